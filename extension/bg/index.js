@@ -33,6 +33,47 @@ async function backend(path, payload) {
   return data;
 }
 
+// ------------------------- DOM delta protocol -------------------------
+// The backend keeps the last snapshot per session; after the first full
+// upload only added / removed / changed controls (keyed by selector) are sent,
+// with added_at[i] = position of added[i] in the page's control list.
+function domKey(c) {
+  return c.selector || `${c.tag||""}|${c.role||""}|${c.name||""}|${c.href||""}`;
+}
+function newDomSession() {
+  return { id: crypto.randomUUID(), prev: null, hash: null };
+}
+function domPayload(sess, controls, full) {
+  const cur = new Map();
+  for (const c of controls || []) cur.set(domKey(c), c);
+  sess.pending = cur;
+  if (full || !sess.prev || !sess.hash) return { session_id: sess.id, dom: controls || [] };
+
+  const added = [], addedAt = [], changed = [], removed = [];
+  let i = 0;
+  for (const [k, c] of cur) {
+    const old = sess.prev.get(k);
+    if (!old) { added.push(c); addedAt.push(i); }
+    else if (JSON.stringify(old) !== JSON.stringify(c)) changed.push(c);
+    i++;
+  }
+  for (const k of sess.prev.keys()) if (!cur.has(k)) removed.push(k);
+  return { session_id: sess.id, dom_delta: { base_hash: sess.hash, added, added_at: addedAt, removed, changed } };
+}
+async function backendWithDom(path, sess, controls, extra) {
+  let data;
+  try {
+    data = await backend(path, { ...extra, ...domPayload(sess, controls, false) });
+  } catch (e) {
+    if (!String(e).includes("HTTP 409")) throw e;
+    // server lost or disagrees with our base snapshot: resync with a full upload
+    data = await backend(path, { ...extra, ...domPayload(sess, controls, true) });
+  }
+  sess.prev = sess.pending;
+  sess.hash = data?.dom_hash || null;
+  return data;
+}
+
 // ----------------------------- tab helpers ----------------------------
 const safeTabId = (sender) => (sender && typeof sender.tab?.id === "number") ? sender.tab.id : null;
 function sendToTab(tabId, msg) {
@@ -105,9 +146,9 @@ async function runAutomation(tabId, prompt) {
     const snap0 = await getSnapshot(tabId);
     stream(tabId, `⚡ <b>Automation:</b> ${escapeHtml(prompt)}`);
 
-    const plan = await backend("/plan", {
+    const domSession = newDomSession();
+    const plan = await backendWithDom("/plan", domSession, snap0?.controls || [], {
       prompt,
-      dom: snap0?.controls || [],
       start_url: snap0?.url || null,
     });
 
@@ -117,6 +158,7 @@ async function runAutomation(tabId, prompt) {
     const executed = [];
     const recent = [];
     let safety = 0;
+    let pageUrl = snap0?.url || "";
 
     while (queue.length && safety < MAX_TOTAL_ACTIONS) {
       let step = queue.shift();
@@ -137,14 +179,22 @@ async function runAutomation(tabId, prompt) {
       const r = await performAction(tabId, step);
       if (!r?.ok) stream(tabId, `❌ action failed: <i>${escapeHtml(r?.error || "unknown")}</i>`, "err");
       else executed.push(step);
+      if ((step.action === "click" || step.action === "type") && (step.selector || step.query)) {
+        // teach the backend which targets work on this site (fire-and-forget)
+        backend("/outcomes", {
+          url: pageUrl,
+          outcomes: [{ selector: step.selector || null, query: step.query || null, via: r?.via || null,
+                       outcome: r?.ok ? "success" : (r?.error === "no-response" ? "timeout" : "not_found") }],
+        }).catch(() => {});
+      }
 
       const snap = await getSnapshot(tabId);
+      pageUrl = snap?.url || pageUrl;
       pushSteps(tabId, executed.concat(queue));
 
       try {
-        const next = await backend("/next", {
+        const next = await backendWithDom("/next", domSession, snap?.controls || [], {
           last_step: step,
-          dom: snap?.controls || [],
           current_url: snap?.url || "",
           prompt,
         });
@@ -157,6 +207,7 @@ async function runAutomation(tabId, prompt) {
       if (step.action === "done") break;
       safety++;
     }
+    backend("/session/end", { session_id: domSession.id }).catch(() => {});
   } finally {
     runningTabs.delete(tabId);
   }
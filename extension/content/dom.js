@@ -268,16 +268,18 @@ export async function performAction(action) {
   try {
     if (!action || !action.action) return { ok: false, error: "invalid action" };
 
+    // { el, via }: via says which target of the step matched ("selector" | "query"),
+    // so the backend credits the one that worked and debits a selector that missed.
     const findTarget = () => {
       if (action.selector) {
         const el = document.querySelector(action.selector);
-        if (el && isVisible(el)) return el;
+        if (el && isVisible(el)) return { el, via: "selector" };
       }
       if (action.query) {
         const el = resolveByQuery(action.query);
-        if (el && isVisible(el)) return el;
+        if (el && isVisible(el)) return { el, via: "query" };
       }
-      return null;
+      return { el: null, via: null };
     };
 
     switch (action.action) {
@@ -289,15 +291,18 @@ export async function performAction(action) {
       }
 
       case ACT.CLICK: {
-        const el = findTarget();
+        const { el, via } = findTarget();
         if (!el) return { ok: false, error: "selector-not-found" };
         el.scrollIntoView({ block: "center", inline: "center" });
         el.click();
-        return { ok: true, didNavigate: false };
+        return { ok: true, didNavigate: false, via };
       }
 
       case ACT.TYPE: {
-        const el = findTarget() || document.activeElement;
+        const found = findTarget();
+        // neither target matched: type into whatever has focus ("active", not a target hit)
+        const via = found.el ? found.via : "active";
+        const el = found.el || document.activeElement;
         if (!el) return { ok: false, error: "selector-not-found" };
 
         el.focus();
@@ -342,7 +347,7 @@ export async function performAction(action) {
           submitNearestSearch(el);
         }
 
-        return { ok: true, didNavigate: false };
+        return { ok: true, didNavigate: false, via };
       }
 
       case ACT.PRESS_ENTER: {
@@ -0,0 +1,390 @@
+"""
+Admission control in front of every model call.
+
+One AdmissionController per worker hands out LLM slots by priority class
+(interactive next step > plan > summarize > batch). The number of slots adapts
+AIMD-style: it grows by one per window of healthy calls made at capacity, and is
+cut multiplicatively on 429s/timeouts or when latency climbs well above the
+observed baseline of the same op (a 6s summary is normal, a 6s plan is not). A call that finds its class queue full, or waits longer than
+its class allows, is rejected at once with Overloaded (503 + Retry-After) instead
+of piling up behind the model. Failed calls are retried with full-jitter backoff,
+but only while the process-wide RetryBudget has tokens, so retries cannot
+multiply the load during an outage.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import math
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, Optional
+
+import metrics
+
+PRIORITIES = ("next", "plan", "summarize", "batch")  # highest first
+
+_DEFAULT_SHARES = {"next": 1.0, "plan": 1.0, "summarize": 0.8, "batch": 0.5}
+_DEFAULT_TIMEOUTS = {"next": 2.0, "plan": 5.0, "summarize": 15.0, "batch": 30.0}
+
+# Set by endpoints (`with admission.priority("next"):`); tasks started inside inherit it.
+_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_priority", default=None)
+
+
+class LLMUnavailable(Exception):
+    """The model could not serve the call (retries exhausted); served as 503 with Retry-After."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"model unavailable ({reason}), retry after {math.ceil(retry_after)}s")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Overloaded(LLMUnavailable):
+    """Shed locally: the priority queue was full or the wait for a slot timed out."""
+
+
+@contextmanager
+def priority(name: str) -> Iterator[None]:
+    if name not in PRIORITIES:
+        raise ValueError(f"unknown priority class: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(op: str) -> str:
+    """Priority set by the endpoint, else derived from the call's op label."""
+    name = _priority.get()
+    if name is not None:
+        return name
+    return "summarize" if op.startswith("summarize") else "plan"
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    # openai.APIStatusError has .status_code; httpx.HTTPStatusError has .response.status_code
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify(exc: BaseException) -> Optional[str]:
+    """Retryable failure kind, or None when retrying cannot help."""
+    if isinstance(exc, LLMUnavailable):
+        return None
+    status = _status(exc)
+    if status == 429:
+        return "rate_limited"
+    if status is not None:
+        return "server" if status >= 500 or status == 408 else None
+    name = type(exc).__name__
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in name:
+        return "timeout"
+    if isinstance(exc, ConnectionError) or "Connect" in name:
+        return "connection"
+    return None
+
+
+def retry_after_hint(exc: BaseException) -> Optional[float]:
+    """Seconds from a Retry-After / retry-after-ms response header, if the error carries one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is None:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms is not None:
+            return float(ms) / 1000.0
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None  # HTTP-date form: fall back to our own backoff
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every call: each first attempt deposits `ratio` tokens,
+    each retry withdraws one, and a `min_per_second` trickle keeps a few retries
+    possible when traffic is low. With ratio=0.2 retries add at most ~20% load.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, cap: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self.tokens = cap
+        self._t = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + (now - self._t) * self.min_per_second)
+        self._t = now
+
+    def deposit(self):
+        self._refill()
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class _Slot:
+    __slots__ = ("priority", "op", "start", "first")
+
+    def __init__(self, priority: str, op: str = "llm"):
+        self.priority = priority
+        self.op = op
+        self.start = time.monotonic()
+        self.first: Optional[float] = None
+
+    def first_item(self):
+        """Streams: the latency sample is the time to the first piece, not the whole stream."""
+        if self.first is None:
+            self.first = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_limit: int = 16,
+        min_limit: int = 1,
+        initial: Optional[int] = None,
+        adaptive: bool = True,
+        queue_max: int = 64,
+        queue_timeouts: Optional[Dict[str, float]] = None,
+        shares: Optional[Dict[str, float]] = None,
+        latency_tolerance: float = 2.0,
+        backoff: float = 0.7,
+        retry_attempts: int = 3,
+        retry_base_delay: float = 0.25,
+        retry_max_delay: float = 8.0,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial or self.max_limit)))
+        self.adaptive = adaptive
+        self.queue_max = queue_max
+        self.queue_timeouts = {**_DEFAULT_TIMEOUTS, **(queue_timeouts or {})}
+        self.shares = {**_DEFAULT_SHARES, **(shares or {})}
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.budget = budget or RetryBudget()
+        self.in_flight = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        self._baselines: Dict[str, float] = {}   # op -> low-percentile latency, tracks an unloaded model
+        self._latency: Optional[float] = None   # EWMA of all latencies, for Retry-After estimates
+        self._last_decrease = 0.0
+        self.counts: Dict[str, int] = {}
+
+    # ---- slots ----
+    def _capacity(self, prio: str) -> int:
+        # lower classes may not take the last slots, so interactive calls always find one
+        return max(1, int(self.limit * self.shares.get(prio, 1.0)))
+
+    def _count(self, what: str, prio: str):
+        self.counts[what] = self.counts.get(what, 0) + 1
+        metrics.inc("llm_admission", result=what, priority=prio)
+
+    def retry_after(self) -> float:
+        """Rough time until a queued call would be served: queued calls / slots x call latency."""
+        queued = sum(len(q) for q in self._queues.values())
+        per_call = self._latency or 1.0
+        return min(30.0, max(1.0, per_call * (queued + 1) / max(1.0, self.limit)))
+
+    async def acquire(self, prio: str, op: str = "llm") -> _Slot:
+        rank = PRIORITIES.index(prio)
+        ahead = any(self._queues[p] for p in PRIORITIES[: rank + 1])
+        if not ahead and self.in_flight < self._capacity(prio):
+            self.in_flight += 1
+            self._count("admitted", prio)
+            return _Slot(prio, op)
+        queue = self._queues[prio]
+        if len(queue) >= self.queue_max:
+            self._count("shed", prio)
+            raise Overloaded("queue_full", self.retry_after())
+        fut = asyncio.get_running_loop().create_future()
+        queue.append(fut)
+        self._count("queued", prio)
+        try:
+            await asyncio.wait_for(fut, self.queue_timeouts.get(prio, 10.0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()  # the slot arrived just as we gave up: hand it on
+            elif fut in queue:
+                queue.remove(fut)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._count("timeout", prio)
+            raise Overloaded("queue_timeout", self.retry_after()) from None
+        return _Slot(prio, op)
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters, highest class first, oldest first within a class."""
+        for prio in PRIORITIES:
+            queue = self._queues[prio]
+            while queue:
+                if self.in_flight >= self._capacity(prio):
+                    return  # lower classes have smaller shares: none of them fits either
+                fut = queue.popleft()
+                if fut.done():
+                    continue
+                self.in_flight += 1
+                fut.set_result(None)
+
+    def release(self, slot: _Slot, exc: Optional[BaseException] = None):
+        latency = (slot.first or time.monotonic()) - slot.start
+        if exc is None:
+            self._on_success(slot.op, latency, self.in_flight >= int(self.limit))
+        else:
+            kind = classify(exc)
+            if kind in ("rate_limited", "timeout"):
+                self._decrease(kind, latency)
+        self._release_slot()
+
+    # ---- AIMD ----
+    def _on_success(self, op: str, latency: float, at_capacity: bool):
+        self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+        baseline = self._baselines.get(op)
+        if baseline is None or latency < baseline:
+            baseline = latency if baseline is None else 0.5 * (baseline + latency)
+        else:
+            baseline += 0.01 * (latency - baseline)  # slow drift: the model may just be slower now
+        self._baselines[op] = baseline
+        if not self.adaptive:
+            return
+        if latency > self.latency_tolerance * baseline:
+            self._decrease("latency", latency)
+        elif at_capacity and self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)  # ~+1 per window of calls
+
+    def _decrease(self, reason: str, latency: float):
+        now = time.monotonic()
+        # one cut per round trip: calls already in flight when the model pushed back carry no new signal
+        if not self.adaptive or now - self._last_decrease < max(latency, 0.05):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        metrics.inc("llm_limit_decrease", reason=reason)
+
+    # ---- calls ----
+    @asynccontextmanager
+    async def slot(self, op: str) -> AsyncIterator[_Slot]:
+        slot = await self.acquire(current_priority(op), op)
+        try:
+            yield slot
+        except BaseException as e:
+            self.release(slot, e)
+            raise
+        self.release(slot)
+
+    def retry_delay(self, exc: BaseException, attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before retrying a failed attempt, None when the error is not
+        retryable. Raises LLMUnavailable once attempts or the retry budget run out.
+        """
+        reason = classify(exc)
+        if reason is None:
+            return None
+        hint = retry_after_hint(exc)
+        if attempt + 1 >= self.retry_attempts or (hint or 0) > self.retry_max_delay:
+            metrics.inc("llm_retry", result="exhausted", reason=reason)
+            raise LLMUnavailable(reason, hint or self.retry_after()) from exc
+        if not self.budget.withdraw():
+            metrics.inc("llm_retry", result="budget", reason=reason)
+            raise LLMUnavailable(reason, hint or self.retry_after()) from exc
+        metrics.inc("llm_retry", result="retried", reason=reason)
+        cap = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return max(hint or 0.0, random.uniform(0.0, cap))  # full jitter, never sooner than the server asked
+
+    async def call(self, op: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn() in a slot of the caller's priority class, retrying retryable failures."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(op):
+                    return await fn()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def stream(self, op: str, open_stream: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield from open_stream() in a slot; retried like call() until the first item arrives."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with self.slot(op) as slot:
+                    async for item in open_stream():
+                        if not started:
+                            started = True
+                            slot.first_item()
+                        yield item
+                return
+            except Exception as e:
+                if started:
+                    raise  # the caller already has part of the output
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": {p: len(q) for p, q in self._queues.items()},
+            "baseline_ms": {op: round(b * 1000, 1) for op, b in sorted(self._baselines.items())},
+            "retry_tokens": round(self.budget.tokens, 2),
+            "events": dict(self.counts),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    """Process-wide controller built from settings (defaults when settings are unavailable)."""
+    global _controller
+    if _controller is None:
+        try:
+            from settings import settings
+        except Exception:
+            settings = None  # benchmarks run without settings
+        if settings is None:
+            _controller = AdmissionController()
+        else:
+            _controller = AdmissionController(
+                max_limit=settings.llm_max_concurrency,
+                min_limit=settings.llm_min_concurrency,
+                adaptive=settings.llm_adaptive_concurrency,
+                queue_max=settings.llm_queue_max,
+                queue_timeouts=settings.llm_queue_timeouts,
+                shares=settings.llm_priority_shares,
+                latency_tolerance=settings.llm_latency_tolerance,
+                retry_attempts=settings.llm_retry_attempts,
+                retry_base_delay=settings.llm_retry_base_delay,
+                retry_max_delay=settings.llm_retry_max_delay,
+                budget=RetryBudget(settings.llm_retry_budget_ratio, settings.llm_retry_min_per_second),
+            )
+    return _controller
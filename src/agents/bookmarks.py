@@ -1,17 +1,17 @@
 
 from typing import Dict, Any
+from bookmark_registry import get_registry
 
 class BookmarksAgent:
     async def run(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        # Example: return canned steps for a named bookmark
-        name = payload.get("name") or ""
-        if name == "create_change_request":
-            return {
-                "name": name,
-                "steps": [
-                    {"action": "click", "query": {"role": "button", "name": "Create"}},
-                    {"action": "click", "query": {"role": "link", "name": "Change Request"}},
-                    {"action": "done"}
-                ]
-            }
-        return {"name": name, "steps": []}
+        """Steps of a registered bookmark, looked up by name or matched from a free-text task."""
+        registry = get_registry()
+        name = payload.get("name") or payload.get("bookmark") or ""
+        if not isinstance(name, str):
+            name = ""
+        if not name and payload.get("task"):
+            kind, matched, _score = registry.route(payload["task"])
+            if kind == "bookmark":
+                name = matched
+        bm = registry.get(name) if name else None
+        return {"name": name, "steps": list(bm["steps"]) if bm else []}
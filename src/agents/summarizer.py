@@ -1,10 +1,169 @@
 # src/agents/summarizer.py
-from typing import Dict, Any
-from llm import build_chat_llm
+import asyncio
+import hashlib
+import zlib
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
+from llm import get_chat_llm, ainvoke_llm, astream_llm
+from settings import settings
+import metrics
+from cache import LRUCache, DiskTier
+from singleflight import SingleFlight
+from masking import MaskVault, new_vault
+
+# identical concurrent summaries (double clicks, several tabs) share one computation
+summary_flight = SingleFlight("summarize")
+
+# requests that mean "just summarize the page" share cache entries
+_GENERIC_TASKS = {"", "summarize", "summarise", "summary", "summarize this page", "summarise this page"}
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 chars per token for English prose; good enough to size chunks
+    return len(text) // 4 + 1
+
+
+def _chunk_text(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into chunks of at most ~max_tokens on line boundaries, hard-splitting
+    any single line that is larger than the budget. Boundaries are content-defined:
+    once a chunk is past half the budget it ends after any line whose hash hits
+    1 in 8, so editing one section only changes the chunk(s) around the edit and
+    the rest keep their exact text (and their chunk-cache entries).
+    """
+    max_chars = max(200, max_tokens * 4)
+    min_chars = max_chars // 2
+    chunks: List[str] = []
+    buf: List[str] = []
+    size = 0
+    for line in text.splitlines():
+        while len(line) > max_chars:
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, size = [], 0
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if size + len(line) + 1 > max_chars and buf:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+        buf.append(line)
+        size += len(line) + 1
+        if size >= min_chars and line.strip() and zlib.crc32(line.encode("utf-8", "replace")) & 7 == 0:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+    if buf:
+        chunks.append("\n".join(buf))
+    return [c for c in chunks if c.strip()]
+
+
+def _page_prompt(title: str, url: str, text: str) -> str:
+    return (
+        f"Summarize the following web page for a busy reader. "
+        f"Use bullets, highlight key facts, and include the page title if present.\n\n"
+        f"TITLE: {title}\nURL: {url}\n\n"
+        f"CONTENT:\n{text}\n\n"
+        "Return concise Markdown."
+    )
+
+
+def _chunk_prompt(title: str, index: int, total: int, text: str) -> str:
+    return (
+        f"This is part {index + 1} of {total} of the web page '{title}'. "
+        "Extract the key facts from this part as short Markdown bullets. "
+        "Do not add an introduction or conclusion.\n\n"
+        f"CONTENT:\n{text}"
+    )
+
+
+def _reduce_prompt(title: str, url: str, partials: List[str]) -> str:
+    joined = "\n\n".join(partials)
+    return (
+        "Merge the following partial summaries of one web page into a single concise "
+        "Markdown summary for a busy reader. Use bullets, remove duplicates, keep key facts "
+        "and include the page title if present.\n\n"
+        f"TITLE: {title}\nURL: {url}\n\n"
+        f"PARTIAL SUMMARIES:\n{joined}"
+    )
+
+
+def _content(resp: Any) -> str:
+    return getattr(resp, "content", str(resp))
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def _hash(*parts: str) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode("utf-8", "replace"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def _summary_key(title: str, url: str, text: str, task: str = "") -> str:
+    """Content address of a summary: normalized title, url (without fragment), text and task."""
+    task = _norm(task).lower()
+    if task in _GENERIC_TASKS:
+        task = ""
+    return _hash("page", _norm(title), (url or "").strip().split("#", 1)[0], _norm(text), task)
+
+
+def _chunk_key(title: str, chunk: str, vault: Optional[MaskVault] = None) -> str:
+    # position-independent, so a chunk that moved (part 3 -> part 4) is still reused.
+    # Keyed on the unmasked text: placeholders depend on the masking key, which is
+    # random per process unless mask_key is set, so masked keys would never hit on disk
+    if vault is not None:
+        title, chunk = vault.unmask(title), vault.unmask(chunk)
+    return _hash("chunk", _norm(title), _norm(chunk))
+
+
+_caches: Optional[Tuple[LRUCache, LRUCache]] = None
+
+
+def get_summary_caches() -> Optional[Tuple[LRUCache, LRUCache]]:
+    """(page summaries, chunk summaries), built lazily from settings; None when disabled."""
+    global _caches
+    if _caches is None and settings.summary_cache_enabled:
+        path = settings.summary_cache_path
+        max_rows = settings.summary_cache_disk_rows
+        _caches = (
+            LRUCache(
+                maxsize=settings.summary_cache_size,
+                ttl=settings.summary_cache_ttl,
+                disk=DiskTier(path, table="summaries", max_rows=max_rows) if path else None,
+            ),
+            LRUCache(
+                maxsize=settings.summary_chunk_cache_size,
+                ttl=settings.summary_cache_ttl,
+                disk=DiskTier(path, table="summary_chunks", max_rows=max_rows) if path else None,
+            ),
+        )
+    return _caches
+
+
+def _cache_get(cache: Optional[LRUCache], key: str, kind: str) -> Optional[str]:
+    if cache is None:
+        return None
+    value = cache.get(key)
+    metrics.inc(kind, result="hit" if value is not None else "miss")
+    return value
+
+
+def _chunk_get(cache: Optional[LRUCache], title: str, chunk: str, vault: Optional[MaskVault]) -> Optional[str]:
+    """Cached (unmasked) summary of a chunk, masked again for the prompts of this request."""
+    hit = _cache_get(cache, _chunk_key(title, chunk, vault), "summary_chunk_cache")
+    return vault.mask(hit) if hit is not None and vault is not None else hit
+
+
+def _chunk_set(cache: Optional[LRUCache], title: str, chunk: str, summary: str, vault: Optional[MaskVault]):
+    if cache is not None:
+        cache.set(_chunk_key(title, chunk, vault), vault.unmask(summary) if vault is not None else summary)
+
 
 class SummarizerAgent:
     async def run(self, context: Dict[str, Any]) -> str:
-        """Summarize page text passed from the extension."""
+        """Summarize page text passed from the extension (served from the summary cache when seen before)."""
         text = (context.get("text") or "").strip()
         title = (context.get("title") or "").strip()
         url = (context.get("url") or "").strip()
@@ -12,14 +171,158 @@ class SummarizerAgent:
         if not text:
             return "No page text was provided to summarize."
 
-        llm = build_chat_llm()
-        prompt = (
-            f"Summarize the following web page for a busy reader. "
-            f"Use bullets, highlight key facts, and include the page title if present.\n\n"
-            f"TITLE: {title}\nURL: {url}\n\n"
-            f"CONTENT:\n{text}\n\n"
-            "Return concise Markdown."
-        )
-        # LangChain's AzureChatOpenAI implements .invoke
-        resp = llm.invoke(prompt)
-        return getattr(resp, "content", str(resp))
\ No newline at end of file
+        key = _summary_key(title, url, text, context.get("task") or "")
+        caches = get_summary_caches()
+        cached = _cache_get(caches[0] if caches else None, key, "summary_cache")
+        if cached is not None:
+            return cached
+        return await summary_flight.do(key, lambda: self._summarize(key, title, url, text))
+
+    async def _summarize(self, key: str, title: str, url: str, text: str) -> str:
+        # the model only sees masked text; cache entries are keyed and stored unmasked
+        vault = new_vault()
+        if vault is not None:
+            title, url, text = vault.mask_many([title, url, text])
+            vault.report()
+        if _estimate_tokens(text) <= settings.summarize_chunk_tokens:
+            # Shared async client: does not block the event loop while the model runs
+            resp = await ainvoke_llm(_page_prompt(title, url, text), get_chat_llm(), op="summarize")
+            summary = _content(resp)
+        else:
+            chunks = _chunk_text(text, settings.summarize_chunk_tokens)
+            metrics.inc("summarize_chunks", len(chunks))
+            partials = await self._map(title, chunks, vault)
+            summary = await self._reduce(title, url, partials)
+        if vault is not None:
+            summary = vault.unmask(summary)
+        caches = get_summary_caches()
+        if caches and summary:
+            caches[0].set(key, summary)
+        return summary
+
+    async def stream(self, context: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Incremental summary events:
+          {"type": "partial", "index", "total", "text"}  one per chunk, in completion order
+          {"type": "delta", "text"}                      tokens of the final summary
+          {"type": "done"}
+        Short pages skip the map phase and stream the single call directly.
+        """
+        text = (context.get("text") or "").strip()
+        title = (context.get("title") or "").strip()
+        url = (context.get("url") or "").strip()
+
+        if not text:
+            yield {"type": "delta", "text": "No page text was provided to summarize."}
+            yield {"type": "done"}
+            return
+
+        key = _summary_key(title, url, text, context.get("task") or "")
+        caches = get_summary_caches()
+        cached = _cache_get(caches[0] if caches else None, key, "summary_cache")
+        if cached is not None:
+            yield {"type": "delta", "text": cached}
+            yield {"type": "done", "cached": True}
+            return
+
+        vault = new_vault()
+        if vault is not None:
+            title, url, text = vault.mask_many([title, url, text])
+            vault.report()
+
+        def unmasked(pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+            return vault.unmask_stream(pieces) if vault is not None else pieces
+
+        llm = get_chat_llm()
+        produced: List[str] = []
+        if _estimate_tokens(text) <= settings.summarize_chunk_tokens:
+            async for piece in unmasked(astream_llm(_page_prompt(title, url, text), llm, op="summarize")):
+                produced.append(piece)
+                yield {"type": "delta", "text": piece}
+            if caches:
+                caches[0].set(key, "".join(produced))
+            yield {"type": "done"}
+            return
+
+        chunks = _chunk_text(text, settings.summarize_chunk_tokens)
+        metrics.inc("summarize_chunks", len(chunks))
+        partials: List[str] = [""] * len(chunks)
+        chunk_cache = caches[1] if caches else None
+
+        async def one(i: int, chunk: str):
+            resp = await ainvoke_llm(_chunk_prompt(title, i, len(chunks), chunk), llm, op="summarize_chunk")
+            summary = _content(resp)
+            _chunk_set(chunk_cache, title, chunk, summary, vault)
+            return i, summary
+
+        pending = []
+        for i, c in enumerate(chunks):
+            hit = _chunk_get(chunk_cache, title, c, vault)
+            if hit is not None:
+                partials[i] = hit
+                text_out = vault.unmask(hit) if vault is not None else hit
+                yield {"type": "partial", "index": i, "total": len(chunks), "text": text_out, "cached": True}
+            else:
+                pending.append((i, c))
+
+        tasks = [asyncio.create_task(one(i, c)) for i, c in pending]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                i, summary = await fut
+                partials[i] = summary
+                text_out = vault.unmask(summary) if vault is not None else summary
+                yield {"type": "partial", "index": i, "total": len(chunks), "text": text_out}
+        finally:
+            for t in tasks:
+                t.cancel()
+
+        partials = await self._collapse(title, partials)
+        async for piece in unmasked(astream_llm(_reduce_prompt(title, url, partials), llm, op="summarize_reduce")):
+            produced.append(piece)
+            yield {"type": "delta", "text": piece}
+        if caches:
+            caches[0].set(key, "".join(produced))
+        yield {"type": "done"}
+
+    async def _map(self, title: str, chunks: List[str], vault: Optional[MaskVault] = None) -> List[str]:
+        """Chunk summaries; chunks already in the chunk cache skip the model."""
+        caches = get_summary_caches()
+        chunk_cache = caches[1] if caches else None
+        partials: List[Optional[str]] = [_chunk_get(chunk_cache, title, c, vault) for c in chunks]
+        missing = [i for i, p in enumerate(partials) if p is None]
+        llm = get_chat_llm()
+        resps = await asyncio.gather(*[
+            ainvoke_llm(_chunk_prompt(title, i, len(chunks), chunks[i]), llm, op="summarize_chunk")
+            for i in missing
+        ])
+        for i, r in zip(missing, resps):
+            partials[i] = _content(r)
+            _chunk_set(chunk_cache, title, chunks[i], partials[i], vault)
+        return partials  # type: ignore[return-value]
+
+    async def _collapse(self, title: str, partials: List[str]) -> List[str]:
+        """
+        Hierarchically merge partial summaries (fan-in groups, concurrently per level)
+        until they fit one reduce call.
+        """
+        llm = get_chat_llm()
+        fanin = max(2, settings.summarize_reduce_fanin)
+        for _ in range(4):  # bounded depth; each level shrinks the set by ~fanin
+            fits = _estimate_tokens("\n\n".join(partials)) <= settings.summarize_chunk_tokens
+            if len(partials) <= 1 or (len(partials) <= fanin and fits):
+                break
+            groups = [partials[i:i + fanin] for i in range(0, len(partials), fanin)]
+            if len(groups) == 1:
+                # a single oversized group: halve it so the next level actually shrinks
+                half = (len(partials) + 1) // 2
+                groups = [partials[:half], partials[half:]]
+            resps = await asyncio.gather(*[
+                ainvoke_llm(_reduce_prompt(title, "", g), llm, op="summarize_reduce") for g in groups
+            ])
+            partials = [_content(r) for r in resps]
+        return partials
+
+    async def _reduce(self, title: str, url: str, partials: List[str]) -> str:
+        partials = await self._collapse(title, partials)
+        resp = await ainvoke_llm(_reduce_prompt(title, url, partials), get_chat_llm(), op="summarize_reduce")
+        return _content(resp)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+from singleflight import SingleFlight
+
+
+class TokenProvider:
+    """
+    Azure AD bearer tokens for the model endpoint, acquired with a certificate
+    credential and cached in memory with their expiry.
+
+    A background task refreshes the token `refresh_margin` seconds before it
+    expires, so requests only ever read the cached value. If a request does find
+    the token missing or expired (first call before start(), refresh failures),
+    the fetch goes through a SingleFlight: concurrent callers share one
+    acquisition instead of each hitting the identity endpoint.
+    """
+
+    def __init__(
+        self,
+        scope: str,
+        tenant_id: str,
+        client_id: str,
+        certificate_path: str,
+        refresh_margin: float = 300.0,
+        retry_interval: float = 10.0,
+    ):
+        self.scope = scope
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.certificate_path = certificate_path
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._credential = None
+        self._token: Optional[str] = None
+        self._expires_on = 0.0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight("token")
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    # ---------------- acquisition ----------------
+    def _get_credential(self):
+        if self._credential is None:
+            # azure.identity is heavy; only bearer-token deployments pay for importing it
+            from azure.identity import CertificateCredential
+            self._credential = CertificateCredential(
+                tenant_id=self.tenant_id,
+                client_id=self.client_id,
+                certificate_path=self.certificate_path,
+            )
+        return self._credential
+
+    def _fetch(self) -> str:
+        """Blocking token request; stores the token and its expiry."""
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                tok = self._get_credential().get_token(self.scope)
+            except Exception:
+                self.failures += 1
+                metrics.inc("token_refresh", result="error")
+                raise
+            self._token, self._expires_on = tok.token, float(tok.expires_on)
+            self.refreshes += 1
+            metrics.inc("token_refresh", result="ok")
+            if metrics.is_enabled():
+                metrics.STAGE_LATENCY.observe(time.perf_counter() - t0, stage="token_fetch")
+            return tok.token
+
+    async def refresh(self) -> str:
+        return await self._flight.do("token", lambda: asyncio.to_thread(self._fetch))
+
+    # ---------------- reads ----------------
+    def _valid(self, margin: float = 0.0) -> bool:
+        return self._token is not None and time.time() < self._expires_on - margin
+
+    async def get_token(self) -> str:
+        if self._valid():
+            return self._token  # type: ignore[return-value]
+        return await self.refresh()
+
+    def get_token_sync(self) -> str:
+        """For the sync HTTP client: cached value, or a blocking fetch if there is none."""
+        if self._valid():
+            return self._token  # type: ignore[return-value]
+        return self._fetch()
+
+    # ---------------- background refresh ----------------
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            if self._valid(self.refresh_margin):
+                delay = self._expires_on - self.refresh_margin - time.time()
+            else:
+                try:
+                    await self.refresh()
+                    delay = self._expires_on - self.refresh_margin - time.time()
+                except Exception:
+                    delay = self.retry_interval
+            await asyncio.sleep(max(self.retry_interval, delay))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": self._token is not None,
+            "expires_in": round(self._expires_on - time.time(), 1) if self._token else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "background": self._task is not None and not self._task.done(),
+        }
+
+
+_provider: Optional[TokenProvider] = None
+
+
+def get_token_provider() -> Optional[TokenProvider]:
+    """Process-wide provider, or None unless scope, tenant, client id and certificate are all set."""
+    global _provider
+    if _provider is None:
+        from settings import settings
+        if not (settings.openai_auth_scope and settings.openai_auth_tenant_id
+                and settings.openai_auth_client_id and settings.pem_file_path):
+            return None
+        _provider = TokenProvider(
+            scope=settings.openai_auth_scope,
+            tenant_id=settings.openai_auth_tenant_id,
+            client_id=settings.openai_auth_client_id,
+            certificate_path=settings.pem_file_path,
+            refresh_margin=settings.token_refresh_margin,
+            retry_interval=settings.token_retry_interval,
+        )
+    return _provider
@@ -0,0 +1,266 @@
+"""
+Offline benchmark suite for the planner pipeline.
+
+Generates synthetic snapshots shaped like extension/content/dom.js output and messy
+LLM completions, then times each stage plus full generate_plan runs against a stub
+model with configurable latency. No network access is needed.
+
+    python bench.py                                   # default sizes
+    python bench.py --sizes 100,5000 --iterations 20
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json --max-regression 0.25
+
+The mask_* rows count megabytes as items, so their ops/s column reads as MB/s;
+record_outcomes rows count outcome reports.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import planner
+from compact_dom import decode_body, decode_compact, encode_compact
+from masking import Masker
+from plan_tools import normalize_plan
+from reliability import ReliabilityIndex
+from selector_index import SelectorIndex
+from tokenizer import load as load_tokenizer
+from traversal_manager import TraversalManager
+
+_WORDS = (
+    "create change request incident problem task approval catalog knowledge article home "
+    "settings profile search filter sort export import save cancel submit delete edit new "
+    "assign group priority state category description notes attachments related history"
+).split()
+_ROLES = [None, None, "button", "link", "textbox", "combobox", "menuitem", "tab", "checkbox"]
+_TAGS = ["a", "button", "input", "div", "span", "select", "textarea", "li"]
+
+
+def synth_dom(n: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Controls with the same keys and selector style as snapshotPage()/cssPath()."""
+    rnd = random.Random(seed)
+    dom = []
+    for i in range(n):
+        tag = rnd.choice(_TAGS)
+        words = " ".join(rnd.sample(_WORDS, rnd.randint(1, 4)))
+        depth = rnd.randint(4, 12)
+        path = " > ".join(
+            f"div.col-{rnd.randint(1, 12)}.sn-{rnd.choice(_WORDS)}:nth-of-type({rnd.randint(1, 9)})"
+            for _ in range(depth)
+        )
+        dom.append({
+            "tag": tag,
+            "text": (words.title() + " " + "·" * rnd.randint(0, 40)).strip(),
+            "role": rnd.choice(_ROLES),
+            "name": words.title(),
+            "href": f"/nav_to.do?uri=%2F{rnd.choice(_WORDS)}.do%3Fsys_id%3D{i:08x}" if tag == "a" else None,
+            "selector": f"{path} > {tag}:nth-of-type({rnd.randint(1, 5)})",
+        })
+    # a couple of realistic anchors deep in the page
+    if n > 10:
+        dom[n // 2] = {"tag": "input", "text": "", "role": "combobox", "name": "Search",
+                       "href": None, "selector": "#sysparm_search"}
+        dom[-3] = {"tag": "button", "text": "Create Change Request", "role": "button",
+                   "name": "Create Change Request", "href": None, "selector": "#create_change"}
+    return dom
+
+
+def synth_page(size: int, seed: int = 11) -> str:
+    """Page text of about `size` characters with an email and a phone number every ~50 lines."""
+    rnd = random.Random(seed)
+    lines: List[str] = []
+    total = 0
+    while total < size:
+        line = " ".join(rnd.choice(_WORDS) for _ in range(12))
+        if len(lines) % 50 == 0:
+            line += f" contact user{len(lines)}@example.com or 555-{rnd.randint(100, 999)}-{rnd.randint(1000, 9999)}"
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+
+def messy_outputs(n_steps: int = 8) -> Dict[str, str]:
+    steps = [{"action": "click", "query": {"role": "button", "name": f"Step {i}"}} for i in range(n_steps)]
+    steps.append({"action": "done"})
+    body = json.dumps({"steps": steps})
+    big = json.dumps({"steps": steps * 200})
+    return {
+        "clean": body,
+        "fenced": f"```json\n{body}\n```",
+        "commentary": f"Sure! Here is the plan you asked for:\n\n{body}\n\nLet me know if you need anything else.",
+        "large": f"Plan:\n```json\n{big}\n```\n" + ("Notes: " + "lorem ipsum " * 2000),
+        "broken": "I could not produce a plan {because the page is empty",
+    }
+
+
+class StubLLM:
+    """Minimal async chat model: fixed latency, canned (fenced) completion."""
+
+    def __init__(self, latency: float, text: str):
+        self.latency = latency
+        self.text = text
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        return type("Resp", (), {"content": self.text, "usage_metadata": None})()
+
+
+def _pct(xs: List[float], p: float) -> float:
+    xs = sorted(xs)
+    if not xs:
+        return 0.0
+    k = min(len(xs) - 1, max(0, int(round(p / 100.0 * (len(xs) - 1)))))
+    return xs[k]
+
+
+def measure(fn: Callable[[], Any], iterations: int, items: int = 1) -> Dict[str, float]:
+    fn()  # warm-up
+    times = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = sum(times) or 1e-12
+    return {
+        "p50_ms": _pct(times, 50) * 1000,
+        "p99_ms": _pct(times, 99) * 1000,
+        "mean_ms": statistics.fmean(times) * 1000,
+        "throughput_per_s": items * iterations / total,
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_suite(sizes: List[int], iterations: int, llm_latency: float) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    goal = "create change request for the payroll database"
+    outputs = messy_outputs()
+
+    for n in sizes:
+        dom = synth_dom(n)
+        results[f"summarize_dom[{n}]"] = measure(lambda: planner._summarize_dom(dom, goal=goal), iterations)
+        results[f"search_hints[{n}]"] = measure(lambda: planner._search_hints(dom), iterations)
+        results[f"build_llm_prompt[{n}]"] = measure(lambda: planner._build_llm_prompt(goal, dom), iterations)
+        wire = json.dumps({"prompt": goal, "dom": dom}).encode("utf-8")
+        compact = json.dumps({"prompt": goal, "dom": encode_compact(dom)}).encode("utf-8")
+        results[f"decode_prompt_json[{n}]"] = measure(
+            lambda: planner._build_llm_prompt(goal, decode_body(wire, "application/json", None)["dom"]), iterations
+        )
+        results[f"decode_prompt_cdom[{n}]"] = measure(
+            lambda: planner._build_llm_prompt(goal, decode_compact(decode_body(compact, "application/json", None)["dom"])),
+            iterations,
+        )
+        targets = [
+            {"action": "click", "query": {"role": "textbox", "name": "Search"}},
+            {"action": "type", "query": {"role": "textbox", "name": dom[n // 2]["name"]}, "text": "x"},
+            {"action": "click", "selector": dom[n // 3]["selector"]},
+            {"action": "click", "query": {"role": "link", "name": "no such control"}},
+        ]
+        results[f"resolve_steps[{n}]"] = measure(lambda: normalize_plan(targets, SelectorIndex(dom)), iterations)
+        outcomes = [
+            {"selector": c["selector"], "outcome": "success" if i % 4 else "not_found"} if i % 2
+            else {"query": {"role": c.get("role") or "", "name": c["name"]}, "outcome": "timeout" if i % 3 else "success"}
+            for i, c in enumerate(dom)
+        ]
+        learned = ReliabilityIndex()
+        results[f"record_outcomes[{n}]"] = measure(lambda: learned.record_many("bench.example.com", outcomes), iterations, items=n)
+        view = learned.view("bench.example.com")
+        results[f"resolve_steps_reliability[{n}]"] = measure(
+            lambda: normalize_plan(targets, SelectorIndex(dom, reliability=view)), iterations
+        )
+        links = [f"https://h{i % 13}.example.com/p/{i}?q={i % 97}#frag" for i in range(n)]
+        results[f"push_links[{n}]"] = measure(
+            lambda: TraversalManager(max_depth=4).push_links("https://example.com/", links, "a.x", 0),
+            iterations,
+            items=n,
+        )
+
+    masker = Masker(dictionary=["Acme Corp", "Project Falcon", "Jane Doe"])
+    for n in sizes:
+        slim = [planner._slim_control(c) for c in synth_dom(n)]
+        mb = sum(len(c[f] or "") for c in slim for f in ("name", "text", "href")) / 1e6
+        results[f"mask_controls[{n}]"] = measure(lambda: masker.vault().mask_controls(slim), iterations, items=mb)
+    page = synth_page(1_000_000)
+    results["mask_page[1MB]"] = measure(lambda: masker.vault().mask(page), iterations, items=len(page) / 1e6)
+
+    for name, text in outputs.items():
+        results[f"safe_json[{name}]"] = measure(lambda: planner._safe_json_from_text(text), iterations)
+
+    raw = json.loads(outputs["clean"])["steps"] * 3
+    results["normalize_plan"] = measure(lambda: normalize_plan(raw), iterations)
+
+    # full pipeline against the stub model (cache bypassed so every run hits the "LLM")
+    stub = StubLLM(llm_latency, outputs["fenced"])
+    original = planner._build_llm
+    planner._build_llm = lambda: stub
+    try:
+        for n in sizes:
+            dom = synth_dom(n)
+            results[f"generate_plan[{n}]"] = measure(
+                lambda: asyncio.run(planner.generate_plan(goal, dom, use_cache=False)), iterations
+            )
+    finally:
+        planner._build_llm = original
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], max_regression: float) -> List[str]:
+    """Return the benchmarks whose p50 got slower than baseline by more than max_regression."""
+    failures = []
+    for name, base in baseline.items():
+        cur = results.get(name)
+        if not cur or base.get("p50_ms", 0) <= 0:
+            continue
+        ratio = cur["p50_ms"] / base["p50_ms"] - 1.0
+        if ratio > max_regression:
+            failures.append(f"{name}: p50 {base['p50_ms']:.3f}ms -> {cur['p50_ms']:.3f}ms (+{ratio:.0%})")
+    return failures
+
+
+def _print(results: Dict[str, Dict[str, float]]):
+    print(f"{'benchmark':32} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>12} {'peak KB':>10}")
+    for name, r in results.items():
+        print(f"{name:32} {r['p50_ms']:10.3f} {r['p99_ms']:10.3f} {r['throughput_per_s']:12.1f} {r['peak_kb']:10.1f}")
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Offline planner pipeline benchmarks")
+    ap.add_argument("--sizes", default="100,1000,10000,50000", help="comma-separated control counts")
+    ap.add_argument("--iterations", type=int, default=10)
+    ap.add_argument("--llm-latency", type=float, default=0.05, help="stub model latency in seconds")
+    ap.add_argument("--save", help="write results to this JSON file")
+    ap.add_argument("--compare", help="baseline JSON file to compare against")
+    ap.add_argument("--max-regression", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    args = ap.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    load_tokenizer(planner._encoding())  # as the server does at startup
+    results = run_suite(sizes, args.iterations, args.llm_latency)
+    _print(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = compare(results, baseline, args.max_regression)
+        if failures:
+            print("\nREGRESSIONS:")
+            for line in failures:
+                print("  " + line)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
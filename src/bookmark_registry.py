@@ -0,0 +1,175 @@
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from intent_index import IntentIndex
+
+# Built-in agent routes, matched by the same index as the bookmarks.
+_AGENT_ROUTES: Dict[str, List[str]] = {
+    "summary": ["summarize", "summarise", "summary", "tldr", "tl dr", "give me the gist"],
+}
+
+# A task that literally asks for a summary is routed to the summarizer before any
+# scoring (as /intent always did): in a long task ("summarize the key points of
+# this incident ticket") the keyword is too small a share of the words to clear
+# intent_min_score.
+_SUMMARY_RE = re.compile(r"\bsummar(?:y|i[sz]\w*)\b|\btl;?\s?dr\b", re.IGNORECASE)
+
+_DEFAULT_BOOKMARKS: List[Dict[str, Any]] = [
+    {
+        "name": "create_change_request",
+        "description": "Open the form for a new change request",
+        "phrases": ["create change request", "new change request", "raise a change", "open a change request"],
+        "steps": [
+            {"action": "click", "query": {"role": "button", "name": "Create"}},
+            {"action": "click", "query": {"role": "link", "name": "Change Request"}},
+            {"action": "done"},
+        ],
+    },
+]
+
+
+def wants_summary(task: str) -> bool:
+    """True for "summarize ...", "summarizing this", "summary of ...", "tl;dr"."""
+    return bool(_SUMMARY_RE.search(task or ""))
+
+
+def _phrases(bm: Dict[str, Any]) -> List[str]:
+    """Trigger phrases of a bookmark; its name ("create_change_request") always counts."""
+    out = [str(p) for p in bm.get("phrases") or [] if p]
+    out.append(str(bm.get("name") or "").replace("_", " ").replace("-", " "))
+    return out
+
+
+class BookmarkRegistry:
+    """
+    Named, pre-wired step lists kept in a JSON file ({"bookmarks": [...]}) and
+    matched against free-text tasks by an IntentIndex.
+
+    The file is re-read when its mtime changes (checked at most every
+    `reload_interval` seconds), so bookmarks can be edited or dropped in without
+    a restart. Each reload builds a fresh index and swaps it in one assignment;
+    readers never see a half-built index. A missing file starts from the
+    built-in defaults and is created on the first save().
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._state: Tuple[Dict[str, Dict[str, Any]], IntentIndex] = self._build(_DEFAULT_BOOKMARKS)
+        self.reloads = 0
+        self._maybe_reload(force=True)
+
+    # ---------------- loading ----------------
+    @staticmethod
+    def _build(items: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], IntentIndex]:
+        by_name: Dict[str, Dict[str, Any]] = {}
+        index = IntentIndex()
+        for key, phrases in _AGENT_ROUTES.items():
+            index.add(("agent", key), phrases)
+        for bm in items:
+            name = str(bm.get("name") or "").strip()
+            if not name or not isinstance(bm.get("steps"), list):
+                continue
+            by_name[name] = bm
+            index.add(("bookmark", name), _phrases(bm))
+        return by_name, index
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def _maybe_reload(self, force: bool = False):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self._mtime:
+            return
+        with self._lock:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return  # keep serving the last good copy
+            items = data.get("bookmarks", []) if isinstance(data, dict) else data
+            self._state = self._build(items if isinstance(items, list) else [])
+            self._mtime = mtime
+            self.reloads += 1
+
+    # ---------------- reads ----------------
+    def names(self) -> List[str]:
+        self._maybe_reload()
+        return sorted(self._state[0])
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        self._maybe_reload()
+        return self._state[0].get(name)
+
+    def route(self, task: str) -> Tuple[str, Optional[str], float]:
+        """
+        (kind, name, score) for a free-text task: kind is "summary" or "bookmark"
+        for the best indexed match, "automation" (name None, score 0) when nothing matched.
+        """
+        self._maybe_reload()
+        hits = self._state[1].match(task, limit=1)
+        if not hits:
+            return "automation", None, 0.0
+        (kind, name), score = hits[0]
+        if kind == "agent":
+            return name, None, score
+        return "bookmark", name, score
+
+    # ---------------- writes ----------------
+    def save(
+        self,
+        name: str,
+        steps: List[Dict[str, Any]],
+        phrases: Optional[List[str]] = None,
+        description: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Add or replace a bookmark and persist the registry (atomic rename)."""
+        name = (name or "").strip()
+        if not name:
+            raise ValueError("bookmark name is required")
+        if not steps:
+            raise ValueError("bookmark needs at least one step")
+        bm = {"name": name, "description": description or "", "phrases": list(phrases or []), "steps": steps}
+        with self._lock:
+            items = dict(self._state[0])
+            items[name] = bm
+            self._state = self._build(list(items.values()))
+            if self.path:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"bookmarks": list(items.values())}, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.path)
+                self._mtime = self._file_mtime()
+        return bm
+
+    def stats(self) -> Dict[str, Any]:
+        by_name, index = self._state
+        return {"bookmarks": len(by_name), "phrases": len(index), "reloads": self.reloads, "path": self.path}
+
+
+_registry: Optional[BookmarkRegistry] = None
+
+
+def get_registry() -> BookmarkRegistry:
+    global _registry
+    if _registry is None:
+        from settings import settings
+        _registry = BookmarkRegistry(settings.bookmarks_path, settings.bookmarks_reload_interval)
+    return _registry
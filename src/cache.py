@@ -0,0 +1,186 @@
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+
+class DiskTier:
+    """
+    Optional SQLite-backed key/value tier. Survives restarts and can be shared
+    by several processes pointing at the same file. Values must be JSON-serializable.
+    With max_rows, every `trim_every` writes drop expired rows and then the rows
+    closest to expiry (i.e. the oldest writes) until the table fits.
+    """
+
+    def __init__(self, path: str, table: str = "cache", max_rows: Optional[int] = None, trim_every: int = 64):
+        self.path = path
+        self.table = table
+        self.max_rows = max_rows
+        self.trim_every = max(1, trim_every)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_expires ON {table}(expires)")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self.delete(key)
+            return None
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        blob = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+                (key, blob, time.time() + ttl),
+            )
+            self._writes += 1
+            due = self.max_rows is not None and self._writes % self.trim_every == 0
+        if due:
+            self.trim()
+
+    def trim(self) -> int:
+        """Enforce max_rows; returns the number of rows removed."""
+        removed = self.purge_expired()
+        if self.max_rows is None:
+            return removed
+        with self._lock:
+            cur = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY expires "
+                f"LIMIT max(0, (SELECT COUNT(*) FROM {self.table}) - ?))",
+                (self.max_rows,),
+            )
+        return removed + (cur.rowcount or 0)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),))
+        return cur.rowcount or 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+
+class LRUCache:
+    """
+    Bounded in-memory LRU with per-entry TTL, hit/miss counters and an optional
+    disk tier consulted on memory misses (and promoted back into memory on hit).
+    A failing disk tier never fails the caller: the lookup is a miss, the write
+    stays memory-only, and the error is counted (disk_errors, last_disk_error).
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 900.0, disk: Optional[DiskTier] = None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self.disk = disk
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_errors = 0
+        self.last_disk_error: Optional[str] = None
+
+    def _disk_error(self, e: Exception):
+        with self._lock:
+            self.disk_errors += 1
+            self.last_disk_error = f"{type(e).__name__}: {e}"
+        metrics.inc("cache_disk_error")
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires >= now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except Exception as e:  # sqlite3 errors, a closed or locked file
+                self._disk_error(e)
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put(key, value, now)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._put(key, value, time.time())
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, self.ttl)
+            except Exception as e:  # unserializable value or sqlite error: memory still has it
+                self._disk_error(e)
+
+    def _put(self, key: str, value: Any, now: float) -> None:
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+            "disk": self.disk.path if self.disk is not None else None,
+            "disk_errors": self.disk_errors,
+            "last_disk_error": self.last_disk_error,
+        }
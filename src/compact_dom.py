@@ -0,0 +1,301 @@
+"""
+Compact snapshot wire format ("cdom") and request/response codecs.
+
+A snapshot is sent column-wise with every string interned once:
+
+    {
+      "format": "cdom", "v": 1, "n": 3,
+      "strings": ["a", "Home", "div.nav > a:nth-of-type(1)", "2)", ...],
+      "cols": {"tag": [0, 0, 5], "role": [-1, -1, 6], "name": [1, 7, 8], ...},
+      "selector_prefix": [0, 25, 0]
+    }
+
+Column values are indexes into `strings` (-1 = null). The selector column is
+front-coded: entry i is prev[:selector_prefix[i]] + strings[cols.selector[i]], where
+prev is the closest earlier non-null selector. That collapses the long shared
+cssPath() prefixes; encoders reset the prefix to 0 every few entries (restart
+points) so one selector can be decoded without walking the whole column.
+All values are plain ints and strings, so the same object works as JSON or msgpack.
+
+Request bodies may be gzip- or zstd-compressed (Content-Encoding) and JSON or
+msgpack (Content-Type). orjson, msgpack and zstandard are used when installed;
+gzip + stdlib json always work.
+"""
+from __future__ import annotations
+import gzip
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+Control = Dict[str, Any]
+
+FORMAT = "cdom"
+COLUMNS = ("tag", "role", "name", "text", "href", "selector")
+
+
+class CompactDom(Sequence):
+    """
+    Read-only, list-like view over a decoded cdom snapshot. Hot paths (ranking,
+    search hints) read whole columns through column()/lower(); indexing builds a
+    single control dict on demand, so only the few hundred controls that end up
+    in the prompt are ever materialized.
+    """
+
+    def __init__(self, strings: List[str], cols: Dict[str, List[int]], n: int, selector_prefix: Optional[List[int]]):
+        self.strings = strings
+        self.cols = cols
+        self.n = n
+        self._prefix = selector_prefix
+        self._columns: Dict[str, List[Optional[str]]] = {}
+        self._lower: Dict[str, List[str]] = {}
+        self._low_strings: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(j) for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return self._row(i)
+
+    def __iter__(self) -> Iterator[Control]:
+        return (self._row(i) for i in range(self.n))
+
+    def _row(self, i: int) -> Control:
+        s = self.strings
+        row: Control = {}
+        for name, col in self.cols.items():
+            if name == "selector" and self._prefix is not None:
+                row[name] = self._selector(i)
+            else:
+                k = col[i]
+                row[name] = s[k] if k >= 0 else None
+        return row
+
+    def _selector(self, i: int) -> Optional[str]:
+        """Decode one front-coded selector by walking back to the nearest restart point."""
+        full = self._columns.get("selector")
+        if full is not None:
+            return full[i]
+        col, prefix, s = self.cols["selector"], self._prefix, self.strings
+        if col[i] < 0:
+            return None
+        chain = []
+        j = i
+        while j >= 0:
+            if col[j] >= 0:
+                chain.append(j)
+                if not prefix[j]:
+                    break
+            j -= 1
+            if len(chain) > 64:
+                return self.column("selector")[i]  # no restart points: decode the column once
+        cur = ""
+        for j in reversed(chain):
+            cur = cur[:prefix[j]] + s[col[j]] if prefix[j] else s[col[j]]
+        return cur
+
+    def column(self, name: str) -> List[Optional[str]]:
+        """All values of one field, in document order (None where missing)."""
+        out = self._columns.get(name)
+        if out is None:
+            col = self.cols.get(name)
+            s = self.strings
+            if col is None:
+                out = [None] * self.n
+            elif name == "selector" and self._prefix is not None:
+                out = []
+                prev = ""
+                for k, p in zip(col, self._prefix):
+                    if k < 0:
+                        out.append(None)
+                        continue
+                    prev = prev[:p] + s[k] if p else s[k]
+                    out.append(prev)
+            else:
+                out = [s[k] if k >= 0 else None for k in col]
+            self._columns[name] = out
+        return out
+
+    def lower(self, name: str) -> List[str]:
+        """Lower-cased column ("" for missing); each distinct string is lowered once."""
+        out = self._lower.get(name)
+        if out is None:
+            if name == "selector":
+                out = [(v or "").lower() for v in self.column(name)]
+            else:
+                if self._low_strings is None:
+                    self._low_strings = [x.lower() for x in self.strings]
+                low = self._low_strings
+                col = self.cols.get(name)
+                out = [low[k] if k >= 0 else "" for k in col] if col is not None else [""] * self.n
+            self._lower[name] = out
+        return out
+
+
+def is_compact(obj: Any) -> bool:
+    return isinstance(obj, dict) and obj.get("format") == FORMAT
+
+
+def _all_ints(col: List[Any]) -> bool:
+    # type() rather than isinstance: True/False are ints too, but not indexes
+    return all(type(v) is int for v in col)
+
+
+def decode_compact(obj: Dict[str, Any]) -> CompactDom:
+    """Validate a cdom object; nothing is expanded until a column or control is read."""
+    if obj.get("v") != 1:
+        raise ValueError(f"unsupported cdom version: {obj.get('v')!r}")
+    strings = obj.get("strings") or []
+    cols = obj.get("cols") or {}
+    n = obj.get("n") or 0
+    if type(n) is not int or n < 0:
+        raise ValueError("cdom n must be a non-negative integer")
+    if not isinstance(strings, list) or not isinstance(cols, dict):
+        raise ValueError("cdom needs a strings list and a cols object")
+    if not all(type(x) is str for x in strings):
+        raise ValueError("cdom strings must all be strings")
+    for name, col in cols.items():
+        if not isinstance(col, list) or len(col) != n:
+            raise ValueError(f"cdom column {name!r} must have {n} entries")
+        if not _all_ints(col):
+            raise ValueError(f"cdom column {name!r} must contain integer string indexes")
+        if col and (max(col) >= len(strings) or min(col) < -1):
+            raise ValueError(f"cdom column {name!r} has a string index out of range")
+    prefix = obj.get("selector_prefix")
+    if prefix is not None and (not isinstance(prefix, list) or len(prefix) != n):
+        raise ValueError("cdom selector_prefix must have n entries")
+    if prefix and (not _all_ints(prefix) or min(prefix) < 0):
+        raise ValueError("cdom selector_prefix must contain non-negative integers")
+    return CompactDom(strings, cols, n, prefix if "selector" in cols else None)
+
+
+def encode_compact(dom: Sequence[Control], columns: Sequence[str] = COLUMNS, restart: int = 16) -> Dict[str, Any]:
+    """Inverse of decode_compact (used by clients and benchmarks); a selector restart point every `restart` entries."""
+    index: Dict[str, int] = {}
+    strings: List[str] = []
+
+    def intern(v: Any) -> int:
+        if v is None:
+            return -1
+        v = str(v)
+        k = index.get(v)
+        if k is None:
+            k = index[v] = len(strings)
+            strings.append(v)
+        return k
+
+    cols: Dict[str, List[int]] = {name: [] for name in columns}
+    prefix: List[int] = []
+    prev = ""
+    for c in dom:
+        for name in columns:
+            if name == "selector":
+                continue
+            cols[name].append(intern(c.get(name)))
+        if "selector" in cols:
+            sel = c.get("selector")
+            if sel is None:
+                cols["selector"].append(-1)
+                prefix.append(0)
+                continue
+            sel = str(sel)
+            p = 0
+            limit = min(len(prev), len(sel)) if len(prefix) % restart else 0
+            while p < limit and prev[p] == sel[p]:
+                p += 1
+            cols["selector"].append(intern(sel[p:]))
+            prefix.append(p)
+            prev = sel
+    out: Dict[str, Any] = {"format": FORMAT, "v": 1, "n": len(dom), "strings": strings, "cols": cols}
+    if "selector" in cols:
+        out["selector_prefix"] = prefix
+    return out
+
+
+# ---------------- body codecs ----------------
+MAX_DECOMPRESSED = 256 * 1024 * 1024  # a small compressed body must not expand into gigabytes
+
+
+def _read_capped(f) -> bytes:
+    chunks, size = [], 0
+    while True:
+        chunk = f.read(1 << 20)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > MAX_DECOMPRESSED:
+            raise ValueError(f"decompressed body exceeds {MAX_DECOMPRESSED >> 20} MB")
+        chunks.append(chunk)
+
+
+def decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """Decode a compressed body in 1 MB steps, stopping at MAX_DECOMPRESSED."""
+    enc = (content_encoding or "").strip().lower()
+    if not enc or enc == "identity":
+        return body
+    if enc in ("gzip", "x-gzip"):
+        with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+            return _read_capped(f)
+    if enc == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd bodies need the zstandard package")
+        # streamed: a frame header declaring a huge content size is not trusted either
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as f:
+            return _read_capped(f)
+    raise ValueError(f"unsupported Content-Encoding: {content_encoding}")
+
+
+def loads(body: bytes, content_type: Optional[str] = None) -> Any:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    if ctype in ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack"):
+        if msgpack is None:
+            raise ValueError("msgpack bodies need the msgpack package")
+        return msgpack.unpackb(body, raw=False)
+    if not body:
+        return {}
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Fast JSON encoding (orjson when installed); non-ASCII stays UTF-8, like ensure_ascii=False.
+    int/float/bool dict keys (stats keyed by depth, ...) become strings in both paths.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def decode_body(body: bytes, content_type: Optional[str], content_encoding: Optional[str]) -> Dict[str, Any]:
+    """Request payload from a raw body; raises ValueError on anything malformed."""
+    try:
+        data = loads(decompress(body, content_encoding), content_type)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"could not decode request body: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("request body must be an object")
+    return data
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import math
+import re
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Function words only: verbs like "create", "open" or "search" are what tells intents apart.
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "to", "of", "in", "on", "for", "with", "at", "by", "from",
+    "is", "it", "this", "that", "me", "my", "i", "please", "can", "you", "page", "new",
+}
+
+
+def intent_terms(text: str) -> List[str]:
+    """Lower-cased, de-duplicated, lightly stemmed ("requests" -> "request") content words."""
+    out: List[str] = []
+    for t in _TOKEN_RE.findall((text or "").lower()):
+        if len(t) < 2 or t in _STOPWORDS:
+            continue
+        if len(t) > 3 and t.endswith("s") and not t.endswith("ss"):
+            t = t[:-1]
+        if t not in out:
+            out.append(t)
+    return out
+
+
+class IntentIndex:
+    """
+    Inverted index from terms to trigger phrases. A lookup only touches the
+    postings of the task's own terms, so it stays sub-millisecond with thousands
+    of phrases. Terms are visited rarest first and very common terms (more than
+    `common_df` phrases) only add weight to candidates a rarer term already found,
+    so a generic word like "create" never fans out over the whole registry.
+    A phrase scores
+        phrase_coverage * (0.5 + 0.5 * task_coverage)
+    with both coverages IDF-weighted: every phrase term must appear in the task
+    for a full score, and extra task words ("... for the payroll db") lower it.
+    """
+
+    def __init__(self, common_df: int = 256):
+        self.common_df = common_df
+        self._phrases: List[Tuple[Hashable, Tuple[str, ...]]] = []
+        self._postings: Dict[str, Set[int]] = {}
+        self._idf: Dict[str, float] = {}
+        self._norms: List[float] = []
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._phrases)
+
+    def add(self, key: Hashable, phrases: Iterable[str]):
+        for phrase in phrases:
+            terms = tuple(intent_terms(phrase))
+            if not terms:
+                continue
+            pid = len(self._phrases)
+            self._phrases.append((key, terms))
+            for t in terms:
+                self._postings.setdefault(t, set()).add(pid)
+        self._dirty = True
+
+    def _reweigh(self):
+        n = max(1, len(self._phrases))
+        self._idf = {t: math.log(1.0 + n / len(p)) for t, p in self._postings.items()}
+        self._norms = [sum(self._idf[t] for t in terms) for _, terms in self._phrases]
+        self._dirty = False
+
+    def match(self, text: str, limit: int = 3) -> List[Tuple[Hashable, float]]:
+        """Best (key, score) pairs for the task, highest first, one entry per key."""
+        if self._dirty:
+            self._reweigh()
+        terms = intent_terms(text)
+        if not terms or not self._phrases:
+            return []
+        unknown = math.log(1.0 + len(self._phrases))
+        task_norm = sum(self._idf.get(t, unknown) for t in terms)
+        hits: Dict[int, float] = {}
+        for t in sorted((t for t in terms if t in self._postings), key=lambda t: len(self._postings[t])):
+            w = self._idf[t]
+            postings = self._postings[t]
+            if hits and len(postings) > self.common_df:
+                for pid in hits:
+                    if pid in postings:
+                        hits[pid] += w
+                continue
+            for pid in postings:
+                hits[pid] = hits.get(pid, 0.0) + w
+        best: Dict[Hashable, float] = {}
+        seen: Set[Hashable] = set()
+        for pid, w in hits.items():
+            key = self._phrases[pid][0]
+            score = (w / self._norms[pid]) * (0.5 + 0.5 * w / task_norm)
+            if key not in seen or score > best[key]:
+                best[key] = score
+                seen.add(key)
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        return ranked[:max(1, limit)]
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, List, Optional
+
+
+class StepStreamParser:
+    """
+    Incremental parser for a streamed {"steps": [ {...}, {...} ]} completion.
+    feed() scans only the newly arrived characters (tracking string/escape state
+    and nesting depth) and returns every step object that became complete, so the
+    total work is linear in the completion length. Leading prose or ``` fences are
+    skipped because scanning only starts at the first '{'. Consumed text is dropped,
+    so the buffer never holds more than the step currently being received.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._str_start = -1
+        self._last_key: Optional[str] = None
+        self._in_steps = False      # inside the top-level "steps" array
+        self._saw_steps = False
+        self._step_start = -1
+        self.done = False           # the top-level object closed
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        if self.done or not chunk:
+            return out
+        self._text += chunk
+        text = self._text
+        i = self._pos
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._depth == 1:
+                        self._last_key = text[self._str_start + 1:i]
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+            elif ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                if self._depth == 1 and ch == "[" and self._last_key == "steps":
+                    self._in_steps = self._saw_steps = True
+                elif self._depth == 2 and self._in_steps and ch == "{":
+                    self._step_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._in_steps and ch == "}" and self._step_start >= 0:
+                    try:
+                        step = json.loads(text[self._step_start:i + 1])
+                        if isinstance(step, dict):
+                            out.append(step)
+                    except ValueError:
+                        pass
+                    self._step_start = -1
+                elif self._depth == 1 and self._in_steps:
+                    self._in_steps = False
+                elif self._depth == 0:
+                    if self._saw_steps:
+                        self.done = True
+                        i += 1
+                        break
+                    # a stray {...} in the preamble: keep looking for the plan object
+                    self._last_key = None
+            i += 1
+        self._pos = i
+        self._trim()
+        return out
+
+    def _trim(self):
+        keep = self._pos
+        if self._step_start >= 0:
+            keep = min(keep, self._step_start)
+        if self._in_str:
+            keep = min(keep, self._str_start)
+        if keep > 0:
+            self._text = self._text[keep:]
+            self._pos -= keep
+            if self._step_start >= 0:
+                self._step_start -= keep
+            self._str_start -= keep
+
+
+def first_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the first balanced top-level {...} in text that parses as JSON.
+    Single forward scan with string awareness (no greedy regex, no rescans):
+    each balanced candidate is tried once and scanning resumes after it.
+    """
+    depth = 0
+    start = -1
+    in_str = esc = False
+    for i, ch in enumerate(text):
+        if depth == 0:
+            if ch == "{":
+                depth, start = 1, i
+            continue
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                try:
+                    data = json.loads(text[start:i + 1])
+                    if isinstance(data, dict):
+                        return data
+                except ValueError:
+                    pass
+    return None
@@ -1,13 +1,81 @@
-import certifi
-import ssl
-import httpx
-from typing import Optional
+from __future__ import annotations
+import asyncio
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional
 from settings import settings
+from admission import get_admission
+import metrics
+
+# httpx, certifi/ssl and langchain_openai are imported on first use, not at import
+# time: langchain alone costs more than the rest of the app to import, and the
+# health endpoint, frontier and cache work fine without it.
+if TYPE_CHECKING:
+    import ssl
+    import httpx
+
+# Process-wide client state: built once, reused by every request.
+_ssl_context: Optional["ssl.SSLContext"] = None
+_http_client: Optional["httpx.Client"] = None
+_http_async_client: Optional["httpx.AsyncClient"] = None
+_shared_llm = None
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+    if _ssl_context is None:
+        import certifi
+        import ssl
+        _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+def _timeout() -> httpx.Timeout:
+    import httpx
+    return httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout)
+
+
+def _limits() -> httpx.Limits:
+    import httpx
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive,
+    )
+
+
+def _token_hooks() -> tuple[dict, dict]:
+    """
+    httpx request hooks that stamp the cached Azure AD bearer token on every model
+    call, so refreshed tokens are picked up without rebuilding the client.
+    Empty when a subscription key is used or no certificate credential is configured.
+    """
+    from auth import get_token_provider
+    provider = None if settings.openapi_subscription_key else get_token_provider()
+    if provider is None:
+        return {}, {}
+
+    def sync_hook(request):
+        request.headers["Authorization"] = f"Bearer {provider.get_token_sync()}"
+
+    async def async_hook(request):
+        request.headers["Authorization"] = f"Bearer {await provider.get_token()}"
+
+    return {"request": [sync_hook]}, {"request": [async_hook]}
+
+
+def get_http_clients() -> tuple[httpx.Client, httpx.AsyncClient]:
+    """Shared keep-alive pools (sync + async) with a single SSL context."""
+    global _http_client, _http_async_client
+    import httpx
+    sync_hooks, async_hooks = _token_hooks()
+    if _http_client is None:
+        _http_client = httpx.Client(
+            verify=_get_ssl_context(), limits=_limits(), timeout=_timeout(), event_hooks=sync_hooks
+        )
+    if _http_async_client is None:
+        _http_async_client = httpx.AsyncClient(
+            verify=_get_ssl_context(), limits=_limits(), timeout=_timeout(), event_hooks=async_hooks
+        )
+    return _http_client, _http_async_client
 
-try:
-    from langchain_openai import ChatOpenAI
-except Exception:
-    AzureChatOpenAI = None
 
 def build_chat_llm(
     azure_token: Optional[str] = None,
@@ -15,12 +83,17 @@ def build_chat_llm(
     model_api_version: Optional[str] = None,
     deployment_name: Optional[str] = None,
     openai_api_key: Optional[str] = None,
+    http_client: Optional[httpx.Client] = None,
+    http_async_client: Optional[httpx.AsyncClient] = None,
 ):
+    try:
+        from langchain_openai import ChatOpenAI
+    except Exception:
+        raise RuntimeError("langchain_openai is not installed")
 
-
-    ca_certs = certifi.where()
-    ssl_context = ssl.create_default_context(cafile=ca_certs)
-    http_client = httpx.Client(verify=ssl_context)
+    from auth import get_token_provider
+    if http_client is None or http_async_client is None:
+        http_client, http_async_client = get_http_clients()
     # --- Decide which authentication method to use ---
     if settings.openapi_subscription_key:
         # Use API Key in header
@@ -32,7 +105,7 @@ def build_chat_llm(
         default_headers = None
 
     # return AzureChatOpenAI(
-      
+
     #     openai_api_version=model_api_version or settings.openai_api_version,
     #     deployment_name=deployment_name or settings.openai_deployment,
     #     openai_api_key=openai_api_key or settings.openai_api_key or "unused",
@@ -42,8 +115,89 @@ def build_chat_llm(
     #     http_client=http_client,
     #     default_headers=default_headers,
     # )
+    api_key = openai_api_key or settings.openapi_subscription_key
+    if api_key is None and (azure_token or get_token_provider() is not None):
+        api_key = "azure-ad"  # required by the client; the Authorization header carries the AD token
     return ChatOpenAI(
     model=settings.model_name,
-    openai_api_key=settings.openapi_subscription_key,  # your OpenAI key
-    temperature=0
+    openai_api_key=api_key,  # your OpenAI key
+    base_url=settings.openai_model_url,  # None = api.openai.com; point at stub_llm.py for load tests
+    temperature=0,
+    timeout=settings.llm_timeout,
+    max_retries=0,  # retries go through the admission controller's budget
+    default_headers=default_headers,
+    http_client=http_client,
+    http_async_client=http_async_client,
 )
+
+
+def get_chat_llm():
+    """Process-wide chat model, created on first use."""
+    global _shared_llm
+    if _shared_llm is None:
+        _shared_llm = build_chat_llm()
+    return _shared_llm
+
+
+def _approx_tokens(obj: Any) -> int:
+    if isinstance(obj, list):
+        return sum(_approx_tokens(m.get("content", "") if isinstance(m, dict) else m) for m in obj)
+    return len(str(obj or "")) // 4 + 1
+
+
+def _record_usage(op: str, messages: Any, resp: Any):
+    if not metrics.is_enabled():
+        return
+    usage = getattr(resp, "usage_metadata", None) or {}
+    prompt = usage.get("input_tokens") or _approx_tokens(messages)
+    completion = usage.get("output_tokens") or _approx_tokens(getattr(resp, "content", resp))
+    metrics.observe_tokens(op, prompt, completion)
+
+
+async def ainvoke_llm(messages: Any, llm=None, op: str = "llm") -> Any:
+    """
+    Non-blocking LLM call on the shared async pool, admitted by priority under the
+    adaptive concurrency limit, bounded by `llm_timeout` and retried within the
+    retry budget. Raises admission.LLMUnavailable when it cannot be served.
+    """
+    llm = llm or get_chat_llm()
+
+    async def call():
+        with metrics.llm_call(op):
+            return await asyncio.wait_for(llm.ainvoke(messages), timeout=settings.llm_timeout)
+
+    resp = await get_admission().call(op, call)
+    _record_usage(op, messages, resp)
+    return resp
+
+
+async def aclose_llm() -> None:
+    """Release pooled connections (call on shutdown)."""
+    global _http_client, _http_async_client, _shared_llm
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+    if _http_client is not None:
+        _http_client.close()
+    _http_client = _http_async_client = _shared_llm = None
+
+
+async def astream_llm(messages: Any, llm=None, op: str = "llm") -> AsyncIterator[str]:
+    """
+    Stream completion text from the shared client as it is generated.
+    Holds one admission slot for the lifetime of the stream; failures before the
+    first piece are retried like ainvoke_llm.
+    """
+    llm = llm or get_chat_llm()
+    produced = []
+
+    async def pieces():
+        with metrics.llm_call(op):
+            async for chunk in llm.astream(messages):
+                text = getattr(chunk, "content", None)
+                if text:
+                    yield text
+
+    async for text in get_admission().stream(op, pieces):
+        produced.append(text)
+        yield text
+    _record_usage(op, messages, "".join(produced))
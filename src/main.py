@@ -1,18 +1,135 @@
+import time
+_IMPORT_T0 = time.perf_counter()
 
-import uvicorn
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Any, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+from urllib.parse import urljoin
 from settings import settings
-from persistence import init_db, upsert_node
-from planner import generate_plan
+from persistence import init_db, close_db, get_store, sqlite_path, upsert_node, upsert_edge
+from planner import generate_plan, stream_plan, get_plan_cache, plan_flight, _plan_cache_key
+from plan_tools import normalize_plan
 from models import PlanModel
-from traversal_manager import TraversalManager
+from bookmark_registry import get_registry, wants_summary
+from auth import get_token_provider
+from traversal_manager import TraversalRegistry
+from snapshot_store import SnapshotStore, SqliteSnapshotStore, ResyncRequired
+from compact_dom import decode_body, decode_compact, dumps, is_compact
 from agents.automation import AutomationAgent
-from agents.summarizer import SummarizerAgent
+from agents.summarizer import SummarizerAgent, summary_flight, get_summary_caches, _summary_key
 from agents.bookmarks import BookmarksAgent
+from admission import LLMUnavailable, get_admission, priority
+from reliability import get_reliability
+from utils import url_host
+from tokenizer import backend as tokenizer_backend, load as load_tokenizer
+import metrics
 
-app = FastAPI(title="Commet Assistant Universal")
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_T0
+log = logging.getLogger("commet")
+_startup_seconds: float | None = None
+
+traversals: TraversalRegistry | None = None
+snapshots: SnapshotStore | SqliteSnapshotStore | None = None
+
+
+def _frontier_db_path() -> str | None:
+    """SQLite path for the crawl frontier, or None for the in-process one."""
+    backend = (settings.frontier_backend or "auto").lower()
+    if backend == "memory" or (backend == "auto" and settings.workers <= 1):
+        return None
+    return settings.frontier_db_path or sqlite_path(settings.sqlite_url)
+
+
+def _snapshot_db_path() -> str | None:
+    """SQLite path for delta snapshots, or None for the in-process store."""
+    backend = (settings.snapshot_backend or "auto").lower()
+    if backend == "memory" or (backend == "auto" and settings.workers <= 1):
+        return None
+    return settings.snapshot_db_path or sqlite_path(settings.sqlite_url)
+
+
+def _reliability_path() -> str:
+    return settings.reliability_snapshot_path or sqlite_path(settings.sqlite_url)
+
+
+async def _load_tokenizer():
+    """Load the prompt tokenizer off the event loop (it may download); prompts are estimated until then."""
+    name = settings.prompt_tokenizer
+    active = await asyncio.to_thread(load_tokenizer, name)
+    if active == "estimate":
+        log.warning("tiktoken encoding %s unavailable; prompt budgets use the offline estimate", name)
+    else:
+        log.info("prompt tokenizer: %s", active)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Per-worker startup/shutdown. Nothing touches the disk or the network at import
+    time, so `import main` stays cheap and every pre-forked worker opens its own
+    connections. With several workers the crawl frontier and the delta snapshots
+    are SQLite-backed, so they all share one queue and agree on every session's
+    base hash (see frontier_backend / snapshot_backend).
+    """
+    global traversals, snapshots, _startup_seconds
+    t0 = time.perf_counter()
+    init_db()
+    traversals = TraversalRegistry(
+        max_depth=settings.frontier_max_depth,
+        max_size=settings.frontier_max_size,
+        max_sessions=settings.frontier_max_sessions,
+        db_path=_frontier_db_path(),
+        max_seen=settings.frontier_max_seen,
+    )
+    snapshot_path = _snapshot_db_path()
+    if snapshot_path:
+        snapshots = SqliteSnapshotStore(snapshot_path, settings.snapshot_sessions_max, settings.snapshot_session_ttl)
+    else:
+        snapshots = SnapshotStore(max_sessions=settings.snapshot_sessions_max, ttl=settings.snapshot_session_ttl)
+    tokens = get_token_provider()
+    if tokens is not None:
+        tokens.start()  # first token is fetched in the background, not by the first request
+    tokenizer_task = asyncio.create_task(_load_tokenizer())
+    reliability = get_reliability()
+    if reliability is not None:
+        try:
+            reliability.load(_reliability_path())
+        except Exception:
+            # start empty; outcomes will rebuild it
+            log.warning("could not load reliability snapshot from %s", _reliability_path(), exc_info=True)
+        reliability.start(_reliability_path(), settings.reliability_snapshot_interval)
+    _startup_seconds = time.perf_counter() - t0
+    try:
+        yield
+    finally:
+        tokenizer_task.cancel()
+        if tokens is not None:
+            await tokens.stop()
+        if reliability is not None:
+            await reliability.stop(_reliability_path())  # final snapshot of what changed
+        try:
+            from llm import aclose_llm
+            await aclose_llm()
+        except Exception:
+            log.warning("closing the LLM client failed", exc_info=True)
+        traversals.close()
+        snapshots.close()
+        close_db()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON responses through compact_dom.dumps (orjson when installed)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+app = FastAPI(title="Commet Assistant Universal", lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.allow_origins,
@@ -21,63 +138,496 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-init_db()
-traversal = TraversalManager(max_depth=4)
+metrics.configure(settings.metrics_enabled)
+
+@app.middleware("http")
+async def _timing_middleware(request: Request, call_next):
+    if not metrics.is_enabled():
+        return await call_next(request)
+    token = metrics.start_request()
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        total = time.perf_counter() - t0
+        # label by route template, not the raw path: ids in paths and 404 probes would make series unbounded
+        route = request.scope.get("route")
+        timings = metrics.end_request(token, getattr(route, "path", None) or "unmatched", total)
+    if settings.metrics_timing_headers:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, total)
+    return response
+
+@app.exception_handler(LLMUnavailable)
+async def _llm_unavailable(_request: Request, exc: LLMUnavailable):
+    """Shed or exhausted model calls: 503 with a Retry-After the client can honour."""
+    return FastJSONResponse(
+        {"detail": str(exc), "reason": exc.reason, "retry_after": exc.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.get("/health")
+async def health():
+    return {
+        "ok": True,
+        "pid": os.getpid(),
+        "import_ms": round(_IMPORT_SECONDS * 1000, 1),
+        "startup_ms": round(_startup_seconds * 1000, 1) if _startup_seconds is not None else None,
+        "frontier": "sqlite" if _frontier_db_path() else "memory",
+        "snapshots": "sqlite" if _snapshot_db_path() else "memory",
+        "tokenizer": tokenizer_backend(settings.prompt_tokenizer),
+        "auth": tokens.stats() if (tokens := get_token_provider()) is not None else None,
+        "graph": store.stats() if (store := get_store()) is not None else None,
+        "llm": get_admission().stats(),
+    }
 
 @app.post("/intent")
 async def intent(payload: Dict[str, Any]):
     task = payload.get("task", "") or ""
     context = payload.get("context", {}) or {}
-    if "summary" in task.lower() or "summarize" in task.lower():
+    # literal summary requests win over an explicit bookmark payload, as they always have
+    if wants_summary(task):
         agent = SummarizerAgent()
         return {"type": "summary", "result": await agent.run(context)}
-    elif "bookmark" in payload:
+    if "bookmark" in payload:
         agent = BookmarksAgent()
         return {"type": "bookmark", "result": await agent.run(payload)}
+    kind, name, score = get_registry().route(task)
+    if score >= settings.intent_min_score:
+        if kind == "summary":
+            agent = SummarizerAgent()
+            return {"type": "summary", "result": await agent.run(context)}
+        if kind == "bookmark":
+            agent = BookmarksAgent()
+            return {"type": "bookmark", "result": await agent.run({"name": name}), "score": round(score, 3)}
+    agent = AutomationAgent()
+    return {"type": "automation", "result": await agent.run({"task":task,"dom":context.get("controls",[])})}
+
+async def _read_payload(request: Request) -> Dict[str, Any]:
+    """
+    Request body as a dict: JSON or msgpack (Content-Type), optionally gzip/zstd
+    compressed (Content-Encoding). Plain JSON bodies behave exactly as before.
+    """
+    try:
+        return decode_body(
+            await request.body(),
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _wire_dom(dom: Any):
+    """A `dom` field as sent: a list of controls, or a columnar cdom object (see compact_dom)."""
+    if is_compact(dom):
+        try:
+            return decode_compact(dom)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return dom if dom is not None else []
+
+async def _on_snapshots(fn: Callable[[], Any]) -> Any:
+    """Run snapshot store calls inline, or in a thread when the store blocks on SQLite."""
+    return await asyncio.to_thread(fn) if snapshots.blocking else fn()
+
+async def _resolve_dom(payload: Dict[str, Any]):
+    """
+    Return (dom, dom_hash). With a session_id, a full `dom` replaces the stored
+    snapshot and a `dom_delta` {base_hash, added, added_at?, removed, changed} is merged into it.
+    A stale or unknown base_hash answers 409 so the client resends the full snapshot.
+    """
+    session_id = payload.get("session_id")
+    if not session_id:
+        return _wire_dom(payload.get("dom", [])), None
+    delta = payload.get("dom_delta")
+    if delta is not None and "dom" not in payload:
+        try:
+            snap = await _on_snapshots(lambda: snapshots.apply_delta(session_id, delta))
+        except ResyncRequired:
+            raise HTTPException(status_code=409, detail={"resync": True, "session_id": session_id})
     else:
-        agent = AutomationAgent()
-        return {"type": "automation", "result": await agent.run({"task":task,"dom":context.get("controls",[])})}
+        dom = _wire_dom(payload.get("dom", []))
+        snap = await _on_snapshots(lambda: snapshots.put_full(session_id, dom))
+    return snap.dom(), snap.hash
+
+def _plan_response(plan, dom_hash):
+    out = plan.model_dump()
+    if dom_hash is not None:
+        out["dom_hash"] = dom_hash
+    return out
+
+def _bookmark_plan(prompt: str) -> PlanModel | None:
+    """A registered bookmark that matches the whole prompt closely enough to skip the planner."""
+    if settings.bookmark_plan_min_score <= 0:
+        return None
+    kind, name, score = get_registry().route(prompt)
+    if kind != "bookmark" or score < settings.bookmark_plan_min_score:
+        return None
+    bm = get_registry().get(name)
+    if not bm:
+        return None
+    return PlanModel(steps=bm["steps"], meta={"path": "bookmark", "bookmark": name, "score": round(score, 3)})
+
+def _history(payload: Dict[str, Any]) -> List[Dict[str, Any]] | None:
+    """Executed steps for the prompt: `history` when sent, else just `last_step` (what /next gets today)."""
+    history = payload.get("history")
+    if isinstance(history, list):
+        return [s for s in history if isinstance(s, dict)] or None
+    last = payload.get("last_step")
+    return [last] if isinstance(last, dict) else None
+
+def _host(payload: Dict[str, Any]) -> str | None:
+    """Site the plan runs on: `host`, else the host of current_url / url / start_url."""
+    if payload.get("host"):
+        return str(payload["host"]).lower()
+    url = payload.get("current_url") or payload.get("url") or payload.get("start_url")
+    if not isinstance(url, str):
+        return None
+    return url_host(url) or None
 
 @app.post("/plan")
-async def plan_endpoint(payload: Dict[str, Any]):
+async def plan_endpoint(request: Request):
+    payload = await _read_payload(request)
     prompt = payload.get("prompt", "")
-    dom = payload.get("dom", [])
+    dom, dom_hash = await _resolve_dom(payload)
     start_url = payload.get("start_url")
     if start_url:
-        traversal.seed(start_url)
+        await _on_frontier(payload.get("session_id"), lambda traversal: traversal.seed(start_url))
         upsert_node(url=start_url, title=None, origin=None)
-    plan = await generate_plan(prompt, dom)
-    return plan.model_dump()
+    plan = _bookmark_plan(prompt) if payload.get("bookmarks", True) is not False else None
+    if plan is None:
+        plan = await generate_plan(
+            prompt,
+            dom,
+            use_cache=payload.get("cache", True) is not False,
+            deadline_ms=payload.get("deadline_ms"),
+            hedge=payload.get("hedge"),
+            history=_history(payload),
+            host=_host(payload),
+        )
+    save_as = payload.get("save_as")
+    if save_as and plan.steps and (plan.meta or {}).get("path") != "bookmark":
+        get_registry().save(
+            save_as,
+            [s.model_dump(exclude_none=True) for s in plan.steps],
+            phrases=[prompt],
+            description=prompt,
+        )
+    return _plan_response(plan, dom_hash)
+
+@app.post("/plan/stream")
+async def plan_stream_endpoint(request: Request):
+    """NDJSON: one {"step": ...} line per plan step as the model produces it, then {"done": true, ...}."""
+    payload = await _read_payload(request)
+    prompt = payload.get("prompt", "")
+    dom, dom_hash = await _resolve_dom(payload)
+    use_cache = payload.get("cache", True) is not False
+
+    async def lines():
+        async for item in stream_plan(prompt, dom, use_cache=use_cache, history=_history(payload), host=_host(payload)):
+            if item.get("done") and dom_hash is not None:
+                item["dom_hash"] = dom_hash
+            yield dumps(item) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def _run_batch(
+    items: List[Any],
+    key_fn: Callable[[Dict[str, Any]], Awaitable[str]],
+    run_fn: Callable[[Dict[str, Any]], Awaitable[Any]],
+) -> AsyncIterator[bytes]:
+    """
+    NDJSON lines for a batch: identical items (same key) run once and every copy is
+    reported; unique items run concurrently under batch_max_concurrency and each
+    result is written as soon as it finishes:
+      {"index", "id", "ok": true, "result"} | {"index", "id", "ok": false, "status", "error", "retry_after"?}
+    then one {"done": true, "count", "unique", "errors"} line.
+    """
+    groups: Dict[str, List[int]] = {}
+    bad: List[tuple] = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            bad.append((i, 400, "item must be an object"))
+            continue
+        try:
+            groups.setdefault(await key_fn(item), []).append(i)
+        except HTTPException as e:
+            bad.append((i, e.status_code, e.detail))
+        except Exception as e:  # a malformed item must not fail the whole batch
+            bad.append((i, 400, str(e) or type(e).__name__))
+
+    def line(i: int, body: Dict[str, Any]) -> bytes:
+        item = items[i]
+        body = {"index": i, "id": item.get("id") if isinstance(item, dict) else None, **body}
+        return dumps(body) + b"\n"
+
+    errors = len(bad)
+    for i, status, detail in bad:
+        yield line(i, {"ok": False, "status": status, "error": detail})
+
+    sem = asyncio.Semaphore(max(1, settings.batch_max_concurrency))
+
+    async def one(indexes: List[int]):
+        async with sem:
+            try:
+                with priority("batch"):
+                    return indexes, {"ok": True, "result": await run_fn(items[indexes[0]])}
+            except LLMUnavailable as e:
+                return indexes, {"ok": False, "status": 503, "error": str(e), "retry_after": e.retry_after}
+            except HTTPException as e:
+                return indexes, {"ok": False, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                return indexes, {"ok": False, "status": 500, "error": str(e) or type(e).__name__}
+
+    tasks = [asyncio.create_task(one(ix)) for ix in groups.values()]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            indexes, body = await fut
+            if not body["ok"]:
+                errors += len(indexes)
+            for i in indexes:
+                yield line(i, body)
+    finally:
+        for t in tasks:
+            t.cancel()
+    metrics.inc("batch_items", len(items))
+    metrics.inc("batch_deduped", len(items) - len(bad) - len(groups))
+    yield dumps({"done": True, "count": len(items), "unique": len(groups), "errors": errors}) + b"\n"
+
+def _batch_items(payload: Dict[str, Any]) -> List[Any]:
+    items = payload.get("items")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="items must be a list")
+    if len(items) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"at most {settings.batch_max_items} items per batch")
+    return items
+
+@app.post("/plan/batch")
+async def plan_batch_endpoint(request: Request):
+    """Many {id?, prompt, dom | session_id + dom_delta, cache?} items in one request, NDJSON results."""
+    payload = await _read_payload(request)
+    items = _batch_items(payload)
+    resolved: Dict[int, tuple] = {}
+
+    async def key(item: Dict[str, Any]) -> str:
+        dom, dom_hash = await _resolve_dom(item)
+        resolved[id(item)] = (dom, dom_hash)
+        use_cache = item.get("cache", True) is not False
+        return f"{int(use_cache)}:{_plan_cache_key(item.get('prompt', ''), dom)}"
+
+    async def run(item: Dict[str, Any]):
+        dom, dom_hash = resolved[id(item)]
+        plan = await generate_plan(
+            item.get("prompt", ""),
+            dom,
+            use_cache=item.get("cache", True) is not False,
+            deadline_ms=item.get("deadline_ms"),
+            hedge=item.get("hedge"),
+            host=_host(item),
+        )
+        return _plan_response(plan, dom_hash)
+
+    return StreamingResponse(_run_batch(items, key, run), media_type="application/x-ndjson")
 
 @app.post("/next")
-async def next_endpoint(payload: Dict[str, Any]):
-    dom = payload.get("dom", [])
+async def next_endpoint(request: Request):
+    payload = await _read_payload(request)
+    dom, dom_hash = await _resolve_dom(payload)
     prompt = payload.get("prompt", "continue")
-    plan = await generate_plan(prompt, dom)
-    return plan.model_dump()
+    if payload.get("current_url"):
+        upsert_node(url=payload["current_url"], title=payload.get("title"), origin=None)
+    with priority("next"):  # interactive: model slots go to /next before plans and summaries
+        plan = await generate_plan(
+            prompt,
+            dom,
+            use_cache=payload.get("cache", True) is not False,
+            deadline_ms=payload.get("deadline_ms"),
+            hedge=payload.get("hedge"),
+            history=_history(payload),
+            host=_host(payload),
+        )
+    return _plan_response(plan, dom_hash)
+
+@app.post("/outcomes")
+async def outcomes_endpoint(request: Request):
+    """
+    Step outcomes from the extension, used to rank and swap unreliable targets:
+    {url | host, outcomes: [{selector?, query?, outcome: success|not_found|timeout, via?}]}
+    (a single outcome may also be sent inline instead of the list).
+    """
+    payload = await _read_payload(request)
+    index = get_reliability()
+    if index is None:
+        return {"ok": True, "recorded": 0}
+    host = _host(payload)
+    if not host:
+        raise HTTPException(status_code=400, detail="url or host is required")
+    items = payload.get("outcomes", [payload])
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="outcomes must be a list")
+    return {"ok": True, "recorded": index.record_many(host, items)}
+
+@app.get("/reliability")
+async def reliability_report(host: str | None = None, limit: int = 50):
+    """Index stats, or a host's judged targets (least reliable first)."""
+    index = get_reliability()
+    if index is None:
+        return {"enabled": False}
+    if host:
+        return {"host": host.lower(), "targets": index.report(host.lower(), limit)}
+    return index.stats()
+
+@app.post("/session/end")
+async def end_session(payload: Dict[str, Any]):
+    session_id = payload.get("session_id") or ""
+    await _on_snapshots(lambda: snapshots.drop(session_id))
+    if session_id:
+        if traversals.blocking:
+            await asyncio.to_thread(traversals.drop, session_id)
+        else:
+            traversals.drop(session_id)
+    return {"ok": True}
+
+async def _on_frontier(session_id: str | None, fn: Callable[[Any], Any]) -> Any:
+    """fn(frontier of the session), inline or in a thread when the frontiers block on SQLite."""
+    def call():
+        return fn(traversals.get(session_id))
+    return await asyncio.to_thread(call) if traversals.blocking else call()
 
 @app.post("/explore")
 async def explore(payload: Dict[str, Any]):
     current = payload.get("current_url") or ""
     links: List[str] = payload.get("links") or []
-    traversal.push_links(current_url=current, links=links, via_selector=None, depth=0)
-    return {"ok": True, "frontier_size": len(traversal.frontier)}
+    added, size = await _on_frontier(payload.get("session_id"), lambda traversal: (
+        traversal.push_links(
+            current_url=current,
+            links=links,
+            via_selector=payload.get("via_selector"),
+            depth=int(payload.get("depth") or 0),
+        ),
+        len(traversal),
+    ))
+    if current:
+        upsert_node(url=current, title=payload.get("title"), origin=payload.get("origin"))
+        for link in links:
+            if not link:
+                continue
+            dst = urljoin(current, link)  # relative hrefs, resolved the way the frontier queues them
+            if dst.startswith(("http://", "https://")):
+                upsert_edge(current, dst, selector=payload.get("via_selector"), link=link)
+    return {"ok": True, "added": added, "frontier_size": size}
 
-@app.post("/summarize")
-async def summarize_endpoint(payload: Dict[str, Any]):
-    task = (payload.get("task") or "Summarize this page").strip()
-    ctx = payload.get("context") or {}
+@app.post("/explore/next")
+async def explore_next(payload: Dict[str, Any]):
+    count = int(payload.get("count") or 1)
+    batch, size = await _on_frontier(payload.get("session_id"), lambda traversal: (
+        traversal.next_batch(count, host=payload.get("host")),
+        len(traversal),
+    ))
+    return {"urls": batch, "frontier_size": size}
+
+@app.post("/explore/stats")
+async def explore_stats(payload: Dict[str, Any]):
+    return await _on_frontier(payload.get("session_id"), lambda traversal: traversal.stats())
+
+@app.get("/pages/history")
+async def pages_history(limit: int = 100, host: str | None = None):
+    store = get_store()
+    return {"pages": store.crawl_history(limit=limit, host=host) if store else []}
+
+@app.get("/pages/known")
+async def pages_known(host: str | None = None, limit: int = 1000):
+    store = get_store()
+    return {"urls": store.known_pages(host=host, limit=limit) if store else []}
+
+def _summary_context(ctx: Dict[str, Any], task: str | None = None) -> Dict[str, Any]:
+    """Page text from the context, falling back to the text of the snapshot controls."""
     text = (ctx.get("text") or "").strip()
     if not text:
-        controls = ctx.get("dom") or []
-        text = "\n".join([str(c.get("text") or "") for c in controls if c.get("text")]).strip()
+        controls = _wire_dom(ctx.get("dom"))
+        texts = controls.column("text") if hasattr(controls, "column") else [c.get("text") for c in controls]
+        text = "\n".join([str(t) for t in texts if t]).strip()
+    return {"text": text, "title": ctx.get("title"), "url": ctx.get("url"), "task": task or ctx.get("task")}
+
+@app.post("/summarize")
+async def summarize_endpoint(request: Request):
+    payload = await _read_payload(request)
+    ctx = payload.get("context") or {}
     agent = SummarizerAgent()
-    summary = await agent.run({"text": text, "title": ctx.get("title"), "url": ctx.get("url")})
+    summary = await agent.run(_summary_context(ctx, payload.get("task")))
     return {"summary": summary}
 
+@app.post("/summarize/stream")
+async def summarize_stream_endpoint(request: Request):
+    """Server-Sent Events variant of /summarize: partial bullets arrive as chunks finish."""
+    payload = await _read_payload(request)
+    ctx = _summary_context(payload.get("context") or {}, payload.get("task"))
+    agent = SummarizerAgent()
+
+    async def events():
+        try:
+            async for ev in agent.stream(ctx):
+                yield b"data: " + dumps(ev) + b"\n\n"
+        except LLMUnavailable as e:
+            yield b"data: " + dumps({"type": "error", "error": str(e), "retry_after": e.retry_after}) + b"\n\n"
+        except Exception as e:
+            yield b"data: " + dumps({"type": "error", "error": str(e)}) + b"\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/summarize/batch")
+async def summarize_batch_endpoint(request: Request):
+    """Many {id?, context: {text | dom, title, url}} items in one request, NDJSON results."""
+    payload = await _read_payload(request)
+    items = _batch_items(payload)
+    agent = SummarizerAgent()
+
+    async def key(item: Dict[str, Any]) -> str:
+        ctx = _summary_context(item.get("context") or {}, item.get("task"))
+        return _summary_key(ctx["title"] or "", ctx["url"] or "", ctx["text"], ctx["task"] or "")
+
+    async def run(item: Dict[str, Any]):
+        return {"summary": await agent.run(_summary_context(item.get("context") or {}, item.get("task")))}
+
+    return StreamingResponse(_run_batch(items, key, run), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    cache = get_plan_cache()
+    summaries = get_summary_caches()
+    return {
+        "plan": cache.stats() if cache is not None else None,
+        "summary": summaries[0].stats() if summaries else None,
+        "summary_chunks": summaries[1].stats() if summaries else None,
+        "singleflight": {"plan": plan_flight.stats(), "summarize": summary_flight.stats()},
+    }
+
 @app.get("/bookmarks")
 async def list_bookmarks():
-    return {"bookmarks":["create_change_request"]}
+    return {"bookmarks": get_registry().names()}
+
+@app.post("/bookmarks")
+async def save_bookmark(payload: Dict[str, Any]):
+    """Register a flow, e.g. a plan the LLM produced: {name, steps, phrases?, description?}."""
+    steps = normalize_plan(payload.get("steps") or [])
+    try:
+        bm = get_registry().save(
+            payload.get("name") or "",
+            steps,
+            phrases=payload.get("phrases") or [],
+            description=payload.get("description"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "bookmark": bm}
+
+@app.get("/bookmarks/stats")
+async def bookmark_stats():
+    return get_registry().stats()
 
 @app.post("/run_bookmark")
 async def run_bookmark(payload: Dict[str, Any]):
@@ -85,7 +635,21 @@ async def run_bookmark(payload: Dict[str, Any]):
     return await agent.run(payload)
 
 def run():
-    uvicorn.run("main:app", host=settings.host, port=settings.port, reload=True)
+    """Development server: single process, auto-reload when settings.debug is on."""
+    import uvicorn
+    uvicorn.run("main:app", host=settings.host, port=settings.port, reload=settings.debug)
+
+def serve():
+    """Production server: no reload, `settings.workers` pre-forked worker processes."""
+    import uvicorn
+    uvicorn.run(
+        "main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=max(1, settings.workers),
+        reload=False,
+        log_level="debug" if settings.debug else "info",
+    )
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,275 @@
+"""
+Reversible PII masking for everything that is sent to the model.
+
+Control names/text/hrefs, the user goal and page text are scanned by one compiled
+Masker; every hit is replaced with a keyed placeholder such as [EMAIL_1a2b3c4d]
+and remembered in a per-request MaskVault, so the plan steps or summary that come
+back can be unmasked before they are returned to the extension.
+"""
+from __future__ import annotations
+import hashlib
+import hmac
+import os
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import metrics
+
+# Detector registry: name -> (regex, flags, first, left).
+#   first: regex class body of the characters a match can start with; all of them
+#          together form a lookahead gate, which lets the regex engine skip every
+#          position that cannot start any detector (most of the text).
+#   left:  regex that must match right before the match; the match is extended over
+#          it. Lets a detector anchor on a rare character in the middle: an email is
+#          found at its "@" and extended back over the local part. A match whose
+#          `left` does not match is dropped.
+# Dictionary detectors are compiled from word lists into the same regex (see Masker).
+_DETECTORS: Dict[str, Tuple[str, int, Optional[str], Optional[str]]] = {
+    "email": (r"@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}", 0, "@", r"[A-Za-z0-9._%+-]+"),
+    "jwt": (r"J[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}", 0, "J", r"(?<![\w-])ey"),
+    "secret": (r"[-_][A-Za-z0-9_-]{16,}", 0, "_\\-", r"(?<![\w-])(?:sk|pk|rk|ghp|xox[abpr])"),
+    "bearer": (r"[Bb]earer\s+[A-Za-z0-9._~+/-]{20,}=*", 0, "Bb", None),
+    "card": (r"(?<![\d-])(?:\d[ -]?){12,18}\d\b", 0, "0-9", None),
+    "ssn": (r"(?<![\d-])\d{3}-\d{2}-\d{4}\b", 0, "0-9", None),
+    "phone": (r"(?<![\w-])(?:\+?\d{1,3}[ .-]?)?(?:\(\d{3}\)|\d{3})[ .-]?\d{3}[ .-]\d{4}\b", 0, "0-9(+", None),
+    "ip": (r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}\b", 0, "0-9", None),
+}
+
+# Placeholders look like [EMAIL_1a2b3c4d]; only ones this vault issued are restored.
+_PLACEHOLDER_RE = re.compile(r"\[[A-Z]+_[0-9a-f]{8}\]")
+
+_PLACEHOLDER_MAX = 32  # longest partial placeholder unmask_stream holds back
+
+_SEP = "\x00"  # joins fields for the single scan; no detector can match across it
+
+
+def register_detector(name: str, pattern: str, flags: int = 0, first: Optional[str] = None, left: Optional[str] = None):
+    """
+    Add (or replace) a regex detector, e.g.
+        register_detector("employee_id", r"EMP\\d{6}\\b", first="E")
+    Without `first` the combined scanner cannot skip ahead and gets slower.
+    """
+    re.compile(pattern, flags)  # fail early on a bad pattern
+    _DETECTORS[name] = (pattern, flags, first, left)
+
+
+def available_detectors() -> List[str]:
+    return list(_DETECTORS)
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    Alternation shaped like a trie ("acme|acne" -> "ac(?:me|ne)"), so the regex
+    engine walks shared prefixes once instead of trying every word in turn --
+    the same work an Aho-Corasick automaton does per position.
+    """
+    trie: Dict[str, Any] = {}
+    for w in words:
+        w = w.strip().lower()
+        if not w:
+            continue
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Any]) -> str:
+        end = "" in node
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 and len(alts[0]) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"{body}?" if end else body
+
+    return build(trie)
+
+
+class Masker:
+    """
+    Compiled multi-pattern scanner. Every enabled detector becomes one named group
+    of a single alternation regex (dictionaries as a trie-shaped group) behind a
+    lookahead gate on their possible first characters, so a text is scanned once
+    however many detectors are on, and a batch of fields is joined and scanned as
+    one string.
+    """
+
+    def __init__(self, detectors: Optional[Sequence[str]] = None, dictionary: Iterable[str] = (), key: Optional[bytes] = None):
+        names = list(detectors) if detectors is not None else available_detectors()
+        parts = []
+        firsts: Optional[List[str]] = []
+        self._left: Dict[str, "re.Pattern[str]"] = {}
+        for name in names:
+            if name not in _DETECTORS:
+                raise ValueError(f"unknown masking detector: {name}")
+            pattern, flags, first, left = _DETECTORS[name]
+            inline = "(?i:" + pattern + ")" if flags & re.IGNORECASE else pattern
+            parts.append(f"(?P<{name}>{inline})")
+            if firsts is not None and first:
+                firsts.append(first)
+            else:
+                firsts = None
+            if left:
+                self._left[name] = re.compile(f"(?:{left})$")
+        terms = sorted({w.strip().lower() for w in dictionary if w and w.strip()})
+        if terms:
+            parts.append(rf"(?P<term>(?i:(?<!\w){_trie_pattern(terms)}(?!\w)))")
+            if firsts is not None:
+                firsts.append("".join(sorted({re.escape(c) for w in terms for c in (w[0].lower(), w[0].upper())})))
+        self.names = names + (["term"] if terms else [])
+        self._re = None
+        if parts:
+            gate = f"(?=[{''.join(firsts)}])" if firsts else ""
+            self._re = re.compile(gate + "(?:" + "|".join(parts) + ")")
+        self._key = key or os.urandom(16)
+
+    def scan(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping (start, end, detector) spans, in order."""
+        spans: List[Tuple[int, int, str]] = []
+        if self._re is None or not text:
+            return spans
+        search = self._re.search
+        pos = prev_end = 0
+        while True:
+            m = search(text, pos)
+            if m is None:
+                return spans
+            kind = m.lastgroup or "pii"
+            start, end = m.span()
+            left = self._left.get(kind)
+            if left is not None:
+                ext = left.search(text, max(prev_end, start - 256), start)
+                if ext is None or ext.start() == start:
+                    pos = start + 1  # rejected: a real match may start inside this one
+                    continue
+                start = ext.start()
+            spans.append((start, end, kind))
+            pos = prev_end = max(end, start + 1)
+
+    def vault(self) -> "MaskVault":
+        return MaskVault(self)
+
+    def placeholder(self, kind: str, value: str) -> str:
+        # keyed hash: stable for the same value (cache friendly), not reversible without the key
+        digest = hmac.new(self._key, value.encode("utf-8", "replace"), hashlib.blake2s).hexdigest()[:8]
+        return f"[{kind.upper()}_{digest}]"
+
+
+class MaskVault:
+    """Placeholder <-> original mapping for one request; unmask() restores what mask() replaced."""
+
+    def __init__(self, masker: Masker):
+        self.masker = masker
+        self.originals: Dict[str, str] = {}
+        self.counts: Dict[str, int] = {}
+
+    def mask(self, text: str) -> str:
+        if not text:
+            return text
+        spans = self.masker.scan(text)
+        if not spans:
+            return text
+        out: List[str] = []
+        pos = 0
+        for start, end, kind in spans:
+            value = text[start:end]
+            ph = self.masker.placeholder(kind, value)
+            self.originals[ph] = value
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            out.append(text[pos:start])
+            out.append(ph)
+            pos = end
+        out.append(text[pos:])
+        return "".join(out)
+
+    def mask_many(self, values: Sequence[Optional[str]]) -> List[Optional[str]]:
+        """Mask a batch of fields in one scan (None stays None)."""
+        if self.masker._re is None:
+            return list(values)
+        joined = self.mask(_SEP.join(v or "" for v in values))
+        out: List[Optional[str]] = joined.split(_SEP)
+        return [None if v is None else out[i] for i, v in enumerate(values)]
+
+    def mask_controls(self, controls: List[Dict[str, Any]], fields: Sequence[str] = ("name", "text", "href")) -> List[Dict[str, Any]]:
+        """Copies of the controls with the given string fields masked (one scan for all of them)."""
+        flat = [c.get(f) if isinstance(c.get(f), str) else None for c in controls for f in fields]
+        masked = self.mask_many(flat)
+        out = []
+        k = 0
+        for c in controls:
+            c = dict(c)
+            for f in fields:
+                if masked[k] is not None:
+                    c[f] = masked[k]
+                k += 1
+            out.append(c)
+        return out
+
+    def report(self):
+        """Count what this vault masked (commet_events_total{kind="pii_masked"})."""
+        for kind, n in self.counts.items():
+            metrics.inc("pii_masked", n, detector=kind)
+
+    def unmask(self, value: Any) -> Any:
+        """Restore originals in a string or (recursively) in lists/dicts such as plan steps."""
+        if not self.originals:
+            return value
+        if isinstance(value, str):
+            if "[" not in value:
+                return value
+            return _PLACEHOLDER_RE.sub(lambda m: self.originals.get(m.group(0), m.group(0)), value)
+        if isinstance(value, list):
+            return [self.unmask(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.unmask(v) for k, v in value.items()}
+        return value
+
+    async def unmask_stream(self, pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Unmask streamed model output; a placeholder split across pieces is held back until complete."""
+        buf = ""
+        async for piece in pieces:
+            buf += piece
+            cut = buf.rfind("[")
+            if cut < 0 or "]" in buf[cut:] or len(buf) - cut > _PLACEHOLDER_MAX:
+                cut = len(buf)
+            if cut:
+                yield self.unmask(buf[:cut])
+                buf = buf[cut:]
+        if buf:
+            yield self.unmask(buf)
+
+
+_masker: Optional[Masker] = None
+_masker_loaded = False
+
+
+def _load_dictionary(path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except OSError:
+        return []
+
+
+def get_masker() -> Optional[Masker]:
+    """Process-wide masker built from settings; None when masking is off."""
+    global _masker, _masker_loaded
+    if not _masker_loaded:
+        try:
+            from settings import settings
+        except Exception:
+            settings = None  # planner/summarizer can run without settings (benchmarks)
+        if settings is not None and settings.mask_enabled:
+            _masker = Masker(
+                settings.mask_detectors,
+                dictionary=list(settings.mask_dictionary) + _load_dictionary(settings.mask_dictionary_path),
+                key=settings.mask_key.encode("utf-8") if settings.mask_key else None,
+            )
+        _masker_loaded = True
+    return _masker
+
+
+def new_vault() -> Optional[MaskVault]:
+    masker = get_masker()
+    return masker.vault() if masker is not None else None
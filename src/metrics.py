@@ -0,0 +1,209 @@
+from __future__ import annotations
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_enabled = True
+_lock = threading.Lock()
+_NULL = nullcontext()
+
+# stage -> seconds for the current request (feeds the Server-Timing header)
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def configure(enabled: bool):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        k = _key(labels)
+        self.values[k] = self.values.get(k, 0.0) + value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(k)} {v}" for k, v in list(self.values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts..., +Inf count], sum
+        self.values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        k = _key(labels)
+        slot = self.values.get(k)
+        if slot is None:
+            slot = self.values.setdefault(k, ([0] * (len(self.buckets) + 1), [0.0]))
+        slot[0][bisect.bisect_left(self.buckets, value)] += 1
+        slot[1][0] += value
+
+    def render(self) -> List[str]:
+        out = []
+        for k, (counts, total) in list(self.values.items()):
+            running = 0
+            for le, c in zip(self.buckets, counts):
+                running += c
+                out.append(f"{self.name}_bucket{_fmt_labels(k, [('le', repr(float(le)))])} {running}")
+            running += counts[-1]
+            out.append(f"{self.name}_bucket{_fmt_labels(k, [('le', '+Inf')])} {running}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {total[0]}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {running}")
+        return out
+
+
+_registry: Dict[str, object] = {}
+
+
+def counter(name: str, help: str) -> Counter:
+    with _lock:
+        m = _registry.get(name)
+        if m is None:
+            m = _registry[name] = Counter(name, help)
+        return m  # type: ignore[return-value]
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    with _lock:
+        m = _registry.get(name)
+        if m is None:
+            m = _registry[name] = Histogram(name, help, buckets)
+        return m  # type: ignore[return-value]
+
+
+# ---- Well-known metrics ----
+HTTP_LATENCY = histogram("commet_http_request_seconds", "Endpoint latency in seconds")
+LLM_LATENCY = histogram("commet_llm_request_seconds", "Time spent waiting on the model per call")
+LLM_TOKENS = histogram("commet_llm_tokens", "Prompt and completion tokens per LLM call", SIZE_BUCKETS)
+STAGE_LATENCY = histogram("commet_stage_seconds", "Latency of internal pipeline stages")
+DOM_CONTROLS = histogram("commet_dom_controls", "Snapshot controls before and after slimming", SIZE_BUCKETS)
+EVENTS = counter("commet_events_total", "Pipeline outcomes (json parse path, fallbacks, cache lookups)")
+
+
+# ---- Recording helpers (cheap no-ops when disabled) ----
+def inc(kind: str, value: float = 1.0, **labels):
+    if _enabled:
+        EVENTS.inc(value, kind=kind, **labels)
+
+
+def observe_tokens(op: str, prompt: int, completion: int):
+    if _enabled:
+        LLM_TOKENS.observe(prompt, op=op, type="prompt")
+        LLM_TOKENS.observe(completion, op=op, type="completion")
+
+
+def observe_prompt(op: str, parts: Dict[str, int]):
+    """Prompt tokens per section (system, goal, history, hints, controls)."""
+    if _enabled:
+        for section, n in parts.items():
+            LLM_TOKENS.observe(n, op=op, type=f"prompt_{section}")
+
+
+def observe_dom(before: int, after: int):
+    if _enabled:
+        DOM_CONTROLS.observe(before, stage="raw")
+        DOM_CONTROLS.observe(after, stage="slim")
+
+
+def _record_stage(hist: Histogram, stage: str, dt: float, labels: Dict[str, object]):
+    hist.observe(dt, **labels)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + dt
+
+
+@contextmanager
+def _timed(hist: Histogram, stage: str, labels: Dict[str, object]) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(hist, stage, time.perf_counter() - t0, labels)
+
+
+def stage(name: str):
+    """`with metrics.stage("prompt_build"):` -- records into commet_stage_seconds."""
+    if not _enabled:
+        return _NULL
+    return _timed(STAGE_LATENCY, name, {"stage": name})
+
+
+def llm_call(op: str):
+    """Times one model round trip (commet_llm_request_seconds{op})."""
+    if not _enabled:
+        return _NULL
+    return _timed(LLM_LATENCY, f"llm_{op}", {"op": op})
+
+
+def start_request() -> Optional[contextvars.Token]:
+    if not _enabled:
+        return None
+    return _request_timings.set({})
+
+
+def end_request(token: Optional[contextvars.Token], path: str, dt: float) -> Dict[str, float]:
+    if token is None:
+        return {}
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    HTTP_LATENCY.observe(dt, path=path)
+    return timings
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    parts = [f"{k};dur={v * 1000:.1f}" for k, v in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render() -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    with _lock:
+        metrics = list(_registry.values())
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")  # type: ignore[attr-defined]
+        lines.append(f"# TYPE {m.name} {m.kind}")  # type: ignore[attr-defined]
+        lines.extend(m.render())  # type: ignore[attr-defined]
+    return "\n".join(lines) + "\n"
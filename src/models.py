@@ -14,3 +14,4 @@ class ActionModel(BaseModel):
 
 class PlanModel(BaseModel):
     steps: List[ActionModel] = Field(default_factory=list)
+    meta: Optional[Dict[str, Any]] = None   # which path produced the plan (cache/llm/heuristic), timings
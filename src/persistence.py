@@ -1,8 +1,246 @@
+from __future__ import annotations
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import metrics
+from utils import normalize_url, url_host
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url        TEXT PRIMARY KEY,
+    host       TEXT NOT NULL,
+    title      TEXT,
+    origin     TEXT,
+    first_seen REAL NOT NULL,
+    last_seen  REAL NOT NULL,
+    visits     INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS ix_pages_host_last ON pages(host, last_seen DESC);
+CREATE INDEX IF NOT EXISTS ix_pages_last ON pages(last_seen DESC);
+
+CREATE TABLE IF NOT EXISTS edges (
+    src        TEXT NOT NULL,
+    dst        TEXT NOT NULL,
+    selector   TEXT NOT NULL DEFAULT '',
+    link       TEXT,
+    first_seen REAL NOT NULL,
+    last_seen  REAL NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (src, dst, selector)
+);
+CREATE INDEX IF NOT EXISTS ix_edges_dst ON edges(dst);
+"""
+
+_UPSERT_PAGE = """
+INSERT INTO pages (url, host, title, origin, first_seen, last_seen, visits)
+VALUES (?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT(url) DO UPDATE SET
+    title = COALESCE(excluded.title, pages.title),
+    origin = COALESCE(excluded.origin, pages.origin),
+    last_seen = excluded.last_seen,
+    visits = pages.visits + 1
+"""
+
+_UPSERT_EDGE = """
+INSERT INTO edges (src, dst, selector, link, first_seen, last_seen, hits)
+VALUES (?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT(src, dst, selector) DO UPDATE SET
+    link = COALESCE(excluded.link, edges.link),
+    last_seen = excluded.last_seen,
+    hits = edges.hits + 1
+"""
+
+
+def sqlite_path(url: str) -> str:
+    """'sqlite:///./commet_graph.db' -> './commet_graph.db'."""
+    for prefix in ("sqlite:///", "sqlite://"):
+        if url.startswith(prefix):
+            return url[len(prefix):] or ":memory:"
+    return url
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class GraphStore:
+    """
+    Page graph (visited pages + the links/selectors between them) in SQLite.
+    Writes are queued and applied by one background thread in batched transactions,
+    so request handlers never wait on disk. A batch that fails (database locked,
+    disk full) is retried with backoff, then dropped and counted in `dropped` and
+    commet_events_total{kind="graph_write_dropped"}. Reads use their own WAL connection.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.2, write_retries: int = 3):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_retries = write_retries
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._wconn = _connect(path)
+        self._wconn.executescript(_SCHEMA)
+        self._wconn.commit()
+        self._rconn = _connect(path)
+        self._rlock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._writer = threading.Thread(target=self._run, name="graph-writer", daemon=True)
+        self._writer.start()
+
+    # ---- writes (non-blocking) ----
+    def upsert_node(self, url: str, title: Optional[str], origin: Optional[str]):
+        key = normalize_url(url)
+        if key:
+            self._queue.put(("page", (key, url_host(key), title, origin)))
+
+    def upsert_edge(self, src: str, dst: str, selector: Optional[str] = None, link: Optional[str] = None):
+        s, d = normalize_url(src), normalize_url(dst)
+        if s and d:
+            self._queue.put(("edge", (s, d, selector or "", link)))
+
+    def flush(self, timeout: float = 10.0):
+        """Block until everything queued so far is on disk."""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+        self._wconn.close()
+        self._rconn.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.time() + self.flush_interval
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: List[Optional[tuple]]) -> bool:
+        now = time.time()
+        pages, edges, waiters, stop = [], [], [], False
+        for item in batch:
+            if item is None:
+                stop = True
+            elif item[0] == "page":
+                url, host, title, origin = item[1]
+                pages.append((url, host, title, origin, now, now))
+            elif item[0] == "edge":
+                src, dst, selector, link = item[1]
+                edges.append((src, dst, selector, link, now, now))
+            elif item[0] == "flush":
+                waiters.append(item[1])
+        rows = len(pages) + len(edges)
+        for attempt in range(self.write_retries + 1 if rows else 0):
+            try:
+                with self._wconn:
+                    if pages:
+                        self._wconn.executemany(_UPSERT_PAGE, pages)
+                    if edges:
+                        self._wconn.executemany(_UPSERT_EDGE, edges)
+                self.written += rows
+                break
+            except sqlite3.Error as e:
+                if attempt < self.write_retries:
+                    metrics.inc("graph_write_retry")
+                    time.sleep(min(2.0, 0.05 * 2 ** attempt))
+                    continue
+                self.dropped += rows
+                self.last_error = f"{type(e).__name__}: {e}"
+                metrics.inc("graph_write_dropped", rows)
+        for w in waiters:
+            w.set()
+        return stop
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+    # ---- reads ----
+    def _query(self, sql: str, args: tuple) -> List[Dict[str, Any]]:
+        with self._rlock:
+            cur = self._rconn.execute(sql, args)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def crawl_history(self, limit: int = 100, host: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recently visited pages, newest first."""
+        if host:
+            return self._query(
+                "SELECT * FROM pages WHERE host = ? ORDER BY last_seen DESC LIMIT ?", (host.lower(), limit)
+            )
+        return self._query("SELECT * FROM pages ORDER BY last_seen DESC LIMIT ?", (limit,))
+
+    def known_pages(self, host: Optional[str] = None, limit: int = 1000) -> List[str]:
+        rows = self.crawl_history(limit=limit, host=host)
+        return [r["url"] for r in rows]
+
+    def is_known(self, url: str) -> bool:
+        return bool(self._query("SELECT 1 AS k FROM pages WHERE url = ?", (normalize_url(url),)))
+
+    def outgoing(self, url: str, limit: int = 200) -> List[Dict[str, Any]]:
+        return self._query(
+            "SELECT dst, selector, link, hits, last_seen FROM edges WHERE src = ? ORDER BY hits DESC LIMIT ?",
+            (normalize_url(url), limit),
+        )
+
+    def incoming(self, url: str, limit: int = 200) -> List[Dict[str, Any]]:
+        return self._query(
+            "SELECT src, selector, link, hits, last_seen FROM edges WHERE dst = ? ORDER BY hits DESC LIMIT ?",
+            (normalize_url(url), limit),
+        )
+
+
+_store: Optional[GraphStore] = None
+
+
+def get_store() -> Optional[GraphStore]:
+    return _store
+
+
+def init_db(url: Optional[str] = None) -> Optional[GraphStore]:
+    global _store
+    if _store is None:
+        if url is None:
+            from settings import settings
+            url = settings.sqlite_url
+        _store = GraphStore(sqlite_path(url))
+    return _store
+
+
+def close_db():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
 
-def init_db():
-    # no-op placeholder (use sqlite/pg if you want persistence)
-    return
 
 def upsert_node(url: str, title: str | None, origin: str | None):
-    # no-op placeholder
-    return
+    # queued; no-op until init_db() has run
+    if _store is not None:
+        _store.upsert_node(url, title, origin)
+
+
+def upsert_edge(src: str, dst: str, selector: str | None = None, link: str | None = None):
+    if _store is not None:
+        _store.upsert_edge(src, dst, selector, link)
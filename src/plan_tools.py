@@ -1,9 +1,13 @@
 
 from __future__ import annotations
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+import metrics
+from selector_index import SelectorIndex, StepResolver
 
 Step = Dict[str, Any]
 
+ALLOWED_ACTIONS = {"navigate", "click", "type", "pressEnter", "waitForText", "scroll", "done"}
+
 def _step_key(s: Step) -> Tuple:
     return (
         s.get("action"),
@@ -44,9 +48,22 @@ def _prefer_enter_on_search(steps: List[Step]) -> List[Step]:
         i += 1
     return out
 
-def normalize_plan(raw_steps: List[Step]) -> List[Step]:
-    allowed = {"navigate", "click", "type", "pressEnter", "waitForText", "scroll", "done"}
-    steps = [s for s in raw_steps or [] if s.get("action") in allowed]
+def normalize_plan(raw_steps: List[Step], index: Optional[SelectorIndex] = None) -> List[Step]:
+    """
+    Dedupe, merge and filter plan steps. With the snapshot's SelectorIndex, click/type
+    targets are also checked: queries get a concrete selector, bad targets are repaired
+    and steps that cannot match anything are dropped (see StepResolver).
+    """
+    with metrics.stage("normalize_plan"):
+        out = _normalize_plan(raw_steps, index)
+    metrics.inc("plan_steps_dropped", len(raw_steps or []) - len(out))
+    return out
+
+def _normalize_plan(raw_steps: List[Step], index: Optional[SelectorIndex] = None) -> List[Step]:
+    steps = [s for s in raw_steps or [] if s.get("action") in ALLOWED_ACTIONS]
+    if index is not None:
+        resolver = StepResolver(index)
+        steps = [r for r in (resolver.check(s) for s in steps) if r is not None]
 
     seen = set()
     unique: List[Step] = []
@@ -60,3 +77,47 @@ def normalize_plan(raw_steps: List[Step]) -> List[Step]:
     unique = _collapse_typing(unique)
     unique = _prefer_enter_on_search(unique)
     return unique
+
+class StepNormalizer:
+    """
+    Streaming counterpart of normalize_plan for steps that arrive one at a time:
+    filters unknown actions, drops duplicates and merges `type` + `pressEnter`
+    into `type(enter=True)`. A `type` without enter is held back until the next
+    step shows whether it can be merged; call flush() at the end of the stream.
+    With a SelectorIndex, targets are checked as in normalize_plan.
+    """
+
+    def __init__(self, index: Optional[SelectorIndex] = None):
+        self._seen = set()
+        self._held: Step | None = None
+        self._resolver = StepResolver(index) if index is not None else None
+
+    def push(self, s: Step) -> List[Step]:
+        if not isinstance(s, dict) or s.get("action") not in ALLOWED_ACTIONS:
+            return []
+        if self._resolver is not None:
+            s = self._resolver.check(s)
+            if s is None:
+                return []
+        k = _step_key(s)
+        if k in self._seen:
+            return []
+        self._seen.add(k)
+
+        out: List[Step] = []
+        if self._held is not None:
+            held, self._held = self._held, None
+            if s.get("action") == "pressEnter":
+                merged = dict(held)
+                merged["enter"] = True
+                return [merged]
+            out.append(held)
+        if s.get("action") == "type" and not s.get("enter"):
+            self._held = s
+        else:
+            out.append(s)
+        return out
+
+    def flush(self) -> List[Step]:
+        held, self._held = self._held, None
+        return [held] if held is not None else []
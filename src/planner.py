@@ -1,9 +1,22 @@
 from __future__ import annotations
+import asyncio
+import hashlib
 import json
-import re
-from typing import List, Dict, Any, Optional
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from models import PlanModel, ActionModel
-from plan_tools import normalize_plan
+from plan_tools import normalize_plan, StepNormalizer
+from json_stream import StepStreamParser, first_json_object
+from cache import LRUCache, DiskTier
+from ranking import select_controls
+from singleflight import SingleFlight
+from selector_index import SelectorIndex
+from masking import MaskVault, new_vault
+from admission import LLMUnavailable
+from reliability import HostReliability, get_reliability
+from tokenizer import count_json_tokens, count_static, count_tokens, backend as tokenizer_backend
+import metrics
 
 # We keep your existing heuristic as an offline fallback
 def _is_search_prompt(p: str) -> bool:
@@ -17,6 +30,36 @@ def _extract_query(p: str) -> str:
             return p[idx + len(kw):].strip().strip('"').strip("'")
     return p
 
+_MULTI_STEP_CUES = (" and ", " then ", ",", ";", " after ", " add ", " open ", " filter ", " sort ")
+
+def _heuristic_confident(p: str) -> bool:
+    """
+    A plain "search for X" goal with a short query and no follow-up sub-tasks:
+    the heuristic plan is as good as the LLM's, so it may win a deadline race.
+    """
+    if not _is_search_prompt(p):
+        return False
+    q = _extract_query(p)
+    return 0 < len(q.split()) <= 8 and not any(cue in f" {q.lower()} " for cue in _MULTI_STEP_CUES)
+
+def _heuristic_steps(prompt: str, dom: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not _is_search_prompt(prompt):
+        return [{"action": "done"}]
+    q = _extract_query(prompt)
+    # Target the search anchor found by the ranking stage when the page has one
+    hints = _search_hints(dom, limit=1)
+    target: Dict[str, Any] = {"query": {"role": "combobox", "name": "Search"}}
+    if hints:
+        target = {"query": {"role": hints[0]["role"], "name": hints[0]["name"] or "Search"}}
+        if hints[0].get("selector"):
+            target["selector"] = hints[0]["selector"]
+    return [
+        {"action": "click", **target},
+        {"action": "type", **target, "text": q, "enter": True},
+        {"action": "waitForText", "text": q},
+        {"action": "done"},
+    ]
+
 # --------- LLM plumbing ---------
 def _safe_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     """
@@ -28,36 +71,96 @@ def _safe_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     # common cases: markdown fenced code, extra commentary
     # try direct parse first
     try:
-        return json.loads(text)
+        data = json.loads(text)
+        metrics.inc("plan_json", result="direct")
+        return data
     except Exception:
         pass
 
-    # strip code fences
-    m = re.search(r"\{.*\}", text, flags=re.DOTALL)
-    if m:
-        snippet = m.group(0)
-        try:
-            return json.loads(snippet)
-        except Exception:
-            return None
+    # fenced code / extra commentary: single linear scan for the first balanced object
+    data = first_json_object(text)
+    if data is not None:
+        metrics.inc("plan_json", result="scan")
+        return data
+    metrics.inc("plan_json", result="failed")
     return None
 
-def _summarize_dom(dom: List[Dict[str, Any]], limit: int = 180) -> List[Dict[str, Any]]:
+def _slim_control(c: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "tag": str(c.get("tag") or "")[:30],
+        "role": c.get("role"),
+        "name": (c.get("name") or "").strip()[:120],
+        "text": (c.get("text") or "").strip()[:120],
+        "href": c.get("href"),
+        "selector": c.get("selector"),
+    }
+
+def _setting(name: str, default: Any) -> Any:
+    # settings is optional here so the planner can run (and be benchmarked) on its own
+    try:
+        from settings import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+def _dom_limits() -> tuple[int, int]:
+    return _setting("dom_max_controls", 180), _setting("dom_token_budget", 8000)
+
+def _summarize_dom(
+    dom: List[Dict[str, Any]],
+    limit: Optional[int] = None,
+    goal: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    cost=None,
+) -> List[Dict[str, Any]]:
     """
     Shrink the DOM snapshot to keep token usage sane while still being useful.
     Keep fields the planner truly needs.
+    With a goal, controls are ranked (search anchors first, then BM25 relevance)
+    and picked within the token budget instead of taking the first `limit`.
     """
-    slim = []
-    for c in dom[:limit]:
-        slim.append({
-            "tag": str(c.get("tag") or "")[:30],
-            "role": c.get("role"),
-            "name": (c.get("name") or "").strip()[:120],
-            "text": (c.get("text") or "").strip()[:120],
-            "href": c.get("href"),
-            "selector": c.get("selector"),
-        })
-    return slim
+    max_controls, budget = _dom_limits()
+    limit = limit or max_controls
+    if not goal:
+        return [_slim_control(c) for c in dom[:limit]]
+    picked = select_controls(
+        dom,
+        goal,
+        limit=limit,
+        token_budget=budget if token_budget is None else token_budget,
+        anchors=_search_hint_indexes(dom),
+        slim=_slim_control,
+        cost=cost,
+    )
+    return [_slim_control(dom[i]) for i in picked]
+
+def _search_hint_indexes(dom: List[Dict[str, Any]], limit: int = 8) -> List[int]:
+    out = []
+    if hasattr(dom, "strings"):
+        # columnar snapshot (compact_dom.CompactDom): roles are interned, so match the
+        # role string ids first and only look at name/text for textboxes and comboboxes
+        roles = dom.cols.get("role") or []
+        wanted = {k for k in set(roles) if k >= 0 and dom.strings[k].lower() in ("textbox", "combobox")}
+        if not wanted:
+            return out
+        names, texts = dom.column("name"), dom.column("text")
+        for i, k in enumerate(roles):
+            if k in wanted and ("search" in (names[i] or "").lower() or "search" in (texts[i] or "").lower()):
+                out.append(i)
+                if len(out) >= limit:
+                    break
+        return out
+    for i, c in enumerate(dom):
+        role = (c.get("role") or "").lower()
+        if role not in ("textbox", "combobox"):
+            continue
+        name = (c.get("name") or "").lower()
+        text = (c.get("text") or "").lower()
+        if ("search" in name) or ("search" in text):
+            out.append(i)
+            if len(out) >= limit:
+                break
+    return out
 
 def _search_hints(dom: List[Dict[str, Any]], limit: int = 8) -> List[Dict[str, Any]]:
     """
@@ -65,137 +168,553 @@ def _search_hints(dom: List[Dict[str, Any]], limit: int = 8) -> List[Dict[str, A
     as hints to the planner, but keep the planner site-agnostic.
     """
     hints = []
-    for c in dom:
-        role = (c.get("role") or "").lower()
-        name = (c.get("name") or "").lower()
-        text = (c.get("text") or "").lower()
-        is_searchish = ("search" in name) or ("search" in text)
-        if role in ("textbox", "combobox") and is_searchish:
-            hints.append({
-                "role": role,
-                "name": c.get("name"),
-                "selector": c.get("selector"),
-            })
-            if len(hints) >= limit:
-                break
+    for i in _search_hint_indexes(dom, limit):
+        c = dom[i]
+        hints.append({
+            "role": (c.get("role") or "").lower(),
+            "name": c.get("name"),
+            "selector": c.get("selector"),
+        })
     return hints
 
-def _build_llm_prompt(user_goal: str, dom: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-    """
-    Construct a strict, JSON-only planning prompt.
-    """
-    slim = _summarize_dom(dom)
-    hints = _search_hints(dom)
-
-    system = (
-        "You are a web-automation planner. Your job is to convert the user's goal "
-        "and the current page snapshot into a SHORT sequence of concrete UI actions.\n\n"
-        "Allowed actions:\n"
-        "  - navigate: { url }\n"
-        "  - click:    { selector? or query:{role,name} }\n"
-        "  - type:     { text, enter?:boolean, selector? or query:{role,name} }\n"
-        "  - pressEnter\n"
-        "  - waitForText: { text, timeout?: number }\n"
-        "  - scroll:   { direction:'down'|'up', times?:number }\n"
-        "  - done\n\n"
-        "Target elements must be identified by either a CSS 'selector' from the snapshot, "
-        "OR a semantic 'query' with {role, name}. Roles are generic (textbox, button, link, combobox). "
-        "The 'name' is the accessible label / placeholder / visible text from the DOM snapshot.\n\n"
-        "CRITICAL RULES:\n"
-        "  1) Output ONLY JSON: {\"steps\":[ ... ]}. No markdown or extra text.\n"
-        "  2) DO NOT type meta-instructions like 'search for items with rating >4 and add to cart'. "
-        "     Extract concrete queries (e.g., 'washing machine') and then add follow-up steps (filters, add-to-cart, etc.).\n"
-        "  3) Prefer typing into a visible 'Search' textbox/combobox and pressing Enter.\n"
-        "  4) If the goal has multiple sub-tasks, plan them in order (search → filter → add to cart → open orders → check ...), "
-        "     using the available controls.\n"
-        "  5) Keep the plan short and avoid repeating identical actions.\n"
-        "  6) If you cannot find a control for a sub-task, plan the most reasonable next step anyway "
-        "     (e.g., type a search, then click a likely link text).\n"
-    )
+# --------- Prompt ---------
+# Everything that never changes (instructions, output example) lives in the system
+# message, built once at import: the prompt prefix is byte-identical across calls, so
+# provider-side prompt caching can reuse it. Per-request parts follow in the user
+# message, most stable first: goal, history, hints, then the snapshot controls.
+_PLAN_EXAMPLE = {
+    "steps": [
+        {"action": "click", "query": {"role": "textbox", "name": "Search"}},
+        {"action": "type", "query": {"role": "textbox", "name": "Search"}, "text": "washing machine", "enter": True},
+        {"action": "waitForText", "text": "washing"},
+        {"action": "click", "query": {"role": "link", "name": "4★ & above"}},
+        {"action": "click", "query": {"role": "button", "name": "Add to Cart"}},
+        {"action": "click", "query": {"role": "link", "name": "Orders"}},
+        {"action": "done"}
+    ]
+}
 
-    # a tiny, generic example to set the shape (site-agnostic)
-    example = {
-        "steps": [
-            {"action": "click", "query": {"role": "textbox", "name": "Search"}},
-            {"action": "type", "query": {"role": "textbox", "name": "Search"}, "text": "washing machine", "enter": True},
-            {"action": "waitForText", "text": "washing"},
-            {"action": "click", "query": {"role": "link", "name": "4★ & above"}},
-            {"action": "click", "query": {"role": "button", "name": "Add to Cart"}},
-            {"action": "click", "query": {"role": "link", "name": "Orders"}},
-            {"action": "done"}
-        ]
-    }
+_PLAN_SYSTEM = (
+    "You are a web-automation planner. Your job is to convert the user's goal "
+    "and the current page snapshot into a SHORT sequence of concrete UI actions.\n\n"
+    "Allowed actions:\n"
+    "  - navigate: { url }\n"
+    "  - click:    { selector? or query:{role,name} }\n"
+    "  - type:     { text, enter?:boolean, selector? or query:{role,name} }\n"
+    "  - pressEnter\n"
+    "  - waitForText: { text, timeout?: number }\n"
+    "  - scroll:   { direction:'down'|'up', times?:number }\n"
+    "  - done\n\n"
+    "Target elements must be identified by either a CSS 'selector' from the snapshot, "
+    "OR a semantic 'query' with {role, name}. Roles are generic (textbox, button, link, combobox). "
+    "The 'name' is the accessible label / placeholder / visible text from the DOM snapshot.\n\n"
+    "CRITICAL RULES:\n"
+    "  1) Output ONLY JSON: {\"steps\":[ ... ]}. No markdown or extra text.\n"
+    "  2) DO NOT type meta-instructions like 'search for items with rating >4 and add to cart'. "
+    "     Extract concrete queries (e.g., 'washing machine') and then add follow-up steps (filters, add-to-cart, etc.).\n"
+    "  3) Prefer typing into a visible 'Search' textbox/combobox and pressing Enter.\n"
+    "  4) If the goal has multiple sub-tasks, plan them in order (search → filter → add to cart → open orders → check ...), "
+    "     using the available controls.\n"
+    "  5) Keep the plan short and avoid repeating identical actions.\n"
+    "  6) If you cannot find a control for a sub-task, plan the most reasonable next step anyway "
+    "     (e.g., type a search, then click a likely link text).\n"
+    "  7) HISTORY lists steps already executed on earlier pages; do not repeat them.\n\n"
+    "Return only JSON in this exact shape:\n"
+    + json.dumps(_PLAN_EXAMPLE, ensure_ascii=False)
+)
 
-    user = (
-        f"USER_GOAL:\n{user_goal}\n\n"
-        f"SNAPSHOT_CONTROLS (trimmed):\n{json.dumps(slim, ensure_ascii=False)}\n\n"
-        f"HINTS (possible search inputs):\n{json.dumps(hints, ensure_ascii=False)}\n\n"
-        "Return only JSON in this exact shape:\n"
-        + json.dumps(example, ensure_ascii=False)
-    )
+_SECTION_LABELS = (
+    "USER_GOAL:\n\n\nHISTORY (steps already executed, oldest first):\n\n\n"
+    "HINTS (possible search inputs):\n\n\nSNAPSHOT_CONTROLS (trimmed):\n"
+)
 
-    return [
-        {"role": "system", "content": system},
+# step fields worth showing back to the model
+_HISTORY_FIELDS = ("action", "selector", "query", "text", "url", "enter", "ok", "error")
+
+
+def _encoding() -> str:
+    return _setting("prompt_tokenizer", "o200k_base")
+
+
+def _fit_text(text: str, max_tokens: int, encoding: str) -> Tuple[str, int]:
+    """Text cut (by characters, proportionally) until it fits max_tokens."""
+    n = count_tokens(text, encoding)
+    while n > max_tokens and text:
+        text = text[:max(0, int(len(text) * max_tokens / n) - 1)]
+        n = count_tokens(text, encoding)
+    return text, n
+
+
+def _fit_history(history: Optional[List[Dict[str, Any]]], max_tokens: int, encoding: str) -> Tuple[List[Dict[str, Any]], int]:
+    """The most recent executed steps that fit max_tokens, oldest first."""
+    out: List[Dict[str, Any]] = []
+    used = 0
+    for step in reversed(history or []):
+        if not isinstance(step, dict):
+            continue
+        item = {k: step[k] for k in _HISTORY_FIELDS if step.get(k) is not None}
+        cost = count_json_tokens(item, encoding) + 1
+        if used + cost > max_tokens:
+            break
+        out.append(item)
+        used += cost
+    out.reverse()
+    return out, used
+
+
+def _build_plan_prompt(
+    user_goal: str,
+    dom: List[Dict[str, Any]],
+    vault: Optional[MaskVault] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Strict, JSON-only planning prompt that fits `prompt_token_budget`, plus its token
+    breakdown. Goal and history are capped by their own budgets; the snapshot controls
+    get whatever is left (at most dom_token_budget), counted with the local tokenizer
+    as they are ranked. With a vault, PII is replaced by placeholders.
+    """
+    enc = _encoding()
+    budget = _setting("prompt_token_budget", 12000)
+    system_tokens = count_static(_PLAN_SYSTEM, enc)
+    label_tokens = count_static(_SECTION_LABELS, enc)
+
+    goal, goal_tokens = _fit_text(user_goal or "", _setting("prompt_goal_tokens", 1000), enc)
+    hist, history_tokens = _fit_history(history, _setting("prompt_history_tokens", 800), enc)
+    with metrics.stage("summarize_dom"):
+        hints = _search_hints(dom)
+        hint_tokens = count_json_tokens(hints, enc)
+        left = budget - system_tokens - label_tokens - goal_tokens - history_tokens - hint_tokens
+        controls_budget = max(0, min(_dom_limits()[1], left))
+        slim = _summarize_dom(
+            dom, goal=user_goal, token_budget=controls_budget, cost=lambda c: count_json_tokens(c, enc) + 1,
+        )
+    metrics.observe_dom(len(dom), len(slim))
+
+    hist_json = json.dumps(hist, ensure_ascii=False) if hist else ""
+    if vault is not None:
+        with metrics.stage("pii_mask"):
+            goal = vault.mask(goal)
+            hist_json = vault.mask(hist_json)
+            slim = vault.mask_controls(slim)
+            hints = vault.mask_controls(hints, fields=("name",))
+        vault.report()
+
+    with metrics.stage("prompt_json"):
+        controls_json = json.dumps(slim, ensure_ascii=False)
+        user = (
+            f"USER_GOAL:\n{goal}\n\n"
+            + (f"HISTORY (steps already executed, oldest first):\n{hist_json}\n\n" if hist_json else "")
+            + f"HINTS (possible search inputs):\n{json.dumps(hints, ensure_ascii=False)}\n\n"
+            + f"SNAPSHOT_CONTROLS (trimmed):\n{controls_json}"
+        )
+        controls_tokens = count_tokens(controls_json, enc)
+
+    parts = {
+        "system": system_tokens,
+        "goal": goal_tokens,
+        "history": history_tokens,
+        "hints": hint_tokens,
+        "controls": controls_tokens,
+    }
+    metrics.observe_prompt("plan", parts)
+    breakdown: Dict[str, Any] = dict(parts)
+    breakdown.update({
+        "total": sum(parts.values()) + label_tokens,
+        "budget": budget,
+        "static_prefix": system_tokens,
+        "controls_shown": len(slim),
+        "controls_total": len(dom),
+        "history_steps": len(hist),
+        "tokenizer": tokenizer_backend(enc),
+    })
+    messages = [
+        {"role": "system", "content": _PLAN_SYSTEM},
         {"role": "user", "content": user},
     ]
+    return messages, breakdown
 
 
-# We import your LLM builder (Azure OpenAI via LangChain), but keep it optional.
+def _build_llm_prompt(
+    user_goal: str,
+    dom: List[Dict[str, Any]],
+    vault: Optional[MaskVault] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, str]]:
+    """Construct a strict, JSON-only planning prompt (messages only; see _build_plan_prompt)."""
+    return _build_plan_prompt(user_goal, dom, vault, history)[0]
+
+
+# --------- Plan cache ---------
+_plan_cache: Optional[LRUCache] = None
+# identical concurrent plan requests share one LLM call
+plan_flight = SingleFlight("plan")
+
+def get_plan_cache() -> Optional[LRUCache]:
+    """
+    Process-wide plan cache, built lazily from settings. Returns None when disabled.
+    """
+    global _plan_cache
+    if _plan_cache is None:
+        if not _setting("plan_cache_enabled", False):
+            return None
+        path = _setting("plan_cache_path", None)
+        disk = DiskTier(path, table="plan_cache") if path else None
+        _plan_cache = LRUCache(
+            maxsize=_setting("plan_cache_size", 512),
+            ttl=_setting("plan_cache_ttl", 900.0),
+            disk=disk,
+        )
+    return _plan_cache
+
+def _normalize_goal(prompt: str) -> str:
+    return " ".join((prompt or "").lower().split())
+
+def _dom_fingerprint(dom: List[Dict[str, Any]]) -> str:
+    """
+    Structural hash of the raw snapshot: tag, role, name and selector only.
+    Visible text and hrefs are ignored because they change between visits
+    (counters, timestamps, session tokens) while the layout stays the same.
+    Nothing is ranked or slimmed, so a cache hit does not pay for the BM25 pass
+    the prompt builder runs on a miss.
+    """
+    fields = ("tag", "role", "name", "selector")
+    if hasattr(dom, "column"):  # compact_dom.CompactDom: read columns, skip building dicts
+        rows = zip(*(dom.column(f) for f in fields))
+    else:
+        rows = ((c.get("tag"), c.get("role"), c.get("name"), c.get("selector")) for c in dom if isinstance(c, dict))
+    h = hashlib.sha1()
+    for parts in rows:
+        h.update("\x1f".join(str(p or "") for p in parts).encode("utf-8", "replace"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+def _plan_cache_key(prompt: str, dom: List[Dict[str, Any]], history: Optional[List[Dict[str, Any]]] = None) -> str:
+    key = f"{_normalize_goal(prompt)}|{_dom_fingerprint(dom)}"
+    if history:
+        # the prompt shows the executed steps, so plans for different histories differ
+        key += "|" + hashlib.sha1(json.dumps(history, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return key
+
+
+# We import the shared LLM client (Azure OpenAI via LangChain), but keep it optional.
 def _build_llm():
     try:
-        from llm import build_chat_llm
-        return build_chat_llm()
+        from llm import get_chat_llm
+        return get_chat_llm()
     except Exception:
         return None
 
 
-async def _llm_plan(prompt: str, dom: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+class _LatencyWindow:
+    """Recent successful LLM plan latencies (seconds), for hedging thresholds and estimates."""
+
+    def __init__(self, size: int = 200):
+        self.samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        xs = sorted(self.samples)
+        return xs[min(len(xs) - 1, int(p / 100.0 * len(xs)))]
+
+_plan_latency = _LatencyWindow()
+
+
+async def _llm_plan(llm, messages: List[Dict[str, str]], vault: Optional[MaskVault]) -> Optional[List[Dict[str, Any]]]:
     """
     Ask the LLM to produce a multi-step JSON plan. Returns a list of raw action dicts or None.
+    Raises LLMUnavailable when the call was shed or failed after its retries.
     """
-    llm = _build_llm()
-    if llm is None:
-        return None
-
-    messages = _build_llm_prompt(prompt, dom)
     try:
-        # LangChain ChatModels accept list[dict] as messages in .invoke for recent versions.
-        resp = llm.invoke(messages)
+        # LangChain ChatModels accept list[dict] as messages in .ainvoke for recent versions.
+        from llm import ainvoke_llm
+        t0 = time.perf_counter()
+        resp = await ainvoke_llm(messages, llm, op="plan")
+        _plan_latency.add(time.perf_counter() - t0)
         text = getattr(resp, "content", None) or (resp if isinstance(resp, str) else None)
         data = _safe_json_from_text(text or "")
         steps = data.get("steps") if isinstance(data, dict) else None
         if isinstance(steps, list) and steps:
-            return steps
+            # placeholders in selectors/text go back to the real values before normalizing
+            return vault.unmask(steps) if vault is not None else steps
+        metrics.inc("plan_fallback", reason="invalid")
         return None
+    except LLMUnavailable:
+        raise
     except Exception:
+        metrics.inc("plan_fallback", reason="llm_error")
+        return None
+
+
+async def _hedged_llm_plan(
+    prompt: str, dom: List[Dict[str, Any]], hedge: bool, history: Optional[List[Dict[str, Any]]] = None
+) -> tuple[Optional[List[Dict[str, Any]]], Dict[str, Any]]:
+    """
+    _llm_plan, optionally hedged: if the first call outlives the recent p95 latency,
+    fire a second identical call and take whichever returns a usable plan first.
+    The prompt is built once and shared by both calls; its token breakdown is in the meta.
+    """
+    llm = _build_llm()
+    if llm is None:
+        metrics.inc("plan_fallback", reason="no_llm")
+        return None, {"hedged": False}
+    vault = new_vault()
+    with metrics.stage("prompt_build"):
+        messages, tokens = _build_plan_prompt(prompt, dom, vault, history)
+    meta: Dict[str, Any] = {"hedged": False, "prompt_tokens": tokens}
+
+    p95 = _plan_latency.percentile(95)
+    min_samples = _setting("plan_hedge_min_samples", 20)
+    if not hedge or p95 is None or len(_plan_latency.samples) < min_samples:
+        return await _llm_plan(llm, messages, vault), meta
+
+    first = asyncio.ensure_future(_llm_plan(llm, messages, vault))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=p95)
+        if done:
+            return first.result(), meta
+        metrics.inc("plan_hedge", result="sent")
+        second = asyncio.ensure_future(_llm_plan(llm, messages, vault))
+        tasks.add(second)
+        pending = set(tasks)
+        meta["hedged"] = True
+        failed: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is not None:
+                    failed = t.exception()  # the other call may still succeed
+                    continue
+                steps = t.result()
+                if steps:
+                    winner = "hedge" if t is second else "primary"
+                    metrics.inc("plan_hedge", result=f"{winner}_won")
+                    return steps, {**meta, "hedge_winner": winner, "hedge_after_ms": round(p95 * 1000, 1)}
+        if failed is not None and all(t.exception() is not None for t in tasks):
+            raise failed
+        return None, {**meta, "hedge_winner": None}
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+def _reliability_view(host: Optional[str]) -> Optional[HostReliability]:
+    index = get_reliability() if host else None
+    return index.view(host) if index is not None else None
+
+
+def _selector_index(dom: List[Dict[str, Any]], host: Optional[str] = None) -> Optional[SelectorIndex]:
+    """
+    Target index for this snapshot (built lazily, shared by every normalize_plan call
+    of a request), with what step outcomes taught us about the host's targets.
+    """
+    if not dom or not _setting("plan_validate_steps", True):
+        return None
+    return SelectorIndex(dom, min_score=_setting("selector_match_min_score", 0.6), reliability=_reliability_view(host))
+
+
+def _recheck_cached(cached: List[Dict[str, Any]], dom: List[Dict[str, Any]], host: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """A cached plan re-normalized when one of its targets has turned unreliable since it was cached; else None."""
+    view = _reliability_view(host)
+    if view is None or not view.flags(cached):
         return None
+    metrics.inc("plan_cache", result="rechecked")
+    return normalize_plan([dict(s) for s in cached], _selector_index(dom, host))
+
+
+def _cache_late_plan(task: asyncio.Future, cache: Optional[LRUCache], key: str, index: Optional[SelectorIndex] = None):
+    """A deadline-losing LLM call still finishes in the background; keep its plan for next time."""
+    if cache is None or task.cancelled() or task.exception() is not None:
+        return
+    steps, _ = task.result()
+    if steps:
+        normalized = normalize_plan([dict(s) for s in steps if isinstance(s, dict)], index)
+        if normalized:
+            cache.set(key, normalized)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
 
 
 # --------- Public API (called by FastAPI endpoints) ---------
-async def generate_plan(prompt: str, dom: List[Dict[str, Any]]) -> PlanModel:
+async def generate_plan(
+    prompt: str,
+    dom: List[Dict[str, Any]],
+    use_cache: bool = True,
+    deadline_ms: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    host: Optional[str] = None,
+) -> PlanModel:
     """
     Multi-step, site-agnostic planner.
-    - First, try LLM to decompose and plan.
-    - If unavailable or invalid, fall back to your previous heuristic.
-    - Always normalize and return PlanModel.
+    - Serve from the plan cache when the same goal hits the same page layout.
+    - Share one LLM call between identical concurrent requests.
+    - Otherwise try LLM to decompose and plan.
+    - With a deadline, goals the heuristic is confident about race the LLM and the
+      heuristic plan is returned if the LLM misses the deadline.
+    - If unavailable or invalid, fall back to your previous heuristic. When the model
+      is overloaded (LLMUnavailable) the error propagates (503 + Retry-After) unless
+      a confident heuristic was racing it.
+    - Always normalize and return PlanModel (plan.meta says which path produced it
+      and, for LLM plans, the prompt's token breakdown).
+    `history` is the list of steps already executed, shown to the model within its budget.
+    `host` selects the target reliability learned from that site's step outcomes.
     """
-    # 1) Try LLM
-    steps: Optional[List[Dict[str, Any]]] = await _llm_plan(prompt, dom)
+    t0 = time.perf_counter()
+    if deadline_ms is None:
+        deadline_ms = _setting("plan_deadline_ms", 0)
+    if hedge is None:
+        hedge = _setting("plan_hedge", False)
+
+    # 0) Cache lookup (goal + structural DOM fingerprint + history)
+    key = _plan_cache_key(prompt, dom, history)
+    cache = get_plan_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(key)
+        metrics.inc("plan_cache", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            cached = _recheck_cached(cached, dom, host) or cached
+            return PlanModel(
+                steps=[ActionModel(**s) for s in cached],
+                meta={"path": "cache", "elapsed_ms": _ms(time.perf_counter() - t0)},
+            )
+
+    # 1) Try LLM (coalesced with identical in-flight requests), racing the heuristic
+    #    when a deadline is set and the heuristic is confident
+    heuristic = _heuristic_steps(prompt, dom)
+    index = _selector_index(dom, host)
+    llm_task = asyncio.ensure_future(plan_flight.do(key, lambda: _hedged_llm_plan(prompt, dom, hedge, history)))
+    racing = bool(deadline_ms) and _heuristic_confident(prompt)
+    if racing:
+        done, _ = await asyncio.wait({llm_task}, timeout=deadline_ms / 1000.0)
+        if not done:
+            llm_task.add_done_callback(lambda t: _cache_late_plan(t, cache, key, index))
+            elapsed = time.perf_counter() - t0
+            p50 = _plan_latency.percentile(50)
+            metrics.inc("plan_race", winner="heuristic")
+            meta = {"path": "heuristic", "reason": "llm_deadline", "deadline_ms": deadline_ms,
+                    "elapsed_ms": _ms(elapsed)}
+            if p50 is not None:
+                meta["time_saved_ms_est"] = _ms(max(0.0, p50 - elapsed))
+            return PlanModel(steps=[ActionModel(**s) for s in normalize_plan(heuristic, index)], meta=meta)
+        metrics.inc("plan_race", winner="llm")
+    try:
+        steps, llm_meta = await llm_task
+    except LLMUnavailable as e:
+        if not racing:
+            raise
+        metrics.inc("plan_fallback", reason=e.reason)
+        steps, llm_meta = None, {"reason": "llm_unavailable"}
+    if steps:
+        # the list is shared with coalesced callers; give each its own step dicts
+        steps = [dict(s) for s in steps if isinstance(s, dict)]
+    from_llm = bool(steps)
 
     # 2) Offline fallback (your original logic)
     if not steps:
-        if _is_search_prompt(prompt):
-            q = _extract_query(prompt)
-            steps = [
-                {"action": "click", "query": {"role": "combobox", "name": "Search"}},
-                {"action": "type",  "query": {"role": "combobox", "name": "Search"}, "text": q, "enter": True},
-                {"action": "waitForText", "text": q},
-                {"action": "done"},
-            ]
-        else:
-            steps = [{"action": "done"}]
-
-    # 3) Normalize (dedupe, clamp, coerce types) using your existing tool
-    normalized = normalize_plan(steps)
-
-    return PlanModel(steps=[ActionModel(**s) for s in normalized])
+        steps = heuristic
+
+    # 3) Normalize (dedupe, clamp, coerce types) and check targets against the snapshot
+    normalized = normalize_plan(steps, index)
+
+    # 4) Only LLM plans are cached; the heuristic is cheap and caching it would pin a failure
+    if cache is not None and from_llm and normalized:
+        cache.set(key, normalized)
+
+    meta = {"path": "llm" if from_llm else "heuristic", "elapsed_ms": _ms(time.perf_counter() - t0), **llm_meta}
+    return PlanModel(steps=[ActionModel(**s) for s in normalized], meta=meta)
+
+
+async def stream_plan(
+    prompt: str,
+    dom: List[Dict[str, Any]],
+    use_cache: bool = True,
+    history: Optional[List[Dict[str, Any]]] = None,
+    host: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming planner: yields {"step": {...}} as soon as each step of the model's
+    {"steps":[...]} output is complete and has passed the per-step normalization,
+    then a final {"done": true, "meta": {...}}. Falls back to the heuristic plan
+    when the model is unavailable or produces no usable step.
+    """
+    t0 = time.perf_counter()
+    key = _plan_cache_key(prompt, dom, history)
+    cache = get_plan_cache() if use_cache else None
+    cached = cache.get(key) if cache is not None else None
+    if cache is not None:
+        metrics.inc("plan_cache", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        for s in _recheck_cached(cached, dom, host) or cached:
+            yield {"step": ActionModel(**s).model_dump()}
+        yield {"done": True, "meta": {"path": "cache", "elapsed_ms": _ms(time.perf_counter() - t0)}}
+        return
+
+    emitted: List[Dict[str, Any]] = []
+    first_ms = None
+    tokens = None
+    reason = None
+    complete = False  # the model closed its JSON object and nothing failed: safe to cache
+    llm = _build_llm()
+    if llm is not None:
+        from llm import astream_llm
+        vault = new_vault()
+        with metrics.stage("prompt_build"):
+            messages, tokens = _build_plan_prompt(prompt, dom, vault, history)
+        parser = StepStreamParser()
+        norm = StepNormalizer(_selector_index(dom, host))
+        try:
+            async for piece in astream_llm(messages, llm, op="plan_stream"):
+                for raw in parser.feed(piece):
+                    if vault is not None:
+                        raw = vault.unmask(raw)
+                    for s in norm.push(raw):
+                        try:
+                            step = ActionModel(**s).model_dump()
+                        except Exception:
+                            continue
+                        if first_ms is None:
+                            first_ms = _ms(time.perf_counter() - t0)
+                        emitted.append(s)
+                        yield {"step": step}
+                if parser.done:
+                    break
+            for s in norm.flush():
+                emitted.append(s)
+                yield {"step": ActionModel(**s).model_dump()}
+            complete = parser.done
+            if not complete:
+                metrics.inc("plan_cache", result="skip_truncated")
+        except LLMUnavailable as e:
+            # the 200 stream has already started: degrade to the heuristic and say why
+            metrics.inc("plan_fallback", reason=e.reason)
+            reason = "llm_unavailable"
+        except Exception:
+            metrics.inc("plan_fallback", reason="llm_error")
+    else:
+        metrics.inc("plan_fallback", reason="no_llm")
+
+    path = "llm"
+    if not emitted:
+        path = "heuristic"
+        for s in normalize_plan(_heuristic_steps(prompt, dom), _selector_index(dom, host)):
+            yield {"step": ActionModel(**s).model_dump()}
+    elif cache is not None and complete:
+        cache.set(key, normalize_plan(emitted))
+
+    meta = {"path": path, "elapsed_ms": _ms(time.perf_counter() - t0)}
+    if first_ms is not None:
+        meta["first_step_ms"] = first_ms
+    if tokens is not None:
+        meta["prompt_tokens"] = tokens
+    if reason is not None and not emitted:
+        meta["reason"] = reason
+    yield {"done": True, "meta": meta}
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import json
+import math
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+Control = Dict[str, Any]
+
+_TOKEN_RE = re.compile(r"[\w★]+", re.UNICODE)
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "to", "of", "in", "on", "for", "with", "at", "by", "from",
+    "is", "it", "this", "that", "me", "my", "i", "please", "then", "go", "page",
+    "search", "find", "look", "up", "google", "click", "open", "type", "enter",
+}
+
+
+def query_terms(goal: str) -> List[str]:
+    """Lower-cased, de-duplicated content words of the goal."""
+    seen: List[str] = []
+    for t in _TOKEN_RE.findall((goal or "").lower()):
+        if len(t) < 2 or t in _STOPWORDS or t in seen:
+            continue
+        seen.append(t)
+    return seen[:16]
+
+
+def _doc_text(c: Control) -> str:
+    # name and role weigh more than body text: repeat them
+    name = str(c.get("name") or "")[:160]
+    role = str(c.get("role") or c.get("tag") or "")
+    text = str(c.get("text") or "")[:240]
+    href = str(c.get("href") or "")[:160]
+    return f"{role} {name} {name} {text} {href}".lower()
+
+
+def _doc_texts(dom: Sequence[Control]) -> List[str]:
+    """_doc_text for every control; columnar snapshots are read column-wise without building dicts."""
+    if not hasattr(dom, "lower"):
+        return [_doc_text(c) for c in dom]
+    return [
+        f"{role or tag or ''} {(name or '')[:160]} {(name or '')[:160]} {(text or '')[:240]} {(href or '')[:160]}".lower()
+        for role, tag, name, text, href in zip(
+            dom.column("role"), dom.column("tag"), dom.column("name"), dom.column("text"), dom.column("href")
+        )
+    ]
+
+
+def bm25_scores(
+    dom: Sequence[Control],
+    terms: Sequence[str],
+    k1: float = 1.2,
+    b: float = 0.75,
+) -> List[float]:
+    """
+    BM25 over role/name/text/href. Term frequency is counted with str.count on the
+    lower-cased field text (substring match, so 'chang' also hits 'change'), which keeps
+    scoring in C and fast enough for 20k-control snapshots.
+    """
+    n = len(dom)
+    if not n or not terms:
+        return [0.0] * n
+    docs = _doc_texts(dom)
+    lens = [len(d) or 1 for d in docs]
+    avg = sum(lens) / n
+    tfs = [[d.count(t) for d in docs] for t in terms]
+    scores = [0.0] * n
+    for tf in tfs:
+        df = sum(1 for x in tf if x)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for i, f in enumerate(tf):
+            if f:
+                norm = k1 * (1 - b + b * lens[i] / avg)
+                scores[i] += idf * (f * (k1 + 1)) / (f + norm)
+    return scores
+
+
+def estimate_tokens(obj: Any) -> int:
+    return len(json.dumps(obj, ensure_ascii=False)) // 4 + 1
+
+
+def select_controls(
+    dom: Sequence[Control],
+    goal: str,
+    limit: int,
+    token_budget: int,
+    anchors: Iterable[int] = (),
+    slim=None,
+    cost: Optional[Callable[[Any], int]] = None,
+) -> List[int]:
+    """
+    Pick the indexes of the controls to show the planner:
+      1) structural anchors (e.g. search boxes) always,
+      2) then controls by descending BM25 score against the goal,
+      3) then remaining controls in document order,
+    until `limit` controls or `token_budget` (estimated on the slim form, or counted
+    with `cost`) is reached.
+    Indexes are returned in document order.
+    """
+    n = len(dom)
+    scores = bm25_scores(dom, query_terms(goal))
+    ranked = sorted((i for i in range(n) if scores[i] > 0), key=lambda i: -scores[i])
+
+    picked: List[int] = []
+    taken = set()
+    used = 0
+
+    def take(i: int) -> bool:
+        nonlocal used
+        if i in taken or not (0 <= i < n):
+            return True
+        c = (cost or estimate_tokens)(slim(dom[i]) if slim else dom[i])
+        if picked and used + c > token_budget:
+            return False
+        picked.append(i)
+        taken.add(i)
+        used += c
+        return len(picked) < limit
+
+    def fill(order: Iterable[int]) -> bool:
+        for i in order:
+            if not take(i):
+                return False
+        return True
+
+    for order in (anchors, ranked, range(n)):
+        if not fill(order):
+            break
+    return sorted(picked)
+
@@ -0,0 +1,339 @@
+"""
+Per-host reliability of plan-step targets, learned from step outcomes.
+
+The extension reports what happened to each executed click/type step (success,
+not found, timed out). Every target is tracked per host under a compact key --
+"css:<selector>" for selectors, "q:<role>|<normalized name>" for queries -- as
+an exponentially decayed (successes, attempts) pair, so old failures fade once a
+site changes. SelectorIndex/StepResolver read a HostReliability view to rank
+candidates and to swap selectors that keep failing for their role/name query.
+
+Recording is a dict lookup and a few float operations (thousands of reports per
+second are cheap); only entries changed since the last snapshot are written to
+SQLite by a background task.
+"""
+from __future__ import annotations
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+from selector_index import norm_name
+
+# extension outcome -> success?
+_OUTCOMES = {
+    "success": True,
+    "ok": True,
+    "not_found": False,
+    "selector-not-found": False,
+    "timeout": False,
+    "timed_out": False,
+    "no-response": False,
+    "error": False,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS target_reliability (
+    host    TEXT NOT NULL,
+    target  TEXT NOT NULL,
+    success REAL NOT NULL,
+    total   REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (host, target)
+)
+"""
+
+# several workers snapshot into the same table: the most recently updated row wins
+_UPSERT = """
+INSERT INTO target_reliability (host, target, success, total, updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(host, target) DO UPDATE SET
+    success = excluded.success, total = excluded.total, updated = excluded.updated
+WHERE excluded.updated >= target_reliability.updated
+"""
+
+
+def selector_key(selector: Optional[str]) -> str:
+    return "css:" + (selector or "")
+
+
+def query_key(query: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not isinstance(query, dict):
+        return None
+    name = norm_name(str(query.get("name") or ""))
+    if not name:
+        return None
+    return f"q:{str(query.get('role') or '').lower()}|{name}"
+
+
+class HostReliability:
+    """Read-only view of one host's targets, decayed to the time the view was taken."""
+
+    def __init__(self, entries: Dict[str, List[float]], half_life: float, min_reports: float, threshold: float):
+        self._entries = entries
+        self._half_life = half_life
+        self._min_reports = min_reports
+        self._threshold = threshold
+        self._now = time.time()
+
+    def rate(self, key: Optional[str]) -> Optional[float]:
+        """Smoothed success rate, or None while the target has too little (recent) evidence."""
+        e = self._entries.get(key) if key else None
+        if e is None:
+            return None
+        success, total, updated = e
+        if total * 0.5 ** ((self._now - updated) / self._half_life) < self._min_reports:
+            return None
+        return (success + 1.0) / (total + 2.0)
+
+    def unreliable(self, key: Optional[str]) -> bool:
+        r = self.rate(key)
+        return r is not None and r < self._threshold
+
+    def weight(self, key: Optional[str]) -> float:
+        """Score multiplier for ranking candidates: 1.0 when unknown, 0.75 (always fails) .. 1.25 (always works)."""
+        r = self.rate(key)
+        return 1.0 if r is None else 0.75 + 0.5 * r
+
+    def selector_weight(self, selector: Optional[str]) -> float:
+        return self.weight(selector_key(selector)) if selector else 1.0
+
+    def selector_unreliable(self, selector: Optional[str]) -> bool:
+        return bool(selector) and self.unreliable(selector_key(selector))
+
+    def query_unreliable(self, query: Optional[Dict[str, Any]]) -> bool:
+        return self.unreliable(query_key(query))
+
+    def flags(self, steps: Iterable[Dict[str, Any]]) -> bool:
+        """True when any step targets a selector or query known to be unreliable."""
+        return any(self.selector_unreliable(s.get("selector")) or self.query_unreliable(s.get("query")) for s in steps)
+
+
+class ReliabilityIndex:
+    """
+    In-memory (host -> target -> [success, total, updated]) table. Hosts are kept
+    LRU (max_hosts) and each host keeps its most recently updated max_targets.
+    """
+
+    def __init__(
+        self,
+        half_life: float = 3 * 86400.0,
+        min_reports: float = 3.0,
+        threshold: float = 0.5,
+        max_hosts: int = 5000,
+        max_targets: int = 2000,
+    ):
+        self.half_life = max(1.0, half_life)
+        self.min_reports = min_reports
+        self.threshold = threshold
+        self.max_hosts = max_hosts
+        self.max_targets = max_targets
+        self._hosts: "OrderedDict[str, Dict[str, List[float]]]" = OrderedDict()
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.rejected = 0
+        self.saved = 0
+
+    def __len__(self) -> int:
+        return sum(len(t) for t in self._hosts.values())
+
+    # ---- recording ----
+    def _targets(self, host: str) -> Dict[str, List[float]]:
+        targets = self._hosts.get(host)
+        if targets is None:
+            targets = self._hosts[host] = {}
+            if len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return targets
+
+    def _update(self, host: str, targets: Dict[str, List[float]], key: str, ok: bool, now: float):
+        e = targets.get(key)
+        if e is None:
+            targets[key] = [1.0 if ok else 0.0, 1.0, now]
+            if len(targets) > self.max_targets:
+                self._prune(host, targets)
+        else:
+            decay = 0.5 ** ((now - e[2]) / self.half_life)
+            e[0] = e[0] * decay + (1.0 if ok else 0.0)
+            e[1] = e[1] * decay + 1.0
+            e[2] = now
+        self._dirty.add((host, key))
+
+    def _prune(self, host: str, targets: Dict[str, List[float]]):
+        # drop the least recently updated tenth in one go, so pruning is rare
+        keep = sorted(targets.items(), key=lambda kv: kv[1][2], reverse=True)[: self.max_targets * 9 // 10]
+        targets.clear()
+        targets.update(keep)
+        self._dirty = {d for d in self._dirty if d[0] != host or d[1] in targets}
+
+    def record(self, host: str, outcome: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """
+        One step outcome: {selector?, query?, outcome, via?}. `via` is the target
+        that found the element: "selector", "query" (the selector missed and the
+        query rescued the step) or "active" (neither matched and a type step fell
+        back to the focused element). Without it the selector is assumed, as the
+        extension tries it first. A success credits the target that matched and
+        counts a selector the query had to rescue as a selector failure; a
+        failure, or an "active" fallback, counts against every target the step named.
+        """
+        ok = _OUTCOMES.get(str(outcome.get("outcome") or outcome.get("error") or "").lower())
+        sel = outcome.get("selector")
+        qkey = query_key(outcome.get("query"))
+        if ok is None or not host or not (sel or qkey):
+            self.rejected += 1
+            return False
+        now = time.time() if now is None else now
+        targets = self._targets(host)
+        via = outcome.get("via")
+        if ok and via == "active":
+            ok = False  # the step worked, but none of its targets did
+        if ok:
+            if via == "query" and qkey:
+                self._update(host, targets, qkey, True, now)
+                if sel:
+                    self._update(host, targets, selector_key(sel), False, now)
+            else:
+                self._update(host, targets, selector_key(sel) if sel else qkey, True, now)
+        else:
+            if sel:
+                self._update(host, targets, selector_key(sel), False, now)
+            if qkey:
+                self._update(host, targets, qkey, False, now)
+        self.recorded += 1
+        return True
+
+    def record_many(self, host: str, outcomes: Iterable[Any]) -> int:
+        now = time.time()
+        n = sum(1 for o in outcomes if isinstance(o, dict) and self.record(host, o, now))
+        metrics.inc("step_outcomes", n)
+        return n
+
+    # ---- reads ----
+    def view(self, host: Optional[str]) -> Optional[HostReliability]:
+        targets = self._hosts.get(host or "")
+        if not targets:
+            return None
+        return HostReliability(targets, self.half_life, self.min_reports, self.threshold)
+
+    def report(self, host: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Targets of a host with enough evidence, least reliable first."""
+        view = self.view(host)
+        if view is None:
+            return []
+        rows = []
+        for key, (success, total, updated) in self._hosts[host].items():
+            rate = view.rate(key)
+            if rate is not None:
+                rows.append({"target": key, "rate": round(rate, 3), "reports": round(total, 1), "updated": updated})
+        rows.sort(key=lambda r: r["rate"])
+        return rows[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hosts": len(self._hosts),
+            "targets": len(self),
+            "recorded": self.recorded,
+            "rejected": self.rejected,
+            "dirty": len(self._dirty),
+            "saved": self.saved,
+        }
+
+    # ---- snapshots ----
+    def load(self, path: str) -> int:
+        """Read a snapshot; entries older than ten half-lives are skipped."""
+        cutoff = time.time() - 10 * self.half_life
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute(_SCHEMA)
+            rows = conn.execute(
+                "SELECT host, target, success, total, updated FROM target_reliability WHERE updated >= ? ORDER BY updated",
+                (cutoff,),
+            ).fetchall()
+        finally:
+            conn.close()
+        for host, target, success, total, updated in rows:
+            targets = self._targets(host)
+            targets[target] = [success, total, updated]
+            if len(targets) > self.max_targets:
+                self._prune(host, targets)
+        return len(rows)
+
+    def _take_dirty(self) -> List[Tuple[str, str, float, float, float]]:
+        # copied on the event loop thread, written by a worker thread
+        rows = []
+        for host, key in self._dirty:
+            e = self._hosts.get(host, {}).get(key)
+            if e is not None:
+                rows.append((host, key, e[0], e[1], e[2]))
+        self._dirty = set()
+        return rows
+
+    @staticmethod
+    def _write(path: str, rows: List[Tuple[str, str, float, float, float]]):
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            with conn:
+                conn.executemany(_UPSERT, rows)
+        finally:
+            conn.close()
+
+    async def save(self, path: str) -> int:
+        rows = self._take_dirty()
+        if rows:
+            try:
+                await asyncio.to_thread(self._write, path, rows)
+            except sqlite3.Error:
+                self._dirty.update((r[0], r[1]) for r in rows)  # try again next time
+                return 0
+            self.saved += len(rows)
+        return len(rows)
+
+    def start(self, path: str, interval: float):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._snapshot_loop(path, interval))
+
+    async def stop(self, path: Optional[str] = None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if path:
+            await self.save(path)
+
+    async def _snapshot_loop(self, path: str, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.save(path)
+
+
+_index: Optional[ReliabilityIndex] = None
+_index_loaded = False
+
+
+def get_reliability() -> Optional[ReliabilityIndex]:
+    """Process-wide index built from settings; None when learning from outcomes is off."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        try:
+            from settings import settings
+        except Exception:
+            settings = None  # planner can run without settings (benchmarks)
+        if settings is not None and settings.reliability_enabled:
+            _index = ReliabilityIndex(
+                half_life=settings.reliability_half_life,
+                min_reports=settings.reliability_min_reports,
+                threshold=settings.reliability_threshold,
+                max_hosts=settings.reliability_max_hosts,
+                max_targets=settings.reliability_max_targets,
+            )
+        _index_loaded = True
+    return _index
@@ -0,0 +1,375 @@
+"""
+Per-snapshot index of plan-step targets.
+
+The LLM names targets as a cssPath() selector from the snapshot or as
+query:{role, name}. SelectorIndex resolves selectors by exact lookup and queries
+by the controls' names: first an exact (case-insensitive) key, then controls
+sharing a word with the query (one regex scan over the distinct names), then
+difflib for typos. Candidates are filtered by role and
+scored like the extension's scoreAgainstName(); role compatibility mirrors
+roleSelector() in extension/content/dom.js.
+
+StepResolver applies the index to a plan, in order: every target on the current
+page is checked, queries get a concrete selector, bad selectors are replaced and
+steps that cannot match are repaired (type -> best text input) or dropped. Steps
+after the first action that may change the page are left untouched, since their
+targets are not in this snapshot.
+
+With a reliability view (reliability.HostReliability, learned from the outcomes
+the extension reports for this host) candidates are ranked by their record as
+well as their name, and a selector that keeps failing is swapped for the
+role/name query of its control, which the extension resolves at run time.
+"""
+from __future__ import annotations
+import bisect
+import difflib
+import itertools
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import metrics
+
+Step = Dict[str, Any]
+
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+# hints that hand-written selectors carry about the element: #id and [name|aria-label|...=value]
+_SELECTOR_HINT_RE = re.compile(r"""#([\w-]+)|\[(?:name|aria-label|placeholder|title|id)\s*[*^$~|]?=\s*["']?([^"'\]]+)""")
+
+_IMPLICIT_ROLES = {"a": "link", "button": "button", "input": "textbox", "textarea": "textbox", "select": "combobox"}
+
+# query role -> (explicit roles, tags) accepted by the extension's roleSelector()
+_ROLE_TARGETS: Dict[str, Tuple[Set[str], Set[str]]] = {
+    "textbox": ({"textbox", "searchbox"}, {"input", "textarea"}),
+    "searchbox": ({"textbox", "searchbox"}, {"input", "textarea"}),
+    "button": ({"button"}, {"button", "input"}),
+    "link": ({"link"}, {"a"}),
+    "combobox": ({"combobox"}, {"select", "input"}),
+}
+_TEXT_INPUT_ROLES = {"textbox", "searchbox", "combobox"}
+
+# actions after which the rest of the plan runs against a page we have not seen
+# (clicks and type+enter are decided per step in StepResolver)
+_PAGE_CHANGING = {"navigate", "pressEnter"}
+
+
+def norm_name(text: Optional[str]) -> str:
+    """Lower-cased words only ("Save & Close" -> "save close"), capped like the slimmed snapshot."""
+    return _NON_WORD_RE.sub(" ", (text or "")[:240].lower()).strip()[:120]
+
+
+def _name_score(query: str, cand: str) -> float:
+    """How well a control's normalized name/text matches a normalized query name, 0..1."""
+    if not cand:
+        return 0.0
+    if cand == query:
+        return 1.0
+    if min(len(query), len(cand)) >= 3 and (cand.startswith(query) or query.startswith(cand)):
+        return 0.9
+    if len(query) >= 3 and query in cand:
+        return 0.8
+    q_tokens = query.split()
+    c_tokens = set(cand.split())
+    overlap = sum(1 for t in q_tokens if t in c_tokens)
+    return 0.75 * overlap / len(q_tokens) if q_tokens else 0.0
+
+
+class SelectorIndex:
+    """
+    Lookups over one snapshot (list of controls or CompactDom). Nothing is built
+    until the first lookup, so plans that never need it (cache hits) cost nothing.
+    """
+
+    def __init__(self, dom: Sequence[Dict[str, Any]], min_score: float = 0.6, max_candidates: int = 512, reliability=None):
+        self.dom = dom
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.reliability = reliability  # reliability.HostReliability for the page's host, or None
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self.dom)
+
+    def _columns(self) -> Tuple[List[Any], ...]:
+        dom = self.dom
+        if hasattr(dom, "column"):
+            return tuple(dom.column(f) for f in ("tag", "role", "name", "text", "selector"))
+        return tuple([c.get(f) for c in dom] for f in ("tag", "role", "name", "text", "selector"))
+
+    def _build(self):
+        self._tags, self._roles, names, texts, self._selectors = self._columns()
+        self._names, self._texts = names, texts
+        self._norm: Dict[int, Tuple[str, str]] = {}
+        self._by_selector: Dict[str, int] = {}
+        for i, sel in enumerate(self._selectors):
+            if sel and sel not in self._by_selector:
+                self._by_selector[sel] = i
+        # exact (lower-cased, trimmed like _slim_control) names; the LLM copies most names
+        # verbatim from the prompt, so this is the common lookup. Texts only take part in
+        # scoring: the snapshot name already falls back to the visible text.
+        self._by_key: Dict[str, List[int]] = {}
+        setdefault = self._by_key.setdefault
+        for i, v in enumerate(names):
+            if v:
+                setdefault(v.strip()[:120].lower(), []).append(i)
+        self._by_key.pop("", None)
+        self._keys = list(self._by_key)
+        self._blob: Optional[str] = None
+        self._text_inputs: Optional[List[int]] = None
+        self._built = True
+
+    def _ensure(self):
+        if not self._built:
+            self._build()
+
+    # ---------------- lookups ----------------
+    def has_selector(self, selector: Optional[str]) -> bool:
+        if not selector:
+            return False
+        self._ensure()
+        return selector in self._by_selector
+
+    def selector(self, i: int) -> Optional[str]:
+        self._ensure()
+        return self._selectors[i]
+
+    def index_of(self, selector: Optional[str]) -> Optional[int]:
+        self._ensure()
+        return self._by_selector.get(selector or "")
+
+    def _role_of(self, i: int) -> Tuple[Optional[str], str]:
+        return (self._roles[i] or "").lower() or None, (self._tags[i] or "").lower()
+
+    def text_inputs(self) -> List[int]:
+        """Controls the extension can type into, in document order."""
+        self._ensure()
+        if self._text_inputs is None:
+            out = []
+            for i in range(len(self._tags)):
+                role, tag = self._role_of(i)
+                if (role or _IMPLICIT_ROLES.get(tag)) in _TEXT_INPUT_ROLES or tag == "textarea":
+                    out.append(i)
+            self._text_inputs = out
+        return self._text_inputs
+
+    def query_of(self, i: int) -> Optional[Dict[str, str]]:
+        """query:{role, name} the extension's resolveByQuery() would find control i by."""
+        name = (self._names[i] or self._texts[i] or "").strip()[:120]
+        if not name:
+            return None
+        role, tag = self._role_of(i)
+        return {"role": role or _IMPLICIT_ROLES.get(tag) or "", "name": name}
+
+    def is_text_input(self, i: int) -> bool:
+        role, tag = self._role_of(i)
+        return (role or _IMPLICIT_ROLES.get(tag)) in _TEXT_INPUT_ROLES or tag == "textarea"
+
+    def _normalized(self, i: int) -> Tuple[str, str]:
+        out = self._norm.get(i)
+        if out is None:
+            out = self._norm[i] = (norm_name(self._names[i]), norm_name(self._texts[i]))
+        return out
+
+    def _role_weight(self, query_role: str, i: int) -> float:
+        if not query_role:
+            return 1.0
+        role, tag = self._role_of(i)
+        targets = _ROLE_TARGETS.get(query_role)
+        if targets is None:
+            # the extension falls back to every snapshot control for roles it does not map
+            return 1.0 if role == query_role else 0.85
+        roles, tags = targets
+        if role in roles or (role is None and tag in tags):
+            return 1.0
+        return 0.0
+
+    def _fuzzy_candidates(self, name: str) -> List[int]:
+        """Controls sharing a word with the query (rarest words first), else difflib's closest keys."""
+        if self._blob is None:
+            # distinct keys, one per line: a word lookup is one C-level regex scan plus a bisect
+            self._blob = "\n".join(self._keys)
+            self._starts = list(itertools.accumulate((len(k) + 1 for k in self._keys[:-1]), initial=0))
+        blob, starts, keys = self._blob, self._starts, self._keys
+        found: List[int] = []
+        seen: Set[int] = set()
+        for tok in sorted(set(name.split()), key=blob.count):
+            # literal first so the regex engine can skip ahead; the left word boundary is checked here
+            for m in re.finditer(rf"{re.escape(tok)}(?![^\W_])", blob):
+                if m.start() and blob[m.start() - 1].isalnum():
+                    continue
+                for i in self._by_key[keys[bisect.bisect_right(starts, m.start()) - 1]]:
+                    if i not in seen:
+                        seen.add(i)
+                        found.append(i)
+                if len(found) >= self.max_candidates:
+                    return found[:self.max_candidates]
+        if not found:
+            # typos: difflib over the keys that share the first letter (typos rarely hit it)
+            same_start = [k for k in keys if k[:1] == name[:1]]
+            for key in difflib.get_close_matches(name, same_start, n=5, cutoff=0.75):
+                found.extend(self._by_key[key])
+        return found[:self.max_candidates]
+
+    def _score(self, name: str, query_role: str, i: int) -> float:
+        w = self._role_weight(query_role, i)
+        if not w:
+            return 0.0
+        cand_name, cand_text = self._normalized(i)
+        s = max(_name_score(name, cand_name), 0.95 * _name_score(name, cand_text))
+        if s < self.min_score:
+            key = cand_name or cand_text
+            if key and abs(len(key) - len(name)) <= max(3, len(name) // 4):
+                s = max(s, 0.9 * difflib.SequenceMatcher(None, name, key).ratio())
+        if "search" in name and self.is_text_input(i):
+            s += 0.05  # the extension strongly prefers text inputs for "search" names
+        return w * s
+
+    def _best(self, name: str, role: str, candidates: Iterable[int]) -> Tuple[Optional[int], float]:
+        best, best_score = None, 0.0
+        rel = self.reliability
+        for i in candidates:
+            s = self._score(name, role, i)
+            if rel is not None and s:
+                s *= rel.selector_weight(self._selectors[i])  # equally named controls: the one that works wins
+            if s > best_score and self._selectors[i]:
+                best, best_score = i, s
+        return best, best_score
+
+    def resolve(self, query: Optional[Dict[str, Any]]) -> Optional[Tuple[int, float]]:
+        """Best (control index, score) for query:{role, name}, or None below min_score."""
+        if not isinstance(query, dict):
+            return None
+        self._ensure()
+        role = str(query.get("role") or "").lower()
+        raw = str(query.get("name") or "")
+        name = norm_name(raw)
+        if not name:
+            # like the extension: no name means the first control of that role
+            for i in range(len(self._tags)):
+                if self._role_weight(role, i) == 1.0 and self._selectors[i]:
+                    return i, 1.0
+            return None
+        best, best_score = self._best(name, role, self._by_key.get(raw.strip()[:120].lower(), ()))
+        if best_score < 1.0:
+            fuzzy, fuzzy_score = self._best(name, role, self._fuzzy_candidates(name))
+            if fuzzy_score > best_score:
+                best, best_score = fuzzy, fuzzy_score
+        if best is None or best_score < self.min_score:
+            return None
+        return best, best_score
+
+    def resolve_selector_hint(self, selector: str) -> Optional[Tuple[int, float]]:
+        """A selector that is not in the snapshot, matched by the id/name/label values it mentions."""
+        for m in _SELECTOR_HINT_RE.finditer(selector or ""):
+            hit = self.resolve({"name": m.group(1) or m.group(2)})
+            if hit is not None:
+                return hit
+        return None
+
+    def best_text_input(self, name: Optional[str]) -> Optional[int]:
+        """Closest text input for a type step whose target is gone; None if the page has none."""
+        key = norm_name(name)
+        best, best_score = None, -1.0
+        for i in self.text_inputs()[:self.max_candidates]:
+            if not self._selectors[i]:
+                continue
+            cand_name = self._normalized(i)[0]
+            s = _name_score(key, cand_name) if key else 0.0
+            if "search" in cand_name:
+                s += 0.1
+            if s > best_score:
+                best, best_score = i, s
+        return best
+
+
+class StepResolver:
+    """
+    Checks plan steps against a SelectorIndex, one at a time and in plan order
+    (so it also works for streamed steps). check() returns the step to keep, a
+    repaired copy, or None to drop it.
+    """
+
+    def __init__(self, index: SelectorIndex):
+        self.index = index
+        self.same_page = True
+        self.counts: Dict[str, int] = {}
+
+    def _count(self, result: str):
+        self.counts[result] = self.counts.get(result, 0) + 1
+        metrics.inc("plan_step_target", result=result)
+
+    def _retarget(self, step: Step, i: int, result: str) -> Step:
+        demoted = self._demote(step, i)
+        if demoted is not None:
+            return demoted
+        out = dict(step)
+        out["selector"] = self.index.selector(i)
+        self._count(result)
+        return out
+
+    def _demote(self, step: Step, i: int) -> Optional[Step]:
+        """A copy targeting control i by role/name when its selector keeps failing on this host; else None."""
+        rel = self.index.reliability
+        if rel is None or not rel.selector_unreliable(self.index.selector(i)):
+            return None
+        query = step.get("query")
+        if not (isinstance(query, dict) and query.get("name")):
+            query = self.index.query_of(i)
+        if query is None or rel.query_unreliable(query):
+            return None  # nothing better to offer: keep the selector
+        out = dict(step)
+        out.pop("selector", None)
+        out["query"] = query
+        self._count("demoted")
+        return out
+
+    def check(self, step: Step) -> Optional[Step]:
+        action = step.get("action")
+        if action not in ("click", "type"):
+            if action in _PAGE_CHANGING:
+                self.same_page = False
+            return step
+        if not self.same_page:
+            self._count("unchecked")
+            return step
+        out, i = self._check_target(step)
+        if out is not None and self._changes_page(out, i):
+            self.same_page = False
+        return out
+
+    def _changes_page(self, step: Step, i: Optional[int]) -> bool:
+        if step.get("action") == "type":
+            return bool(step.get("enter"))
+        # clicking into a text field only focuses it; anything else may navigate or open new UI.
+        # i is the control the step was matched to: a demoted step has no selector left to look up
+        return i is None or not self.index.is_text_input(i)
+
+    def _check_target(self, step: Step) -> Tuple[Optional[Step], Optional[int]]:
+        """The step to keep (or None) and the index of the control it targets."""
+        index = self.index
+        selector = step.get("selector")
+        query = step.get("query")
+        if selector and index.has_selector(selector):
+            i = index.index_of(selector)
+            demoted = self._demote(step, i)
+            if demoted is not None:
+                return demoted, i
+            self._count("ok")
+            return step, i
+        hit = index.resolve(query) if query else None
+        if hit is not None:
+            return self._retarget(step, hit[0], "resolved" if not selector else "repaired"), hit[0]
+        if selector:
+            hit = index.resolve_selector_hint(selector)
+            if hit is not None:
+                return self._retarget(step, hit[0], "repaired"), hit[0]
+        if step.get("action") == "type":
+            name = (query or {}).get("name") if isinstance(query, dict) else None
+            i = index.best_text_input(name)
+            if i is not None:
+                out = self._retarget(step, i, "repaired")
+                if out.get("selector"):
+                    out.pop("query", None)  # a demoted step keeps the query it now relies on
+                return out, i
+        self._count("dropped")
+        return None, None
@@ -1,8 +1,6 @@
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pathlib import Path
-from datetime import datetime
-from azure.identity import CertificateCredential
 
 # Current directory (where this file is located)
 curr_dir = Path(__file__).parent if "__file__" in globals() else Path.cwd()
@@ -50,9 +48,114 @@ class Settings(BaseSettings):
     # --- Certificates ---
     pem_file_path: Optional[str] = None
 
-    # --- Private Attributes for Token Caching ---
-    _cached_token: Optional[str] = None
-    _token_expiry: Optional[datetime] = None
+    # --- Azure AD Token Cache ---
+    token_refresh_margin: float = 300.0         # Refresh the bearer token this many seconds before expiry
+    token_retry_interval: float = 10.0          # Seconds between background retries after a failed refresh
+
+    # --- Metrics ---
+    metrics_enabled: bool = True                # Record latency/token/fallback metrics (/metrics)
+    metrics_timing_headers: bool = False        # Add a Server-Timing header to every response
+
+    # --- Shared LLM Client ---
+    llm_max_concurrency: int = 16               # Max in-flight LLM calls per worker (adaptive limit ceiling)
+    llm_timeout: float = 60.0                   # Seconds per LLM call (read/total)
+    llm_connect_timeout: float = 10.0
+    llm_max_connections: int = 100              # httpx pool size
+    llm_max_keepalive: int = 20                 # Idle keep-alive connections kept in the pool
+
+    # --- LLM Admission Control ---
+    llm_adaptive_concurrency: bool = True       # AIMD: shrink the limit on 429s/timeouts/slow calls, grow it back when healthy
+    llm_min_concurrency: int = 2                # Floor for the adaptive limit
+    llm_latency_tolerance: float = 2.0          # Calls slower than this x baseline latency shrink the limit
+    llm_queue_max: int = 64                     # Waiting calls per priority class before 503s
+    llm_queue_timeouts: Dict[str, float] = {"next": 2.0, "plan": 5.0, "summarize": 15.0, "batch": 30.0}  # Max wait for a slot
+    llm_priority_shares: Dict[str, float] = {"next": 1.0, "plan": 1.0, "summarize": 0.8, "batch": 0.5}  # Share of the limit a class may use
+    llm_retry_attempts: int = 3                 # Attempts per call (429, 5xx, timeouts, connection errors)
+    llm_retry_base_delay: float = 0.25          # Full-jitter backoff: uniform(0, base * 2^attempt)
+    llm_retry_max_delay: float = 8.0            # Longer Retry-After from the model fails the call instead
+    llm_retry_budget_ratio: float = 0.2         # Retries allowed per first attempt, process-wide
+    llm_retry_min_per_second: float = 1.0       # Retry budget trickle when traffic is low
+
+    # --- Summarization ---
+    summarize_chunk_tokens: int = 3000          # Pages above this are map-reduced in chunks
+    summarize_reduce_fanin: int = 8             # Partial summaries merged per reduce call
+
+    # --- Summary Cache ---
+    summary_cache_enabled: bool = True
+    summary_cache_size: int = 1024              # Page summaries kept in memory (LRU)
+    summary_chunk_cache_size: int = 8192        # Chunk summaries kept in memory (LRU)
+    summary_cache_ttl: float = 86400.0          # Seconds before a cached summary expires
+    summary_cache_path: Optional[str] = None    # SQLite file shared by workers and restarts (off if unset)
+    summary_cache_disk_rows: int = 100_000      # Rows kept per on-disk table (oldest dropped first)
+
+    # --- DOM Ranking ---
+    dom_max_controls: int = 180                 # Controls shown to the planner
+    dom_token_budget: int = 8000                # Max prompt tokens for the control list
+
+    # --- Prompt Budget ---
+    prompt_token_budget: int = 12000            # Whole plan prompt; controls get what the other parts leave
+    prompt_goal_tokens: int = 1000              # Longer goals are cut
+    prompt_history_tokens: int = 800            # Most recent executed steps shown to the model
+    prompt_tokenizer: str = "o200k_base"        # tiktoken encoding, loaded at startup (estimate until loaded or offline)
+
+    # --- Crawl Frontier ---
+    frontier_max_depth: int = 4
+    frontier_max_size: int = 100_000            # Queued URLs per session before eviction
+    frontier_max_seen: int = 1_000_000          # URLs remembered for dedupe per session (LRU)
+    frontier_max_sessions: int = 256
+
+    # --- Session Snapshots (delta protocol) ---
+    snapshot_sessions_max: int = 1000           # Sessions kept (LRU)
+    snapshot_session_ttl: float = 1800.0        # Idle seconds before a session snapshot is dropped
+
+    # --- Hedged Planning ---
+    plan_deadline_ms: float = 0                 # >0: confident heuristic plans win if the LLM is slower
+    plan_hedge: bool = False                    # Send a second LLM call once the first exceeds p95
+    plan_hedge_min_samples: int = 20            # Latency samples needed before hedging kicks in
+
+    # --- Plan Cache ---
+    plan_cache_enabled: bool = True
+    plan_cache_size: int = 512                  # Max plans kept in memory (LRU)
+    plan_cache_ttl: float = 900.0               # Seconds before a cached plan expires
+    plan_cache_path: Optional[str] = None       # SQLite file for the on-disk tier (off if unset)
+
+    # --- Batch Endpoints ---
+    batch_max_items: int = 200                  # Items accepted per /plan/batch or /summarize/batch
+    batch_max_concurrency: int = 8              # Unique items of one batch run at the same time
+
+    # --- Bookmarks & Intent Routing ---
+    bookmarks_path: Optional[str] = "./bookmarks.json"  # Registry file, re-read when it changes
+    bookmarks_reload_interval: float = 2.0      # Seconds between mtime checks
+    intent_min_score: float = 0.6               # /intent: route to a summary/bookmark at or above this
+    bookmark_plan_min_score: float = 0.9        # /plan: answer with a bookmark instead of the LLM (0 = off)
+
+    # --- Step Validation ---
+    plan_validate_steps: bool = True            # Check click/type targets against the snapshot before returning a plan
+    selector_match_min_score: float = 0.6       # Fuzzy role/name match needed to resolve a query to a selector
+
+    # --- Target Reliability (step outcomes) ---
+    reliability_enabled: bool = True            # Learn per-host selector/query success rates from /outcomes
+    reliability_half_life: float = 259200.0     # Seconds for an outcome to lose half its weight (3 days)
+    reliability_min_reports: float = 3.0        # Decayed reports needed before a target is judged
+    reliability_threshold: float = 0.5          # Success rate below which a target is swapped or ranked down
+    reliability_max_hosts: int = 5000           # Hosts kept in memory (LRU)
+    reliability_max_targets: int = 2000         # Targets kept per host (most recently reported)
+    reliability_snapshot_path: Optional[str] = None  # SQLite file for snapshots (defaults to sqlite_url)
+    reliability_snapshot_interval: float = 30.0  # Seconds between snapshots of changed entries
+
+    # --- PII Masking ---
+    mask_enabled: bool = True                   # Mask goal, controls and page text before they reach the model
+    mask_detectors: List[str] = ["email", "jwt", "secret", "bearer", "card", "ssn", "phone", "ip"]
+    mask_dictionary: List[str] = []             # Extra terms to mask (names, customers, project codenames)
+    mask_dictionary_path: Optional[str] = None  # File with one dictionary term per line
+    mask_key: Optional[str] = None              # Placeholder HMAC key; set it to share masked cache entries across workers/restarts
+
+    # --- Production Server ---
+    workers: int = 1                            # Worker processes for `serve` (pre-forked by uvicorn)
+    frontier_backend: str = "auto"              # memory | sqlite | auto (sqlite when workers > 1)
+    frontier_db_path: Optional[str] = None      # SQLite file for the shared frontier (defaults to sqlite_url)
+    snapshot_backend: str = "auto"              # memory | sqlite | auto (sqlite when workers > 1)
+    snapshot_db_path: Optional[str] = None      # SQLite file for shared delta snapshots (defaults to sqlite_url)
 
     class Config:
         """
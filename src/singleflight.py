@@ -0,0 +1,62 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight computation.
+    Every caller awaits the same task through asyncio.shield, so one client
+    disconnecting does not cancel the work for the others; the task is only
+    cancelled once every waiter has gone away. Exceptions propagate to all
+    waiters and are not cached: the next call starts a fresh computation.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, Tuple[asyncio.Task, list]] = {}
+        self.calls = 0
+        self.executions = 0
+        self.shared = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        entry = self._inflight.get(key)
+        if entry is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            entry = (task, [0])
+            self._inflight[key] = entry
+            task.add_done_callback(lambda _t, k=key, e=entry: self._forget(k, e))
+            metrics.inc("singleflight", name=self.name, result="leader")
+        else:
+            self.shared += 1
+            metrics.inc("singleflight", name=self.name, result="shared")
+
+        task, waiters = entry
+        waiters[0] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                raise
+            waiters[0] -= 1
+            if waiters[0] <= 0 and not task.done():
+                self.abandoned += 1
+                task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "saved": self.shared,
+            "abandoned": self.abandoned,
+            "inflight": len(self._inflight),
+        }
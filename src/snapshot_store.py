@@ -0,0 +1,354 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from compact_dom import dumps, loads
+
+Control = Dict[str, Any]
+
+
+def control_key(c: Control) -> str:
+    """Controls are keyed by selector; fall back to a descriptive key when missing."""
+    sel = c.get("selector")
+    if sel:
+        return str(sel)
+    return f"{c.get('tag') or ''}|{c.get('role') or ''}|{c.get('name') or ''}|{c.get('href') or ''}"
+
+
+def _control_hash(c: Control) -> int:
+    blob = json.dumps(c, sort_keys=True, ensure_ascii=False, default=str)
+    return int.from_bytes(hashlib.blake2b(blob.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ResyncRequired(Exception):
+    """The client's base hash does not match the server copy; it must resend the full snapshot."""
+
+
+class SessionSnapshot:
+    """
+    Last known control list for one session. The snapshot hash is the XOR of
+    per-control hashes, so applying a delta costs O(changed), not O(page).
+    """
+
+    def __init__(self):
+        self.controls: "OrderedDict[str, Control]" = OrderedDict()
+        self._hashes: Dict[str, int] = {}
+        self._acc = 0
+        self.touched = time.time()
+
+    @property
+    def hash(self) -> str:
+        return f"{self._acc:016x}-{len(self.controls)}"
+
+    def _put(self, c: Control):
+        k = control_key(c)
+        h = _control_hash(c)
+        old = self._hashes.get(k)
+        if old is not None:
+            self._acc ^= old
+        self._acc ^= h
+        self._hashes[k] = h
+        self.controls[k] = c
+
+    def _drop(self, k: str):
+        old = self._hashes.pop(k, None)
+        if old is not None:
+            self._acc ^= old
+            self.controls.pop(k, None)
+
+    def replace(self, dom: List[Control]):
+        self.controls.clear()
+        self._hashes.clear()
+        self._acc = 0
+        for c in dom or []:
+            if isinstance(c, dict):
+                self._put(c)
+
+    def apply(self, delta: Dict[str, Any]):
+        """
+        Merge {removed, changed, added, added_at?}. added_at[i] is the position of
+        added[i] in the client's control list, so the merged snapshot keeps page
+        order; without it new controls are appended.
+        """
+        for k in delta.get("removed") or []:
+            self._drop(str(k))
+        for c in delta.get("changed") or []:
+            if isinstance(c, dict):
+                self._put(c)
+        added = delta.get("added") or []
+        at = delta.get("added_at")
+        if not isinstance(at, list) or len(at) != len(added):
+            at = [None] * len(added)
+        placed = []
+        for c, i in zip(added, at):
+            if not isinstance(c, dict):
+                continue
+            k = control_key(c)
+            new = k not in self.controls
+            self._put(c)
+            if new and isinstance(i, int) and not isinstance(i, bool):
+                placed.append((i, k))
+        if placed:
+            self._place(placed)
+
+    def _place(self, placed: List[tuple]):
+        # O(page), and only when the delta added controls
+        moved = {k for _, k in placed}
+        order = [k for k in self.controls if k not in moved]
+        for i, k in sorted(placed):
+            order.insert(max(0, i), k)
+        self.controls = OrderedDict((k, self.controls[k]) for k in order)
+
+    def dom(self) -> List[Control]:
+        return list(self.controls.values())
+
+    @classmethod
+    def restore(cls, keys: List[str], controls: List[Control], hashes: List[int]) -> "SessionSnapshot":
+        """Rebuild a stored snapshot without re-hashing every control."""
+        snap = cls()
+        for k, c, h in zip(keys, controls, hashes):
+            snap.controls[k] = c
+            snap._hashes[k] = h
+            snap._acc ^= h
+        return snap
+
+
+class SnapshotStore:
+    """
+    Per-session DOM snapshots for the delta protocol used by /plan and /next.
+    Bounded by session count (LRU) and idle TTL. In-process only: with several
+    workers use SqliteSnapshotStore.
+    """
+
+    blocking = False
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 1800.0):
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl = float(ttl)
+        self._sessions: "OrderedDict[str, SessionSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> Optional[SessionSnapshot]:
+        snap = self._sessions.get(session_id)
+        if snap is None:
+            return None
+        if time.time() - snap.touched > self.ttl:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        snap.touched = time.time()
+        return snap
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def put_full(self, session_id: str, dom: List[Control]) -> SessionSnapshot:
+        with self._lock:
+            snap = self._get(session_id) or SessionSnapshot()
+            snap.replace(dom)
+            self._sessions[session_id] = snap
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return snap
+
+    def apply_delta(self, session_id: str, delta: Dict[str, Any]) -> SessionSnapshot:
+        """
+        Merge {base_hash, added, added_at?, removed, changed} into the stored snapshot.
+        Raises ResyncRequired if the session is unknown or base_hash is stale.
+        """
+        with self._lock:
+            snap = self._get(session_id)
+            if snap is None or delta.get("base_hash") != snap.hash:
+                raise ResyncRequired(session_id)
+            snap.apply(delta)
+            return snap
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def close(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+_SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dom_sessions (
+    session TEXT PRIMARY KEY,
+    hash    TEXT NOT NULL,
+    touched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_dom_sessions_touched ON dom_sessions(touched);
+CREATE TABLE IF NOT EXISTS dom_controls (
+    session TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    pos     REAL NOT NULL,
+    hash    INTEGER NOT NULL,
+    control BLOB NOT NULL,
+    PRIMARY KEY (session, key)
+);
+"""
+
+_PUT_CONTROL = "INSERT OR REPLACE INTO dom_controls (session, key, pos, hash, control) VALUES (?, ?, ?, ?, ?)"
+
+# smallest gap between neighbouring positions before a session's controls are renumbered
+_MIN_GAP = 1e-6
+
+
+def _signed(h: int) -> int:
+    """Control hashes are unsigned 64-bit; SQLite integers are signed."""
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+class SqliteSnapshotStore:
+    """
+    Same API as SnapshotStore, but snapshots live in SQLite (WAL) tables so every
+    worker process of a multi-worker server sees the same base hash; otherwise each
+    request landing on another worker would answer 409 and force a full upload.
+    Controls are stored one row each with a sortable position, so a delta writes
+    only the rows it added, changed or removed. A delta is applied inside BEGIN
+    IMMEDIATE, so two workers cannot both build on the same base. Every
+    `trim_every` writes drop idle and least recently used sessions beyond
+    max_sessions. Calls block on SQLite: callers on an event loop run them in a
+    thread (see `blocking`).
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_sessions: int = 1000, ttl: float = 1800.0, trim_every: int = 64):
+        self.max_sessions = max(1, int(max_sessions))
+        self.ttl = float(ttl)
+        self.trim_every = max(1, trim_every)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SNAPSHOT_SCHEMA)
+
+    def _touch(self, session_id: str, snap: SessionSnapshot):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dom_sessions (session, hash, touched) VALUES (?, ?, ?)",
+            (session_id, snap.hash, snap.touched),
+        )
+        self._writes += 1
+        if self._writes % self.trim_every == 0:
+            self._trim()
+
+    def _trim(self):
+        stale = [r[0] for r in self._conn.execute(
+            "SELECT session FROM dom_sessions WHERE touched < ? UNION "
+            "SELECT session FROM (SELECT session FROM dom_sessions ORDER BY touched DESC LIMIT -1 OFFSET ?)",
+            (time.time() - self.ttl, self.max_sessions),
+        )]
+        for session_id in stale:
+            self._delete(session_id)
+
+    def _delete(self, session_id: str):
+        self._conn.execute("DELETE FROM dom_controls WHERE session = ?", (session_id,))
+        self._conn.execute("DELETE FROM dom_sessions WHERE session = ?", (session_id,))
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return out
+
+    def put_full(self, session_id: str, dom: List[Control]) -> SessionSnapshot:
+        snap = SessionSnapshot()
+        snap.replace(dom)
+
+        def write():
+            self._conn.execute("DELETE FROM dom_controls WHERE session = ?", (session_id,))
+            self._conn.executemany(_PUT_CONTROL, [
+                (session_id, k, float(i), _signed(snap._hashes[k]), dumps(c))
+                for i, (k, c) in enumerate(snap.controls.items())
+            ])
+            self._touch(session_id, snap)
+
+        self._transaction(write)
+        return snap
+
+    def apply_delta(self, session_id: str, delta: Dict[str, Any]) -> SessionSnapshot:
+        """
+        Merge {base_hash, added, added_at?, removed, changed} into the stored snapshot.
+        Raises ResyncRequired if the session is unknown, idle past ttl or base_hash is stale.
+        """
+
+        def merge():
+            row = self._conn.execute(
+                "SELECT hash, touched FROM dom_sessions WHERE session = ?", (session_id,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl or delta.get("base_hash") != row[0]:
+                raise ResyncRequired(session_id)
+            rows = self._conn.execute(
+                "SELECT key, pos, hash, control FROM dom_controls WHERE session = ? ORDER BY pos", (session_id,)
+            ).fetchall()
+            snap = SessionSnapshot.restore(
+                [r[0] for r in rows], [loads(r[3]) for r in rows], [r[2] & 0xFFFFFFFFFFFFFFFF for r in rows]
+            )
+            pos = {r[0]: r[1] for r in rows}
+            before = dict(snap._hashes)
+            snap.apply(delta)
+            self._write_changes(session_id, snap, before, pos)
+            self._touch(session_id, snap)
+            return snap
+
+        return self._transaction(merge)
+
+    def _write_changes(self, session_id: str, snap: SessionSnapshot, before: Dict[str, int], pos: Dict[str, float]):
+        """Delete removed rows and write added or changed ones; new controls get a position between their neighbours."""
+        removed = [k for k in before if k not in snap.controls]
+        if removed:
+            self._conn.executemany(
+                "DELETE FROM dom_controls WHERE session = ? AND key = ?", [(session_id, k) for k in removed]
+            )
+        order = list(snap.controls)
+        new_pos: Dict[str, float] = {}
+        i = 0
+        while i < len(order):
+            if order[i] in pos:
+                i += 1
+                continue
+            j = i
+            while j < len(order) and order[j] not in pos:
+                j += 1
+            lo = pos[order[i - 1]] if i else (pos[order[j]] - (j - i + 1) if j < len(order) else 0.0)
+            hi = pos[order[j]] if j < len(order) else lo + (j - i + 1)
+            step = (hi - lo) / (j - i + 1)
+            if step < _MIN_GAP:
+                new_pos = {k: float(n) for n, k in enumerate(order)}  # positions ran out: renumber the session
+                break
+            for n in range(i, j):
+                new_pos[order[n]] = lo + step * (n - i + 1)
+            i = j
+        writes = [k for k in order if k in new_pos or snap._hashes[k] != before.get(k)]
+        self._conn.executemany(_PUT_CONTROL, [
+            (session_id, k, new_pos.get(k, pos.get(k)), _signed(snap._hashes[k]), dumps(snap.controls[k]))
+            for k in writes
+        ])
+
+    def drop(self, session_id: str):
+        self._transaction(lambda: self._delete(session_id))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM dom_sessions").fetchone()[0])
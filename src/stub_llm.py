@@ -0,0 +1,170 @@
+"""
+Local stub of an OpenAI-compatible chat completions endpoint for load tests.
+
+Answers POST /v1/chat/completions (plain and `stream: true`) with a canned plan
+after an injected latency, and injects failures: a fraction of 500s, a fraction
+of 429s, and 429s for everything above `--capacity` concurrent requests, which
+is how a rate-limited deployment behaves. Standard library only.
+
+    python stub_llm.py --port 8089 --latency 0.3 --jitter 0.2 --capacity 8 --error-rate 0.05
+    OPENAI_MODEL_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub MODEL_NAME=stub python main.py
+
+GET /stats returns what was served, so a load test can compare it with /health.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+_PLAN = json.dumps({"steps": [
+    {"action": "click", "query": {"role": "textbox", "name": "Search"}},
+    {"action": "type", "query": {"role": "textbox", "name": "Search"}, "text": "change request"},
+    {"action": "press", "key": "Enter"},
+]})
+
+_REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class StubModel:
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, capacity: int = 0, error_rate: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: float = 1.0, text: str = _PLAN, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.text = text
+        self.rng = random.Random(seed)
+        self.in_flight = 0
+        self.counts: Dict[str, int] = {"ok": 0, "429": 0, "500": 0, "peak_in_flight": 0}
+
+    def _fail(self) -> Optional[Tuple[int, Dict[str, str], Dict[str, Any]]]:
+        if self.capacity and self.in_flight > self.capacity:
+            self.counts["429"] += 1
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, {"error": {"message": "over capacity", "type": "rate_limit"}}
+        roll = self.rng.random()
+        if roll < self.rate_limit:
+            self.counts["429"] += 1
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, {"error": {"message": "rate limited", "type": "rate_limit"}}
+        if roll < self.rate_limit + self.error_rate:
+            self.counts["500"] += 1
+            return 500, {}, {"error": {"message": "injected failure", "type": "server_error"}}
+        return None
+
+    async def handle(self, body: Dict[str, Any], writer: asyncio.StreamWriter):
+        self.in_flight += 1
+        self.counts["peak_in_flight"] = max(self.counts["peak_in_flight"], self.in_flight)
+        try:
+            failure = self._fail()
+            if failure is not None:
+                await asyncio.sleep(0.005)  # rejections are fast, like a real gateway
+                await _respond(writer, *failure)
+                return
+            await asyncio.sleep(self.latency + self.rng.uniform(0.0, self.jitter))
+            self.counts["ok"] += 1
+            model = body.get("model") or "stub"
+            if body.get("stream"):
+                await self._stream(writer, model)
+                return
+            await _respond(writer, 200, {}, {
+                "id": f"stub-{self.counts['ok']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(self.text) // 4, "total_tokens": len(self.text) // 4},
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, writer: asyncio.StreamWriter, model: str):
+        head = "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+        writer.write(head.encode())
+        pieces = [self.text[i:i + 16] for i in range(0, len(self.text), 16)]
+        for i, piece in enumerate(pieces + [None]):
+            delta = {"content": piece} if piece is not None else {}
+            event = {"id": "stub-stream", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None if piece is not None else "stop"}]}
+            _chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await writer.drain()
+            await asyncio.sleep(0.002)
+        _chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def _chunk(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str], body: Dict[str, Any]):
+    data = json.dumps(body).encode()
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json",
+             f"Content-Length: {len(data)}", *[f"{k}: {v}" for k, v in headers.items()]]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + data)
+    await writer.drain()
+
+
+async def _serve_connection(stub: StubModel, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:  # keep-alive: httpx reuses pooled connections
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip())
+            raw = await reader.readexactly(length) if length else b""
+            if method == "GET" and path.startswith("/stats"):
+                await _respond(writer, 200, {}, {**stub.counts, "in_flight": stub.in_flight})
+            elif method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                await stub.handle(json.loads(raw or b"{}"), writer)
+            else:
+                await _respond(writer, 404, {}, {"error": {"message": f"no route {method} {path}"}})
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(stub: StubModel, host: str, port: int):
+    server = await asyncio.start_server(lambda r, w: _serve_connection(stub, r, w), host, port)
+    print(f"stub model on http://{host}:{port}/v1 "
+          f"(latency {stub.latency}s +{stub.jitter}s, capacity {stub.capacity or 'unlimited'}, "
+          f"429 {stub.rate_limit:.0%}, 500 {stub.error_rate:.0%})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub model with injected latency and errors")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.2, help="seconds before each answer")
+    ap.add_argument("--jitter", type=float, default=0.0, help="extra uniform random latency in seconds")
+    ap.add_argument("--capacity", type=int, default=0, help="concurrent requests above this get 429 (0 = unlimited)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args(argv)
+    stub = StubModel(args.latency, args.jitter, args.capacity, args.error_rate, args.rate_limit, args.retry_after,
+                     seed=args.seed)
+    try:
+        asyncio.run(serve(stub, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import json
+
+import pytest
+
+import stub_llm
+from admission import AdmissionController, LLMUnavailable, Overloaded, RetryBudget, _Slot, priority
+
+
+def _finish(ctrl, op, latency, prio="plan"):
+    slot = _Slot(prio, op)
+    slot.start -= latency
+    ctrl.in_flight += 1
+    ctrl.release(slot)
+
+
+def test_latency_baseline_is_per_op():
+    ctrl = AdmissionController(max_limit=8, initial=8)
+    for _ in range(20):
+        _finish(ctrl, "plan", 1.0)
+    for _ in range(20):
+        _finish(ctrl, "summarize", 6.0, "summarize")  # slow, but normal for a summary
+    assert ctrl.limit == 8
+    baselines = ctrl.stats()["baseline_ms"]
+    assert baselines["plan"] == pytest.approx(1000, rel=0.01)
+    assert baselines["summarize"] == pytest.approx(6000, rel=0.01)
+
+
+def test_latency_spike_within_an_op_cuts_the_limit():
+    ctrl = AdmissionController(max_limit=8, initial=8)
+    for _ in range(20):
+        _finish(ctrl, "plan", 1.0)
+    _finish(ctrl, "plan", 6.0)
+    assert ctrl.limit < 8
+
+
+# ---- driven through stub_llm ----
+class _Response:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class _StatusError(Exception):
+    """Shaped like httpx.HTTPStatusError: .response.status_code / .response.headers."""
+
+    def __init__(self, status_code, headers):
+        super().__init__(status_code)
+        self.response = _Response(status_code, headers)
+
+
+async def _post(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"model": "stub", "messages": []}).encode()
+    writer.write(b"POST /v1/chat/completions HTTP/1.1\r\nHost: stub\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers["content-length"]))
+    writer.close()
+    if status != 200:
+        raise _StatusError(status, headers)
+    return json.loads(data)
+
+
+def _with_stub(stub, scenario):
+    async def run():
+        server = await asyncio.start_server(lambda r, w: stub_llm._serve_connection(stub, r, w), "127.0.0.1", 0)
+        try:
+            return await scenario(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+    return asyncio.run(run())
+
+
+def test_rate_limits_cut_the_limit_multiplicatively():
+    stub = stub_llm.StubModel(latency=0.01, rate_limit=1.0, retry_after=0.01)
+    ctrl = AdmissionController(max_limit=8, initial=8, retry_attempts=1, backoff=0.5)
+
+    async def scenario(port):
+        with pytest.raises(LLMUnavailable) as e:
+            await ctrl.call("plan", lambda: _post(port))
+        return e.value
+
+    err = _with_stub(stub, scenario)
+    assert err.reason == "rate_limited"
+    assert err.retry_after >= 1
+    assert ctrl.limit == 4
+    assert stub.counts["429"] == 1
+
+
+def test_retries_stop_when_the_budget_is_spent():
+    stub = stub_llm.StubModel(latency=0.01, error_rate=1.0)
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, cap=1.0)
+    ctrl = AdmissionController(retry_attempts=10, retry_base_delay=0.001, budget=budget)
+
+    async def scenario(port):
+        with pytest.raises(LLMUnavailable) as e:
+            await ctrl.call("plan", lambda: _post(port))
+        return e.value
+
+    err = _with_stub(stub, scenario)
+    assert err.reason == "server"
+    assert stub.counts["500"] == 2  # first attempt + the one retry the budget paid for
+    assert budget.tokens < 1.0
+
+
+def test_successful_calls_pass_through():
+    stub = stub_llm.StubModel(latency=0.01)
+    ctrl = AdmissionController()
+    resp = _with_stub(stub, lambda port: ctrl.call("plan", lambda: _post(port)))
+    assert json.loads(resp["choices"][0]["message"]["content"])["steps"]
+    assert ctrl.in_flight == 0
+
+
+# ---- queueing ----
+def test_full_queue_sheds_with_retry_after():
+    ctrl = AdmissionController(max_limit=1, queue_max=1)
+
+    async def scenario():
+        gate = asyncio.Event()
+        with priority("batch"):
+            holder = asyncio.create_task(ctrl.call("plan", gate.wait))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(ctrl.call("plan", gate.wait))
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded) as e:
+                await ctrl.call("plan", gate.wait)
+        gate.set()
+        await asyncio.gather(holder, waiter)
+        return e.value
+
+    err = asyncio.run(scenario())
+    assert err.reason == "queue_full"
+    assert err.retry_after >= 1
+    assert ctrl.counts["shed"] == 1
+
+
+def test_queue_timeout_sheds():
+    ctrl = AdmissionController(max_limit=1, queue_timeouts={"batch": 0.02})
+
+    async def scenario():
+        gate = asyncio.Event()
+        holder = asyncio.create_task(ctrl.call("plan", gate.wait))
+        await asyncio.sleep(0)
+        with priority("batch"), pytest.raises(Overloaded) as e:
+            await ctrl.call("plan", gate.wait)
+        gate.set()
+        await holder
+        return e.value
+
+    assert asyncio.run(scenario()).reason == "queue_timeout"
+    assert ctrl.in_flight == 0
+
+
+def test_waiters_are_served_highest_priority_first():
+    ctrl = AdmissionController(max_limit=1)
+    served = []
+
+    async def scenario():
+        gate = asyncio.Event()
+        holder = asyncio.create_task(ctrl.call("plan", gate.wait))
+        await asyncio.sleep(0)
+
+        async def one(prio):
+            async def fn():
+                served.append(prio)
+            with priority(prio):
+                await ctrl.call("plan", fn)
+
+        waiters = []
+        for prio in ("batch", "summarize", "plan", "next"):
+            waiters.append(asyncio.create_task(one(prio)))
+            await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(holder, *waiters)
+
+    asyncio.run(scenario())
+    assert served == ["next", "plan", "summarize", "batch"]
+
+
+def test_lower_classes_leave_slots_for_interactive_calls():
+    ctrl = AdmissionController(max_limit=4, shares={"batch": 0.5})
+
+    async def scenario():
+        gate = asyncio.Event()
+        with priority("batch"):
+            batch = [asyncio.create_task(ctrl.call("plan", gate.wait)) for _ in range(4)]
+        await asyncio.sleep(0)
+        admitted = ctrl.in_flight
+        with priority("next"):
+            await ctrl.call("next", lambda: asyncio.sleep(0))  # does not wait for the batch
+        gate.set()
+        await asyncio.gather(*batch)
+        return admitted
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_overloaded_is_served_as_503_with_retry_after():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("pydantic_settings")
+    import main
+
+    resp = asyncio.run(main._llm_unavailable(None, Overloaded("queue_full", 2.4)))
+    assert resp.status_code == 503
+    assert resp.headers["retry-after"] == "3"
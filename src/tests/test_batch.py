@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pydantic_settings")
+from fastapi import HTTPException
+
+import main
+from snapshot_store import SnapshotStore
+
+
+class _Plan:
+    def __init__(self, prompt):
+        self.prompt = prompt
+
+    def model_dump(self):
+        return {"steps": [{"action": "click", "selector": "#go"}], "prompt": self.prompt}
+
+
+def _call(monkeypatch, endpoint, payload):
+    async def read_payload(_request):
+        return payload
+
+    async def go():
+        resp = await endpoint(None)
+        return [json.loads(chunk) async for chunk in resp.body_iterator]
+
+    monkeypatch.setattr(main, "_read_payload", read_payload)
+    lines = asyncio.run(go())
+    done = lines.pop()
+    assert done["done"] is True
+    return sorted(lines, key=lambda line: line["index"]), done
+
+
+@pytest.fixture
+def plans(monkeypatch):
+    calls = []
+
+    async def generate_plan(prompt, dom, **_kw):
+        calls.append(prompt)
+        await asyncio.sleep(0)
+        if prompt == "explode":
+            raise RuntimeError("model went away")
+        return _Plan(prompt)
+
+    monkeypatch.setattr(main, "generate_plan", generate_plan)
+    return calls
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    calls = []
+
+    class Agent:
+        async def run(self, ctx):
+            calls.append(ctx["text"])
+            if ctx["text"] == "explode":
+                raise RuntimeError("model went away")
+            return "summary of " + ctx["text"]
+
+    monkeypatch.setattr(main, "SummarizerAgent", Agent)
+    return calls
+
+
+DOM = [{"selector": "#go", "tag": "button", "name": "Go"}]
+
+
+def test_plan_batch_runs_identical_items_once(monkeypatch, plans):
+    items = [
+        {"id": "a", "prompt": "open it", "dom": DOM},
+        {"id": "b", "prompt": "open it", "dom": DOM},
+        {"id": "c", "prompt": "close it", "dom": DOM},
+        {"id": "d", "prompt": "open it", "dom": DOM, "cache": False},
+    ]
+    lines, done = _call(monkeypatch, main.plan_batch_endpoint, {"items": items})
+    assert sorted(plans) == ["close it", "open it", "open it"]  # cache: false is its own group
+    assert [(line["index"], line["id"], line["ok"]) for line in lines] == [
+        (0, "a", True), (1, "b", True), (2, "c", True), (3, "d", True),
+    ]
+    assert lines[0]["result"] == lines[1]["result"]
+    assert done == {"done": True, "count": 4, "unique": 3, "errors": 0}
+
+
+def test_plan_batch_isolates_bad_items(monkeypatch, plans):
+    monkeypatch.setattr(main, "snapshots", SnapshotStore())
+    items = [
+        {"id": "ok", "prompt": "open it", "dom": DOM},
+        "not an object",
+        {"id": "cdom", "prompt": "open it", "dom": {"format": "cdom", "v": 99}},
+        {"id": "stale", "prompt": "open it", "session_id": "s-missing", "dom_delta": {"base_hash": "nope"}},
+        {"id": "boom", "prompt": "explode", "dom": DOM},
+        {"id": "boom2", "prompt": "explode", "dom": DOM},
+    ]
+    lines, done = _call(monkeypatch, main.plan_batch_endpoint, {"items": items})
+    assert [(line["index"], line["ok"], line.get("status")) for line in lines] == [
+        (0, True, None), (1, False, 400), (2, False, 400), (3, False, 409), (4, False, 500), (5, False, 500),
+    ]
+    assert lines[1]["id"] is None
+    assert "version" in lines[2]["error"]
+    assert lines[4]["error"] == "model went away"
+    assert sorted(plans) == ["explode", "open it"]
+    assert done == {"done": True, "count": 6, "unique": 2, "errors": 5}
+
+
+def test_summarize_batch_dedupes_and_isolates_errors(monkeypatch, summaries):
+    items = [
+        {"id": "a", "context": {"text": "page one", "title": "One"}},
+        {"id": "b", "context": {"text": "page one", "title": "One"}},
+        {"id": "c", "context": {"text": "explode"}},
+        {"id": "d", "context": {"dom": {"format": "cdom", "v": 99}}},
+        {"id": "e", "context": {"text": "page two"}},
+    ]
+    lines, done = _call(monkeypatch, main.summarize_batch_endpoint, {"items": items})
+    assert sorted(summaries) == ["explode", "page one", "page two"]
+    assert [(line["id"], line["ok"], line.get("status")) for line in lines] == [
+        ("a", True, None), ("b", True, None), ("c", False, 500), ("d", False, 400), ("e", True, None),
+    ]
+    assert lines[0]["result"] == lines[1]["result"] == {"summary": "summary of page one"}
+    assert done == {"done": True, "count": 5, "unique": 3, "errors": 2}
+
+
+@pytest.mark.parametrize("endpoint", [main.plan_batch_endpoint, main.summarize_batch_endpoint])
+def test_batch_size_limit(monkeypatch, plans, summaries, endpoint):
+    monkeypatch.setattr(main.settings, "batch_max_items", 2)
+    with pytest.raises(HTTPException) as exc:
+        _call(monkeypatch, endpoint, {"items": [{}, {}, {}]})
+    assert exc.value.status_code == 413
+    with pytest.raises(HTTPException) as exc:
+        _call(monkeypatch, endpoint, {"items": {"a": 1}})
+    assert exc.value.status_code == 400
+    lines, done = _call(monkeypatch, endpoint, {"items": []})
+    assert lines == [] and done["count"] == 0
+    assert plans == [] and summaries == []
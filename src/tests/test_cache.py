@@ -0,0 +1,105 @@
+import types
+
+import pytest
+
+import cache
+from cache import DiskTier, LRUCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_eviction_drops_least_recently_used(clock):
+    c = LRUCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # a is now the most recent
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    s = c.stats()
+    assert (s["size"], s["evictions"], s["hits"], s["misses"]) == (2, 1, 3, 1)
+
+
+def test_set_refreshes_recency_and_ttl(clock):
+    c = LRUCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    clock[0] += 50
+    c.set("a", 10)
+    c.set("c", 3)
+    assert c.get("b") is None
+    clock[0] += 50  # past the first write's ttl, inside the second's
+    assert c.get("a") == 10
+
+
+def test_ttl_expiry(clock):
+    c = LRUCache(maxsize=8, ttl=60)
+    c.set("a", 1)
+    clock[0] += 60
+    assert c.get("a") == 1  # expires is inclusive
+    clock[0] += 1
+    assert c.get("a") is None
+    s = c.stats()
+    assert (s["size"], s["expirations"], s["misses"]) == (0, 1, 1)
+
+
+def test_disk_hit_is_promoted_and_survives_restart(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    first = LRUCache(maxsize=8, ttl=60, disk=DiskTier(path))
+    first.set("k", {"steps": [1, 2]})
+
+    second = LRUCache(maxsize=8, ttl=60, disk=DiskTier(path))
+    assert len(second) == 0
+    assert second.get("k") == {"steps": [1, 2]}
+    assert len(second) == 1
+    assert second.get("k") == {"steps": [1, 2]}
+    s = second.stats()
+    assert (s["disk_hits"], s["hits"], s["misses"]) == (1, 1, 0)
+    assert s["hit_rate"] == 1.0
+
+
+def test_memory_expiry_falls_through_to_disk_ttl(tmp_path, clock):
+    disk = DiskTier(str(tmp_path / "cache.db"))
+    c = LRUCache(maxsize=8, ttl=60, disk=disk)
+    c.set("k", "v")
+    clock[0] += 61
+    assert c.get("k") is None
+    assert disk._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+    s = c.stats()
+    assert (s["expirations"], s["disk_hits"], s["misses"]) == (1, 0, 1)
+
+
+def test_disk_trim_keeps_the_newest_rows(tmp_path, clock):
+    disk = DiskTier(str(tmp_path / "cache.db"), max_rows=3, trim_every=5)
+    for i in range(5):
+        clock[0] += 1
+        disk.set(f"k{i}", i, ttl=60)
+    rows = [r[0] for r in disk._conn.execute("SELECT key FROM cache ORDER BY key")]
+    assert rows == ["k2", "k3", "k4"]
+    clock[0] += 100
+    assert disk.trim() == 3
+    assert disk.get("k4") is None
+
+
+def test_disk_errors_are_counted_not_raised(tmp_path, clock):
+    disk = DiskTier(str(tmp_path / "cache.db"))
+    c = LRUCache(maxsize=8, ttl=60, disk=disk)
+    c.set("bad", {1, 2})  # not JSON-serializable
+    assert c.get("bad") == {1, 2}
+    assert c.stats()["disk_errors"] == 1
+    assert c.stats()["last_disk_error"].startswith("TypeError")
+
+    disk._conn.close()
+    c.set("k", "v")
+    assert c.get("k") == "v"
+    assert c.get("other") is None
+    s = c.stats()
+    assert s["disk_errors"] == 3
+    assert s["last_disk_error"].startswith("ProgrammingError")
+    assert s["misses"] == 1
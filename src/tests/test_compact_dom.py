@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+
+import compact_dom
+from compact_dom import decode_body, decode_compact, encode_compact
+
+DOM = [
+    {"tag": "a", "role": "link", "name": "Home", "selector": "div.nav > a:nth-of-type(1)"},
+    {"tag": "a", "role": "link", "name": "Docs", "selector": "div.nav > a:nth-of-type(2)"},
+    {"tag": "input", "role": "textbox", "name": None, "selector": "#q"},
+]
+
+
+def test_round_trip():
+    decoded = list(decode_compact(encode_compact(DOM)))
+    assert [{k: c[k] for k in DOM[0]} for c in decoded] == DOM
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda o: o["cols"]["tag"].__setitem__(0, "0"),
+    lambda o: o["cols"]["tag"].__setitem__(0, None),
+    lambda o: o["cols"]["tag"].__setitem__(0, 1.5),
+    lambda o: o["cols"]["tag"].__setitem__(0, True),
+    lambda o: o["cols"]["tag"].__setitem__(0, 99),
+    lambda o: o["selector_prefix"].__setitem__(1, "3"),
+    lambda o: o["selector_prefix"].__setitem__(1, -1),
+    lambda o: o.__setitem__("n", {"x": 1}),
+    lambda o: o["strings"].__setitem__(0, 7),
+    lambda o: o["strings"].__setitem__(0, ["a"]),
+    lambda o: o["strings"].__setitem__(-1, None),
+])
+def test_malformed_columns_raise_value_error(mutate):
+    obj = encode_compact(DOM)
+    mutate(obj)
+    with pytest.raises(ValueError):
+        decode_compact(obj)
+
+
+def test_non_string_selector_fragment_is_rejected_before_use():
+    obj = encode_compact(DOM)
+    fragment = obj["cols"]["selector"][1]  # front-coded: the tail after the shared prefix
+    obj["strings"][fragment] = {"x": 1}
+    with pytest.raises(ValueError):
+        decode_compact(obj)
+
+
+def test_gzip_bodies_decode():
+    assert decode_body(gzip.compress(b'{"a": 1}'), "application/json", "gzip") == {"a": 1}
+
+
+def test_gzip_bomb_is_rejected(monkeypatch):
+    monkeypatch.setattr(compact_dom, "MAX_DECOMPRESSED", 4 << 20)
+    bomb = gzip.compress(b"[" + b" " * (8 << 20) + b"]")
+    assert len(bomb) < 64 << 10
+    with pytest.raises(ValueError, match="exceeds"):
+        decode_body(bomb, "application/json", "gzip")
+
+
+def test_corrupt_gzip_is_a_value_error():
+    with pytest.raises(ValueError):
+        decode_body(b"\x1f\x8bnot gzip", "application/json", "gzip")
@@ -0,0 +1,51 @@
+import pytest
+
+from bookmark_registry import BookmarkRegistry, wants_summary
+
+
+@pytest.mark.parametrize("task", [
+    "summarize the key points of this long incident ticket for me",
+    "summarizing this",
+    "Summarise the page",
+    "give me a summary",
+    "tl;dr",
+])
+def test_summary_requests_bypass_scoring(task):
+    assert wants_summary(task)
+
+
+@pytest.mark.parametrize("task", ["create change request", "open the incident list", "summer schedule"])
+def test_other_tasks_are_scored(task):
+    assert not wants_summary(task)
+
+
+def test_long_summary_task_scores_low_without_the_override():
+    # what the override exists for: BM25-style coverage drops with every extra word
+    _, _, score = BookmarkRegistry(None).route("summarize the key points of this long incident ticket for me")
+    assert score < 0.6  # intent_min_score default
+    assert BookmarkRegistry(None).route("summarizing this")[2] == 0.0
+
+
+def test_bookmarks_still_route():
+    assert BookmarkRegistry(None).route("create a new change request")[:2] == ("bookmark", "create_change_request")
+
+
+def test_summary_task_wins_over_a_bookmark_payload(monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("pydantic_settings")
+    import asyncio
+    import main
+
+    class Agent:
+        def __init__(self, name):
+            self.name = name
+
+        async def run(self, _payload):
+            return self.name
+
+    monkeypatch.setattr(main, "SummarizerAgent", lambda: Agent("summarizer"))
+    monkeypatch.setattr(main, "BookmarksAgent", lambda: Agent("bookmarks"))
+    both = asyncio.run(main.intent({"task": "summarize this page", "bookmark": {"name": "x"}}))
+    assert both == {"type": "summary", "result": "summarizer"}
+    only_bookmark = asyncio.run(main.intent({"task": "open it", "bookmark": {"name": "x"}}))
+    assert only_bookmark == {"type": "bookmark", "result": "bookmarks"}
@@ -0,0 +1,30 @@
+import metrics
+from persistence import GraphStore
+
+
+def test_queued_writes_reach_disk(tmp_path):
+    store = GraphStore(str(tmp_path / "graph.db"))
+    try:
+        store.upsert_node("https://a.example/", "Home", None)
+        store.upsert_edge("https://a.example/", "https://a.example/x", "a.nav", "/x")
+        store.flush()
+        assert store.stats()["written"] == 2
+        assert [e["dst"] for e in store.outgoing("https://a.example/")] == ["https://a.example/x"]
+    finally:
+        store.close()
+
+
+def test_failed_batches_are_retried_then_counted(tmp_path):
+    store = GraphStore(str(tmp_path / "graph.db"), write_retries=1)
+    try:
+        store._wconn.execute("DROP TABLE edges")
+        before = metrics.EVENTS.values.get((("kind", "graph_write_dropped"),), 0.0)
+        store.upsert_edge("https://a.example/", "https://a.example/x")
+        store.upsert_edge("https://a.example/", "https://a.example/y")
+        store.flush()
+        stats = store.stats()
+        assert stats["dropped"] == 2
+        assert "edges" in stats["last_error"]
+        assert metrics.EVENTS.values[(("kind", "graph_write_dropped"),)] == before + 2
+    finally:
+        store.close()
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("pydantic")  # planner's models
+
+import planner
+from compact_dom import decode_compact, encode_compact
+
+DOM = [
+    {"tag": "input", "role": "textbox", "name": "Search", "selector": "#q", "text": ""},
+    {"tag": "a", "name": "Cart (3)", "selector": "#cart", "text": "Cart (3)", "href": "/cart?t=1"},
+    {"tag": "button", "name": "Go", "selector": "#go"},
+]
+
+
+def test_key_does_not_rank_the_snapshot(monkeypatch):
+    def no_ranking(*_a, **_k):
+        raise AssertionError("the cache key must not run the BM25 pass")
+
+    monkeypatch.setattr(planner, "select_controls", no_ranking)
+    assert planner._plan_cache_key("search laptops", DOM)
+
+
+def test_key_ignores_volatile_fields_but_not_structure():
+    key = planner._plan_cache_key("Search  Laptops", DOM)
+    visit = [dict(c, text="Cart (4)", href="/cart?t=2") if c["selector"] == "#cart" else c for c in DOM]
+    assert planner._plan_cache_key("search laptops", visit) == key
+    renamed = [dict(c, name="Find") if c["selector"] == "#q" else c for c in DOM]
+    assert planner._plan_cache_key("search laptops", renamed) != key
+    assert planner._plan_cache_key("search laptops", DOM, history=[{"action": "click"}]) != key
+
+
+def test_compact_and_list_snapshots_share_keys():
+    compact = decode_compact(encode_compact(DOM))
+    assert planner._plan_cache_key("search laptops", compact) == planner._plan_cache_key("search laptops", DOM)
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+pytest.importorskip("pydantic_settings")  # budgets come from settings
+
+import planner
+from settings import settings
+from tokenizer import count_json_tokens
+
+INVOICES = [{"tag": "a", "name": f"Invoice {i}", "selector": f"#inv{i}"} for i in range(5)]
+FILLER = [{"tag": "a", "name": f"Help topic {i}", "selector": f"#help{i}"} for i in range(25)]
+DOM = FILLER[:10] + INVOICES + FILLER[10:]
+GOAL = "open the invoice"
+
+
+def _control_cost(c):
+    return count_json_tokens(planner._slim_control(c), planner._encoding()) + 1
+
+
+def _shown(messages):
+    controls = messages[1]["content"].split("SNAPSHOT_CONTROLS (trimmed):\n", 1)[1]
+    return [c["selector"] for c in json.loads(controls)]
+
+
+def _fixed_cost(breakdown):
+    return breakdown["total"] - breakdown["controls"]
+
+
+def test_controls_are_dropped_lowest_rank_first(monkeypatch):
+    _, full = planner._build_plan_prompt(GOAL, DOM)
+    assert full["controls_shown"] == len(DOM)
+    room = sum(_control_cost(c) for c in INVOICES[:3]) + 2
+    monkeypatch.setattr(settings, "prompt_token_budget", _fixed_cost(full) + room)
+    messages, breakdown = planner._build_plan_prompt(GOAL, DOM)
+    shown = _shown(messages)
+    assert 1 <= len(shown) <= 3
+    assert all(s.startswith("#inv") for s in shown)  # every filler control went before any match
+    assert breakdown["total"] <= breakdown["budget"]
+    assert breakdown["controls_total"] == len(DOM)
+
+
+def test_history_keeps_the_most_recent_steps(monkeypatch):
+    history = [{"action": "click", "selector": f"#step{i}"} for i in range(40)]
+    monkeypatch.setattr(settings, "prompt_history_tokens", 60)
+    messages, breakdown = planner._build_plan_prompt(GOAL, DOM, history=history)
+    assert 0 < breakdown["history_steps"] < len(history)
+    assert breakdown["history"] <= 60
+    user = messages[1]["content"]
+    assert '"#step39"' in user and '"#step0"' not in user
+
+
+def test_long_goal_is_cut_to_its_budget(monkeypatch):
+    monkeypatch.setattr(settings, "prompt_goal_tokens", 20)
+    _, breakdown = planner._build_plan_prompt("invoice " * 200, DOM)
+    assert breakdown["goal"] <= 20
+
+
+def test_static_prefix_does_not_depend_on_the_request():
+    a_messages, a = planner._build_plan_prompt(GOAL, DOM)
+    b_messages, b = planner._build_plan_prompt("search for help", FILLER, history=[{"action": "click", "selector": "#x"}])
+    assert a["static_prefix"] == b["static_prefix"] > 0
+    assert a_messages[0] == b_messages[0]  # the system message is the cacheable prefix
+    assert a_messages[1] != b_messages[1]
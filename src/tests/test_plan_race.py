@@ -0,0 +1,110 @@
+import asyncio
+import json
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("pydantic")  # planner's models
+
+import planner
+from cache import LRUCache
+from singleflight import SingleFlight
+
+DOM = [{"tag": "input", "role": "searchbox", "name": "Search", "selector": "#q"}]
+GOAL = "search for laptops"
+LLM_PLAN = json.dumps({"steps": [
+    {"action": "click", "selector": "#q"},
+    {"action": "type", "selector": "#q", "text": "laptops from the model", "enter": True},
+]})
+
+
+def _model(monkeypatch, delays):
+    """Model calls that answer after delays[i] seconds (None: wait for state.release)."""
+    state = types.SimpleNamespace(calls=0, release=None)
+
+    async def ainvoke_llm(messages, llm=None, op="llm"):
+        delay = delays[state.calls]
+        state.calls += 1
+        if delay is None:
+            await state.release.wait()
+        else:
+            await asyncio.sleep(delay)
+        return types.SimpleNamespace(content=LLM_PLAN)
+
+    cache = LRUCache()
+    monkeypatch.setitem(sys.modules, "llm", types.SimpleNamespace(ainvoke_llm=ainvoke_llm))
+    monkeypatch.setattr(planner, "_build_llm", lambda: object())
+    monkeypatch.setattr(planner, "get_plan_cache", lambda: cache)
+    monkeypatch.setattr(planner, "plan_flight", SingleFlight("plan"))
+    monkeypatch.setattr(planner, "_plan_latency", planner._LatencyWindow())
+    return state, cache
+
+
+def test_confident_heuristic_wins_the_deadline_and_the_late_plan_is_cached(monkeypatch):
+    state, cache = _model(monkeypatch, [None])
+
+    async def run():
+        state.release = asyncio.Event()
+        plan = await planner.generate_plan(GOAL, DOM, deadline_ms=20, hedge=False)
+        assert len(cache) == 0  # the heuristic answer is never cached
+        state.release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        return plan
+
+    plan = asyncio.run(run())
+    assert plan.meta["path"] == "heuristic"
+    assert plan.meta["reason"] == "llm_deadline"
+    assert plan.meta["deadline_ms"] == 20
+    assert plan.steps[1].text == "laptops"
+    late = cache.get(planner._plan_cache_key(GOAL, DOM))
+    assert late[1]["text"] == "laptops from the model"
+
+
+def test_llm_within_the_deadline_wins(monkeypatch):
+    _model(monkeypatch, [0.0])
+    plan = asyncio.run(planner.generate_plan(GOAL, DOM, deadline_ms=1000, hedge=False))
+    assert plan.meta["path"] == "llm"
+
+
+def test_unconfident_goal_waits_for_the_model(monkeypatch):
+    _model(monkeypatch, [0.05])
+    plan = asyncio.run(planner.generate_plan("open the cart and remove the laptop", DOM, deadline_ms=1, hedge=False))
+    assert plan.meta["path"] == "llm"
+
+
+def _warm(samples=20, seconds=0.02):
+    for _ in range(samples):
+        planner._plan_latency.add(seconds)
+
+
+def test_hedge_fires_after_p95_and_the_faster_call_wins(monkeypatch):
+    state, _ = _model(monkeypatch, [None, 0.0])
+    _warm()
+
+    async def run():
+        state.release = asyncio.Event()
+        return await planner.generate_plan(GOAL, DOM, use_cache=False, deadline_ms=0, hedge=True)
+
+    plan = asyncio.run(run())
+    assert state.calls == 2
+    assert plan.meta["hedged"] is True
+    assert plan.meta["hedge_winner"] == "hedge"
+    assert plan.meta["hedge_after_ms"] == 20.0
+
+
+def test_no_hedge_when_the_first_call_is_fast_enough(monkeypatch):
+    state, _ = _model(monkeypatch, [0.0, 0.0])
+    _warm(seconds=0.5)
+    plan = asyncio.run(planner.generate_plan(GOAL, DOM, use_cache=False, deadline_ms=0, hedge=True))
+    assert state.calls == 1
+    assert plan.meta["hedged"] is False
+
+
+def test_no_hedge_without_enough_latency_samples(monkeypatch):
+    state, _ = _model(monkeypatch, [0.1, 0.0])
+    _warm(samples=5, seconds=0.001)
+    plan = asyncio.run(planner.generate_plan(GOAL, DOM, use_cache=False, deadline_ms=0, hedge=True))
+    assert state.calls == 1
+    assert plan.meta["hedged"] is False
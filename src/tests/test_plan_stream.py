@@ -0,0 +1,54 @@
+import asyncio
+import json
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("pydantic")  # planner's models
+
+import planner
+from cache import LRUCache
+
+DOM = [{"tag": "input", "role": "textbox", "name": "Search", "selector": "#q"}]
+PLAN = json.dumps({"steps": [
+    {"action": "click", "query": {"role": "textbox", "name": "Search"}},
+    {"action": "type", "query": {"role": "textbox", "name": "Search"}, "text": "laptops"},
+]})
+
+
+def _stream(monkeypatch, pieces, fail=None):
+    async def astream_llm(messages, llm=None, op="llm"):
+        for p in pieces:
+            yield p
+        if fail is not None:
+            raise fail
+
+    cache = LRUCache()
+    monkeypatch.setitem(sys.modules, "llm", types.SimpleNamespace(astream_llm=astream_llm))
+    monkeypatch.setattr(planner, "_build_llm", lambda: object())
+    monkeypatch.setattr(planner, "get_plan_cache", lambda: cache)
+
+    async def collect():
+        return [ev async for ev in planner.stream_plan("search for laptops", DOM)]
+
+    return asyncio.run(collect()), cache
+
+
+def test_complete_stream_is_cached(monkeypatch):
+    events, cache = _stream(monkeypatch, [PLAN[:40], PLAN[40:]])
+    assert sum("step" in e for e in events) == 2
+    assert len(cache) == 1
+
+
+def test_truncated_stream_is_not_cached(monkeypatch):
+    events, cache = _stream(monkeypatch, [PLAN[: PLAN.index("laptops")]])
+    assert sum("step" in e for e in events) == 1
+    assert events[-1]["meta"]["path"] == "llm"
+    assert len(cache) == 0
+
+
+def test_stream_error_is_not_cached(monkeypatch):
+    events, cache = _stream(monkeypatch, [PLAN[: PLAN.index("laptops")]], fail=ConnectionError("reset"))
+    assert sum("step" in e for e in events) == 1
+    assert len(cache) == 0
@@ -0,0 +1,57 @@
+from reliability import ReliabilityIndex, query_key, selector_key
+from selector_index import SelectorIndex, StepResolver
+
+QUERY = {"role": "textbox", "name": "Search"}
+
+
+def _entries(index, host="a.example"):
+    return {k: (round(s, 3), round(t, 3)) for k, (s, t, _) in index._hosts[host].items()}
+
+
+def test_selector_hit_credits_the_selector():
+    index = ReliabilityIndex()
+    index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success", "via": "selector"}, now=0)
+    assert _entries(index) == {selector_key("#q"): (1.0, 1.0)}
+
+
+def test_query_rescue_counts_as_selector_failure():
+    index = ReliabilityIndex()
+    index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success", "via": "query"}, now=0)
+    assert _entries(index) == {query_key(QUERY): (1.0, 1.0), selector_key("#q"): (0.0, 1.0)}
+
+
+def test_active_element_fallback_is_not_a_target_success():
+    index = ReliabilityIndex()
+    index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success", "via": "active"}, now=0)
+    assert _entries(index) == {query_key(QUERY): (0.0, 1.0), selector_key("#q"): (0.0, 1.0)}
+
+
+def test_repeated_rescues_mark_the_selector_unreliable():
+    index = ReliabilityIndex(min_reports=3)
+    for _ in range(5):
+        index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success", "via": "query"})
+    view = index.view("a.example")
+    assert view.selector_unreliable("#q")
+    assert not view.query_unreliable(QUERY)
+
+
+def test_without_via_the_selector_is_credited():
+    index = ReliabilityIndex()
+    index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success"}, now=0)
+    index.record("a.example", {"query": QUERY, "outcome": "ok"}, now=0)
+    assert _entries(index) == {selector_key("#q"): (1.0, 1.0), query_key(QUERY): (1.0, 1.0)}
+
+
+def test_demoted_focus_click_keeps_checking_the_page():
+    index = ReliabilityIndex(min_reports=3)
+    for _ in range(5):
+        index.record("a.example", {"selector": "#q", "query": QUERY, "outcome": "success", "via": "query"})
+    dom = [
+        {"tag": "input", "role": "textbox", "name": "Search", "selector": "#q"},
+        {"tag": "button", "role": "button", "name": "Go", "selector": "#go"},
+    ]
+    resolver = StepResolver(SelectorIndex(dom, reliability=index.view("a.example")))
+    click = resolver.check({"action": "click", "selector": "#q"})
+    assert "selector" not in click and click["query"] == QUERY
+    assert resolver.same_page  # focusing the text input does not leave the page
+    assert resolver.check({"action": "click", "selector": "#missing", "query": {"role": "button", "name": "Go"}})["selector"] == "#go"
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import compact_dom
+from admission import AdmissionController
+from bookmark_registry import BookmarkRegistry
+from cache import LRUCache
+from persistence import GraphStore
+from reliability import ReliabilityIndex
+from singleflight import SingleFlight
+from traversal_manager import TraversalRegistry
+
+
+def _payloads(tmp_path):
+    """The shapes the JSON endpoints return, built from the real components."""
+    memory = TraversalRegistry().get("s")
+    memory.seed("https://a.example/")
+    memory.push_links("https://a.example/", ["/x", "https://b.example/y"], "a.nav", 0)
+    shared = TraversalRegistry(db_path=str(tmp_path / "frontier.db")).get("s")
+    shared.seed("https://a.example/")
+    shared.push_links("https://a.example/", ["/x"], None, 0)
+
+    index = ReliabilityIndex(min_reports=1)
+    index.record_many("a.example", [
+        {"selector": "#q", "outcome": "success"},
+        {"query": {"role": "button", "name": "Go"}, "outcome": "not_found"},
+    ])
+
+    store = GraphStore(str(tmp_path / "graph.db"))
+    store.upsert_node("https://a.example/", "Home", None)
+    store.upsert_edge("https://a.example/", "https://a.example/x", "a.nav", "/x")
+    store.flush()
+    pages, edges = store.crawl_history(), store.outgoing("https://a.example/")
+    store.close()
+
+    cache = LRUCache(maxsize=4, ttl=60)
+    cache.set("k", {"steps": []})
+    cache.get("k")
+    return {
+        "/health": {"ok": True, "pid": 1, "import_ms": 1.5, "startup_ms": None, "llm": AdmissionController().stats()},
+        "/explore/next": {"urls": memory.next_batch(2), "frontier_size": len(memory)},
+        "/explore/stats memory": memory.stats(),
+        "/explore/stats sqlite": shared.stats(),
+        "/outcomes": {"ok": True, "recorded": 2},
+        "/reliability": index.stats(),
+        "/reliability?host": {"host": "a.example", "targets": index.report("a.example")},
+        "/pages/history": {"pages": pages, "edges": edges},
+        "/cache/stats": {
+            "plan": cache.stats(),
+            "summary": None,
+            "singleflight": {"plan": SingleFlight("plan").stats()},
+        },
+        "/bookmarks/stats": BookmarkRegistry(None).stats(),
+        "/plan/batch": {"index": 0, "ok": False, "status": 400, "error": "bad item"},
+        "/summarize": {"summary": "Résumé — 要約", "chunks": 2},
+    }
+
+
+def _normalized(obj):
+    """What a client reads back: JSON object keys are always strings."""
+    return json.loads(json.dumps(obj, default=str))
+
+
+@pytest.mark.parametrize("fast", [True, False], ids=["orjson", "stdlib"])
+def test_every_endpoint_payload_serializes(tmp_path, monkeypatch, fast):
+    if fast and compact_dom.orjson is None:
+        pytest.skip("orjson not installed")
+    if not fast:
+        monkeypatch.setattr(compact_dom, "orjson", None)
+    for name, payload in _payloads(tmp_path).items():
+        assert json.loads(compact_dom.dumps(payload)) == _normalized(payload), name
+
+
+@pytest.mark.parametrize("fast", [True, False], ids=["orjson", "stdlib"])
+def test_non_string_keys(monkeypatch, fast):
+    if fast and compact_dom.orjson is None:
+        pytest.skip("orjson not installed")
+    if not fast:
+        monkeypatch.setattr(compact_dom, "orjson", None)
+    out = json.loads(compact_dom.dumps({"by_depth": {0: 1, 2: 5}, "flags": {True: 1}}))
+    assert out == {"by_depth": {"0": 1, "2": 5}, "flags": {"true": 1}}
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import sys
+import types
+
+import pytest
+
+from singleflight import SingleFlight
+
+pytest.importorskip("pydantic")  # planner's models
+
+import planner
+
+DOM = [{"tag": "input", "role": "textbox", "name": "Search", "selector": "#q"}]
+PLAN = json.dumps({"steps": [{"action": "type", "selector": "#q", "text": "laptops"}]})
+
+
+def _slow_model(monkeypatch):
+    """A model call that blocks until released; counts how often it ran and whether it was cancelled."""
+    state = types.SimpleNamespace(calls=0, cancelled=0, release=None)
+
+    async def ainvoke_llm(messages, llm=None, op="llm"):
+        state.calls += 1
+        try:
+            await state.release.wait()
+        except asyncio.CancelledError:
+            state.cancelled += 1
+            raise
+        return types.SimpleNamespace(content=PLAN)
+
+    flight = SingleFlight("plan")
+    monkeypatch.setitem(sys.modules, "llm", types.SimpleNamespace(ainvoke_llm=ainvoke_llm))
+    monkeypatch.setattr(planner, "_build_llm", lambda: object())
+    monkeypatch.setattr(planner, "plan_flight", flight)
+    return state, flight
+
+
+def _plan():
+    return planner.generate_plan("search for laptops", DOM, use_cache=False, deadline_ms=0, hedge=False)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_cancelled_caller_leaves_the_shared_call_to_the_survivor(monkeypatch):
+    state, flight = _slow_model(monkeypatch)
+
+    async def run():
+        state.release = asyncio.Event()
+        first, second = asyncio.ensure_future(_plan()), asyncio.ensure_future(_plan())
+        await _settle()
+        first.cancel()
+        await _settle()
+        state.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    plan = asyncio.run(run())
+    assert plan.meta["path"] == "llm"
+    assert plan.steps[0].text == "laptops"
+    assert state.calls == 1 and state.cancelled == 0
+    assert flight.stats() == {"calls": 2, "executions": 1, "saved": 1, "abandoned": 0, "inflight": 0}
+
+
+def test_call_is_cancelled_when_every_caller_leaves(monkeypatch):
+    state, flight = _slow_model(monkeypatch)
+
+    async def run():
+        state.release = asyncio.Event()
+        callers = [asyncio.ensure_future(_plan()) for _ in range(2)]
+        await _settle()
+        for c in callers:
+            c.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await _settle()
+
+    asyncio.run(run())
+    assert state.calls == 1 and state.cancelled == 1
+    assert flight.stats()["abandoned"] == 1
+    assert flight.stats()["inflight"] == 0
+
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    flight = SingleFlight("t")
+    runs = []
+
+    async def boom():
+        runs.append(1)
+        await asyncio.sleep(0)
+        raise ValueError("model failed")
+
+    async def run():
+        results = await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        with pytest.raises(ValueError):
+            await flight.do("k", boom)  # a fresh computation, not a cached failure
+
+    asyncio.run(run())
+    assert len(runs) == 2
+    assert flight.stats()["inflight"] == 0
@@ -0,0 +1,128 @@
+import pytest
+
+from snapshot_store import ResyncRequired, SnapshotStore, SqliteSnapshotStore
+
+DOM = [
+    {"selector": "#a", "tag": "a", "name": "Home"},
+    {"selector": "#q", "tag": "input", "role": "textbox", "name": "Search"},
+]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        s = SnapshotStore()
+    else:
+        s = SqliteSnapshotStore(str(tmp_path / "snap.db"))
+    yield s
+    s.close()
+
+
+def test_delta_on_current_base(store):
+    base = store.put_full("s1", DOM)
+    snap = store.apply_delta("s1", {
+        "base_hash": base.hash,
+        "removed": ["#a"],
+        "changed": [{"selector": "#q", "tag": "input", "role": "textbox", "name": "Find"}],
+        "added": [{"selector": "#go", "tag": "button", "name": "Go"}],
+    })
+    assert [c["selector"] for c in snap.dom()] == ["#q", "#go"]
+    assert snap.dom()[0]["name"] == "Find"
+    fresh = SnapshotStore().put_full("x", snap.dom())
+    assert snap.hash == fresh.hash
+
+
+def test_stale_or_unknown_base_needs_resync(store):
+    base = store.put_full("s1", DOM).hash
+    current = store.apply_delta("s1", {"base_hash": base, "removed": ["#a"]}).hash
+    with pytest.raises(ResyncRequired):
+        store.apply_delta("s1", {"base_hash": base, "removed": ["#q"]})
+    with pytest.raises(ResyncRequired):
+        store.apply_delta("nope", {"base_hash": current})
+    store.drop("s1")
+    with pytest.raises(ResyncRequired):
+        store.apply_delta("s1", {"base_hash": current})
+
+
+def test_workers_share_sqlite_snapshots(tmp_path):
+    path = str(tmp_path / "snap.db")
+    worker_a, worker_b = SqliteSnapshotStore(path), SqliteSnapshotStore(path)
+    try:
+        h = worker_a.put_full("s1", DOM).hash
+        for i, worker in enumerate([worker_b, worker_a, worker_b]):
+            h = worker.apply_delta("s1", {"base_hash": h, "added": [{"selector": f"#n{i}", "name": str(i)}]}).hash
+        assert len(worker_a.apply_delta("s1", {"base_hash": h}).dom()) == 5
+    finally:
+        worker_a.close()
+        worker_b.close()
+
+
+def test_sqlite_store_is_bounded(tmp_path):
+    store = SqliteSnapshotStore(str(tmp_path / "snap.db"), max_sessions=3, trim_every=1)
+    for i in range(10):
+        store.put_full(f"s{i}", DOM)
+    assert len(store) == 3
+    store.drop("s9")
+    assert len(store) == 2
+    assert store._conn.execute("SELECT COUNT(*) FROM dom_controls").fetchone()[0] == 2 * len(DOM)
+    store.close()
+
+
+def _delta(prev, cur, base_hash):
+    """What the extension's domPayload() sends."""
+    key = {c["selector"]: c for c in prev}
+    now = [c["selector"] for c in cur]
+    added = [(i, c) for i, c in enumerate(cur) if c["selector"] not in key]
+    return {
+        "base_hash": base_hash,
+        "removed": [k for k in key if k not in now],
+        "changed": [c for c in cur if c["selector"] in key and key[c["selector"]] != c],
+        "added": [c for _, c in added],
+        "added_at": [i for i, _ in added],
+    }
+
+
+def test_added_controls_keep_page_order(store):
+    prev = [{"selector": s} for s in ("#a", "#b", "#c", "#d")]
+    cur = [{"selector": s} for s in ("#new0", "#a", "#c", "#x", "#y", "#d", "#z")]
+    base = store.put_full("s1", prev).hash
+    snap = store.apply_delta("s1", _delta(prev, cur, base))
+    assert snap.dom() == cur
+
+
+def test_added_without_positions_are_appended(store):
+    base = store.put_full("s1", [{"selector": "#a"}, {"selector": "#b"}]).hash
+    snap = store.apply_delta("s1", {"base_hash": base, "added": [{"selector": "#n"}]})
+    assert [c["selector"] for c in snap.dom()] == ["#a", "#b", "#n"]
+
+
+def test_sqlite_delta_writes_only_changed_rows(tmp_path):
+    store = SqliteSnapshotStore(str(tmp_path / "snap.db"))
+    dom = [{"selector": f"#c{i}", "name": str(i)} for i in range(50)]
+    base = store.put_full("s1", dom).hash
+    writes = []
+    store._conn.set_trace_callback(lambda sql: writes.append(sql) if "dom_controls" in sql and "SELECT" not in sql else None)
+    snap = store.apply_delta("s1", {
+        "base_hash": base,
+        "removed": ["#c3"],
+        "changed": [{"selector": "#c7", "name": "seven"}, dom[8]],
+        "added": [{"selector": "#n"}],
+        "added_at": [1],
+    })
+    store._conn.set_trace_callback(None)
+    assert len(writes) == 3  # one delete, #c7 and #n; the unchanged #c8 is not rewritten
+    reread = store.apply_delta("s1", {"base_hash": snap.hash})
+    assert reread.dom() == snap.dom()
+    assert [c["selector"] for c in reread.dom()[:3]] == ["#c0", "#n", "#c1"]
+    store.close()
+
+
+def test_sqlite_positions_are_renumbered_when_they_run_out(tmp_path):
+    store = SqliteSnapshotStore(str(tmp_path / "snap.db"))
+    h = store.put_full("s1", [{"selector": "#a"}, {"selector": "#b"}]).hash
+    expected = ["#a", "#b"]
+    for i in range(40):  # always between #a and the previous insert: halves the gap each time
+        h = store.apply_delta("s1", {"base_hash": h, "added": [{"selector": f"#n{i}"}], "added_at": [1]}).hash
+        expected.insert(1, f"#n{i}")
+    assert [c["selector"] for c in store.apply_delta("s1", {"base_hash": h}).dom()] == expected
+    store.close()
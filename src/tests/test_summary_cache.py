@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("pydantic_settings")  # settings
+
+from agents.summarizer import _chunk_get, _chunk_key, _chunk_set
+from cache import LRUCache
+from masking import Masker
+
+CHUNK = "Contact jane.doe@example.com about the renewal."
+TITLE = "Account for jane.doe@example.com"
+
+
+def _masked(key):
+    vault = Masker(["email"], key=key).vault()
+    title, chunk = vault.mask_many([TITLE, CHUNK])
+    return vault, title, chunk
+
+
+def test_chunk_keys_do_not_depend_on_the_masking_key():
+    a, title_a, chunk_a = _masked(b"a" * 16)
+    b, title_b, chunk_b = _masked(b"b" * 16)
+    assert chunk_a != chunk_b
+    assert _chunk_key(title_a, chunk_a, a) == _chunk_key(title_b, chunk_b, b) == _chunk_key(TITLE, CHUNK)
+
+
+def test_cached_chunk_summary_is_remasked_for_another_key():
+    cache = LRUCache(maxsize=8)
+    a, title_a, chunk_a = _masked(b"a" * 16)
+    ph_a = a.mask("jane.doe@example.com")
+    _chunk_set(cache, title_a, chunk_a, f"- renewal owner {ph_a}", a)
+
+    b, title_b, chunk_b = _masked(b"b" * 16)
+    hit = _chunk_get(cache, title_b, chunk_b, b)
+    assert hit == f"- renewal owner {b.mask('jane.doe@example.com')}"  # the model never sees the address
+    assert b.unmask(hit) == "- renewal owner jane.doe@example.com"
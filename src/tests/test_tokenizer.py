@@ -0,0 +1,47 @@
+import tokenizer
+
+
+class _Encoding:
+    def encode(self, text, disallowed_special=()):
+        return list(text)  # one token per character, unlike the estimate
+
+
+class _Tiktoken:
+    def __init__(self):
+        self.loads = 0
+
+    def get_encoding(self, name):
+        self.loads += 1
+        return _Encoding()
+
+
+def test_counting_never_loads_the_encoding(monkeypatch):
+    fake = _Tiktoken()
+    monkeypatch.setattr(tokenizer, "tiktoken", fake)
+    monkeypatch.setattr(tokenizer, "_encodings", {})
+    assert tokenizer.count_tokens("hello world", "fake") == tokenizer._estimate("hello world")
+    assert tokenizer.backend("fake") == "estimate"
+    assert fake.loads == 0
+
+
+def test_load_switches_counts_and_static_parts(monkeypatch):
+    fake = _Tiktoken()
+    monkeypatch.setattr(tokenizer, "tiktoken", fake)
+    monkeypatch.setattr(tokenizer, "_encodings", {})
+    assert tokenizer.count_static("static prompt", "fake") == 2
+    assert tokenizer.load("fake") == "tiktoken:fake"
+    assert tokenizer.load("fake") == "tiktoken:fake"
+    assert fake.loads == 1
+    assert tokenizer.count_tokens("hello world", "fake") == 11
+    assert tokenizer.count_static("static prompt", "fake") == 13  # not the count cached before load()
+
+
+def test_failed_load_keeps_the_estimate(monkeypatch):
+    class Offline:
+        def get_encoding(self, name):
+            raise OSError("no network")
+
+    monkeypatch.setattr(tokenizer, "tiktoken", Offline())
+    monkeypatch.setattr(tokenizer, "_encodings", {})
+    assert tokenizer.load("fake") == "estimate"
+    assert tokenizer.count_tokens("hello world", "fake") == 2
@@ -0,0 +1,97 @@
+from traversal_manager import TraversalManager, TraversalRegistry
+
+
+def test_dedupe_on_canonical_urls():
+    tm = TraversalManager()
+    tm.seed("https://A.example/")
+    assert tm.push_links("https://a.example", ["/x", "https://a.example/x#top", "https://a.example:443/"], None, 0) == 1
+    assert [e["url"] for e in tm.next_batch(5)] == ["https://a.example", "https://a.example/x"]
+
+
+def test_seen_set_is_bounded():
+    tm = TraversalManager(max_size=10, max_seen=100)
+    for i in range(50):
+        tm.push_links("https://a.example/", [f"/p{i}-{j}" for j in range(10)], None, 0)
+        tm.next_batch(10)
+    stats = tm.stats()
+    assert stats["seen"] == 100
+    assert stats["forgotten"] == 400
+
+
+def test_relinked_urls_stay_remembered():
+    tm = TraversalManager(max_size=10, max_seen=10)
+    tm.push_links("https://a.example/", ["/home"], None, 0)
+    for i in range(30):
+        # every page links home again, which keeps it at the fresh end of the LRU
+        assert tm.push_links("https://a.example/", ["/home", f"/p{i}"], None, 0) == 1
+
+
+def _sqlite(tmp_path, **kw):
+    return TraversalRegistry(db_path=str(tmp_path / "frontier.db"), **kw)
+
+
+def test_sqlite_frontier_deletes_popped_and_evicted_rows(tmp_path):
+    registry = _sqlite(tmp_path, max_size=3)
+    tm = registry.get("s")
+    tm.seed("https://a.example/")
+    assert tm.push_links("https://a.example/", ["/1", "/2", "/3", "/1"], None, 0) == 3
+    assert len(tm) == 3  # one of the depth-1 links was evicted
+    assert tm.pop()["url"] == "https://a.example"
+    assert [e["url"] for e in tm.next_batch(5)] == ["https://a.example/1", "https://a.example/2"]
+    assert registry._conn.execute("SELECT COUNT(*) FROM frontier_queue").fetchone()[0] == 0
+    assert tm.stats() == {"frontier_size": 0, "seen": 4, "forgotten": 0, "evicted": 1, "by_depth": {}, "hosts": 0}
+    assert tm.push_links("https://a.example/", ["/2", "/3"], None, 0) == 0  # still deduped after the rows are gone
+    registry.close()
+
+
+def test_sqlite_frontier_stats_count_hosts_across_depths(tmp_path):
+    registry = _sqlite(tmp_path)
+    tm = registry.get("s")
+    tm.seed("https://a.example/")
+    tm.seed("https://b.example/")
+    tm.push_links("https://a.example/", ["https://c.example/", "https://d.example/"], None, 0)
+    stats = tm.stats()
+    assert stats["by_depth"] == {0: 2, 1: 2}
+    assert stats["hosts"] == 4
+    registry.close()
+
+
+def test_sqlite_frontier_seen_is_bounded(tmp_path):
+    registry = _sqlite(tmp_path, max_size=5, max_seen=10)
+    tm = registry.get("s")
+    for i in range(6):
+        tm.push_links("https://a.example/", [f"/p{i}-{j}" for j in range(5)], None, 0)
+        tm.next_batch(5)
+    assert tm.stats()["seen"] == 10
+    assert tm.stats()["forgotten"] == 20
+    assert registry._conn.execute("SELECT COUNT(*) FROM frontier_seen").fetchone()[0] == 10
+    registry.close()
+
+
+def test_workers_share_one_sqlite_frontier(tmp_path):
+    a, b = _sqlite(tmp_path).get("s"), _sqlite(tmp_path).get("s")
+    a.push_links("https://a.example/", ["/1", "/2"], None, 0)
+    assert b.push_links("https://a.example/", ["/2", "/3"], None, 0) == 1
+    assert b.pop()["url"] == "https://a.example/1"
+    assert len(a) == 2
+
+
+def _rows(registry, session):
+    return [
+        registry._conn.execute(f"SELECT COUNT(*) FROM {t} WHERE session = ?", (session,)).fetchone()[0]
+        for t in ("frontier_queue", "frontier_seen", "frontier_counts")
+    ]
+
+
+def test_sqlite_rows_are_deleted_on_evict_and_drop(tmp_path):
+    registry = _sqlite(tmp_path, max_sessions=2)
+    for s in ("s1", "s2"):
+        registry.get(s).push_links("https://a.example/", ["/1", "/2"], None, 0)
+    assert _rows(registry, "s1") == [2, 2, 1]
+    registry.get("s3").seed("https://a.example/")  # evicts s1, the least recently used
+    assert _rows(registry, "s1") == [0, 0, 0]
+    assert _rows(registry, "s2") == [2, 2, 1]
+    registry.drop("s2")
+    assert _rows(registry, "s2") == [0, 0, 0]
+    assert registry._conn.execute("SELECT COUNT(*) FROM frontier_seen").fetchone()[0] == 1  # only s3 is left
+    registry.close()
@@ -0,0 +1,77 @@
+"""
+Local token counting for prompt budgets.
+
+Uses tiktoken once load() has loaded the encoding: the BPE file may be
+downloaded on first use, so the server calls it at startup in a thread and
+request handling never touches the network. Until then, or when tiktoken is
+missing or offline, counts are an estimate modelled on BPE behaviour: a word is
+one token, a punctuation mark starts a new token (".col", "-type", "("),
+non-ASCII characters count one each. That is close enough to keep prompts
+inside a budget; counts are only used for budgeting and reporting, never sent
+to the model.
+"""
+from __future__ import annotations
+import json
+from functools import lru_cache
+from typing import Any, Dict
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+_PUNCT = "{}[]():;,.\"'-_/<>=#&?!*+|@%$~`^\\"
+
+# encoding name -> tiktoken Encoding, or None when it could not be loaded; filled by load() only
+_encodings: Dict[str, Any] = {}
+
+
+def load(name: str = "o200k_base") -> str:
+    """
+    Load a tiktoken encoding (blocking: may download its BPE file) so later counts
+    use it; returns the backend now in use. Failures leave the estimate in place.
+    """
+    if name not in _encodings:
+        enc = None
+        if tiktoken is not None:
+            try:
+                enc = tiktoken.get_encoding(name)
+            except Exception:
+                enc = None  # offline and not cached yet: keep estimating
+        _encodings[name] = enc
+        count_static.cache_clear()  # static parts were counted with the estimate
+    return backend(name)
+
+
+def _get_encoding(name: str):
+    return _encodings.get(name)
+
+def _estimate(text: str) -> int:
+    # whitespace-separated chunks, plus one per punctuation mark (each one starts a new
+    # piece), plus one per non-ASCII character; only C-level str methods, no regex
+    n = len(text.split()) + sum(text.count(c) for c in _PUNCT)
+    return n + len(text) - len(text.encode("ascii", "ignore"))
+
+
+def count_tokens(text: str, encoding: str = "o200k_base") -> int:
+    if not text:
+        return 0
+    enc = _get_encoding(encoding)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return _estimate(text)
+
+
+def count_json_tokens(obj: Any, encoding: str = "o200k_base") -> int:
+    """Tokens of obj as it appears in a prompt (compact-ish JSON, non-ASCII kept)."""
+    return count_tokens(json.dumps(obj, ensure_ascii=False), encoding)
+
+
+@lru_cache(maxsize=256)
+def count_static(text: str, encoding: str = "o200k_base") -> int:
+    """count_tokens for prompt parts that never change (memoized)."""
+    return count_tokens(text, encoding)
+
+
+def backend(encoding: str = "o200k_base") -> str:
+    return f"tiktoken:{encoding}" if _get_encoding(encoding) is not None else "estimate"
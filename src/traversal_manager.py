@@ -1,18 +1,400 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+from utils import normalize_url, url_host
+
+
+class FrontierEntry:
+    __slots__ = ("url", "depth", "host", "parent", "via_selector", "added")
+
+    def __init__(self, url: str, depth: int, host: str, parent: Optional[str], via_selector: Optional[str]):
+        self.url = url
+        self.depth = depth
+        self.host = host
+        self.parent = parent
+        self.via_selector = via_selector
+        self.added = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "depth": self.depth,
+            "host": self.host,
+            "parent": self.parent,
+            "via_selector": self.via_selector,
+        }
 
-from typing import List, Optional
 
 class TraversalManager:
-    def __init__(self, max_depth: int = 3):
-        self.frontier: List[str] = []
+    """
+    Crawl frontier.
+    - O(1) dedupe on normalize_url()-canonical URLs. The seen set is LRU-bounded by
+      max_seen (a URL is refreshed whenever it is linked again), so a long crawl
+      keeps constant memory; a URL forgotten that long ago may be queued again.
+    - Buckets by depth, then by host: pop() takes the shallowest depth first and
+      round-robins hosts inside it so one site cannot starve the others.
+    - Bounded by max_size: overflow evicts the deepest entry of the largest host queue.
+    """
+
+    blocking = False
+
+    def __init__(self, max_depth: int = 3, max_size: int = 100_000, max_seen: int = 1_000_000):
         self.max_depth = max_depth
+        self.max_size = max(1, int(max_size))
+        self.max_seen = max(self.max_size, int(max_seen))
+        self.seen: "OrderedDict[str, None]" = OrderedDict()
+        self.forgotten = 0
+        self._buckets: Dict[int, "OrderedDict[str, Deque[FrontierEntry]]"] = {}
+        self._size = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, url: str, depth: int, parent: Optional[str], via_selector: Optional[str]) -> bool:
+        key = normalize_url(url)
+        if not key:
+            return False
+        if key in self.seen:
+            self.seen.move_to_end(key)
+            return False
+        self.seen[key] = None
+        if len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+            self.forgotten += 1
+        entry = FrontierEntry(key, depth, url_host(key), parent, via_selector)
+        hosts = self._buckets.setdefault(depth, OrderedDict())
+        hosts.setdefault(entry.host, deque()).append(entry)
+        self._size += 1
+        if self._size > self.max_size:
+            self._evict_one()
+        return True
+
+    def _evict_one(self):
+        depth = max(self._buckets)
+        hosts = self._buckets[depth]
+        host = max(hosts, key=lambda h: len(hosts[h]))
+        hosts[host].pop()
+        if not hosts[host]:
+            del hosts[host]
+        if not hosts:
+            del self._buckets[depth]
+        self._size -= 1
+        self.evicted += 1
 
     def seed(self, url: str):
-        if url and url not in self.frontier:
-            self.frontier.append(url)
+        if url:
+            with self._lock:
+                self._add(url, 0, None, None)
 
-    def push_links(self, current_url: str, links: List[str], via_selector: Optional[str], depth: int):
+    def push_links(self, current_url: str, links: List[str], via_selector: Optional[str], depth: int) -> int:
+        """Queue links found on current_url (at `depth`) as depth+1. Returns how many were new."""
         if depth >= self.max_depth:
-            return
+            return 0
+        added = 0
+        with self._lock:
+            for u in links or []:
+                if not u:
+                    continue
+                if not u.startswith(("http://", "https://")):
+                    if not current_url:
+                        continue
+                    u = urljoin(current_url, u)
+                    if not u.startswith(("http://", "https://")):
+                        continue
+                if self._add(u, depth + 1, current_url or None, via_selector):
+                    added += 1
+        return added
+
+    def pop(self, host: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Next URL to visit: shallowest depth first, hosts round-robin (or only `host`)."""
+        with self._lock:
+            for depth in sorted(self._buckets):
+                hosts = self._buckets[depth]
+                if host is not None:
+                    if host not in hosts:
+                        continue
+                    h = host
+                else:
+                    h = next(iter(hosts))
+                q = hosts[h]
+                entry = q.popleft()
+                if q:
+                    hosts.move_to_end(h)
+                else:
+                    del hosts[h]
+                if not hosts:
+                    del self._buckets[depth]
+                self._size -= 1
+                return entry.to_dict()
+        return None
+
+    def next_batch(self, n: int, host: Optional[str] = None) -> List[Dict[str, Any]]:
+        out = []
+        for _ in range(max(0, n)):
+            e = self.pop(host)
+            if e is None:
+                break
+            out.append(e)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_depth = {d: sum(len(q) for q in hosts.values()) for d, hosts in sorted(self._buckets.items())}
+            hosts = {h for bucket in self._buckets.values() for h in bucket}
+        return {
+            "frontier_size": self._size,
+            "seen": len(self.seen),
+            "forgotten": self.forgotten,
+            "evicted": self.evicted,
+            "by_depth": by_depth,
+            "hosts": len(hosts),
+        }
+
+
+_FRONTIER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier_queue (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    session      TEXT NOT NULL,
+    url          TEXT NOT NULL,
+    depth        INTEGER NOT NULL,
+    host         TEXT NOT NULL,
+    parent       TEXT,
+    via_selector TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_frontier_queue_next ON frontier_queue(session, depth, id);
+CREATE INDEX IF NOT EXISTS ix_frontier_queue_host ON frontier_queue(session, host, depth, id);
+
+CREATE TABLE IF NOT EXISTS frontier_seen (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    url     TEXT NOT NULL,
+    UNIQUE (session, url)
+);
+CREATE INDEX IF NOT EXISTS ix_frontier_seen_age ON frontier_seen(session, id);
+
+CREATE TABLE IF NOT EXISTS frontier_counts (
+    session   TEXT PRIMARY KEY,
+    queued    INTEGER NOT NULL DEFAULT 0,
+    seen      INTEGER NOT NULL DEFAULT 0,
+    forgotten INTEGER NOT NULL DEFAULT 0,
+    evicted   INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_BUMP_COUNTS = """
+INSERT INTO frontier_counts (session, queued, seen, forgotten, evicted) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(session) DO UPDATE SET
+    queued = queued + excluded.queued, seen = seen + excluded.seen,
+    forgotten = forgotten + excluded.forgotten, evicted = evicted + excluded.evicted
+RETURNING queued, seen
+"""
+
+
+class SqliteTraversalManager:
+    """
+    Same API as TraversalManager, but the frontier lives in SQLite (WAL) tables so
+    every worker process of a multi-worker server sees one consistent frontier.
+    - frontier_queue holds only queued URLs: pop() is a single atomic
+      DELETE ... RETURNING, so two workers never hand out the same URL, and
+      evicted rows are deleted too.
+    - frontier_seen is the dedupe set (UNIQUE(session, url)), trimmed oldest
+      first past max_seen.
+    - frontier_counts keeps running totals updated in the same transactions, so
+      no call has to COUNT(*) the queue.
+    Ordering is shallowest depth first, then insertion order. Every call blocks on
+    disk: async callers run it in a thread (`blocking` is True).
+    """
+
+    blocking = True
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, session: str,
+                 max_depth: int = 3, max_size: int = 100_000, max_seen: int = 1_000_000):
+        self.conn = conn
+        self._lock = lock
+        self.session = session
+        self.max_depth = max_depth
+        self.max_size = max(1, int(max_size))
+        self.max_seen = max(self.max_size, int(max_seen))
+
+    def _counts(self) -> Tuple[int, int, int, int]:
+        row = self.conn.execute(
+            "SELECT queued, seen, forgotten, evicted FROM frontier_counts WHERE session = ?", (self.session,)
+        ).fetchone()
+        return tuple(row) if row else (0, 0, 0, 0)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._counts()[0]
+
+    def _insert(self, rows: List[tuple]) -> int:
+        with self._lock:
+            with self.conn:
+                new = [r for r in rows if self.conn.execute(
+                    "INSERT OR IGNORE INTO frontier_seen (session, url) VALUES (?, ?)", (self.session, r[0])
+                ).rowcount]
+                if not new:
+                    return 0
+                self.conn.executemany(
+                    "INSERT INTO frontier_queue (session, url, depth, host, parent, via_selector) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.session, *r) for r in new],
+                )
+                queued, seen = self.conn.execute(_BUMP_COUNTS, (self.session, len(new), len(new), 0, 0)).fetchone()
+                over, forget = queued - self.max_size, seen - self.max_seen
+                if over > 0:
+                    self.conn.execute(
+                        "DELETE FROM frontier_queue WHERE id IN ("
+                        "SELECT id FROM frontier_queue WHERE session = ? ORDER BY depth DESC, id DESC LIMIT ?)",
+                        (self.session, over),
+                    )
+                if forget > 0:
+                    self.conn.execute(
+                        "DELETE FROM frontier_seen WHERE id IN ("
+                        "SELECT id FROM frontier_seen WHERE session = ? ORDER BY id LIMIT ?)",
+                        (self.session, forget),
+                    )
+                if over > 0 or forget > 0:
+                    over, forget = max(0, over), max(0, forget)
+                    self.conn.execute(_BUMP_COUNTS, (self.session, -over, -forget, forget, over)).fetchone()
+        return len(new)
+
+    def seed(self, url: str):
+        key = normalize_url(url)
+        if key:
+            self._insert([(key, 0, url_host(key), None, None)])
+
+    def push_links(self, current_url: str, links: List[str], via_selector: Optional[str], depth: int) -> int:
+        if depth >= self.max_depth:
+            return 0
+        rows = []
         for u in links or []:
-            if u and u not in self.frontier:
-                self.frontier.append(u)
+            if not u:
+                continue
+            if not u.startswith(("http://", "https://")):
+                if not current_url:
+                    continue
+                u = urljoin(current_url, u)
+                if not u.startswith(("http://", "https://")):
+                    continue
+            key = normalize_url(u)
+            rows.append((key, depth + 1, url_host(key), current_url or None, via_selector))
+        return self._insert(rows) if rows else 0
+
+    def pop(self, host: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        where, args = "session = ?", [self.session]
+        if host is not None:
+            where += " AND host = ?"
+            args.append(host)
+        with self._lock:
+            with self.conn:
+                row = self.conn.execute(
+                    f"DELETE FROM frontier_queue WHERE id = ("
+                    f"SELECT id FROM frontier_queue WHERE {where} ORDER BY depth, id LIMIT 1) "
+                    "RETURNING url, depth, host, parent, via_selector",
+                    args,
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(_BUMP_COUNTS, (self.session, -1, 0, 0, 0)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url", "depth", "host", "parent", "via_selector"), row))
+
+    def next_batch(self, n: int, host: Optional[str] = None) -> List[Dict[str, Any]]:
+        out = []
+        for _ in range(max(0, n)):
+            e = self.pop(host)
+            if e is None:
+                break
+            out.append(e)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT depth, COUNT(*) FROM frontier_queue WHERE session = ? GROUP BY depth ORDER BY depth",
+                (self.session,),
+            ).fetchall()
+            hosts = self.conn.execute(
+                "SELECT COUNT(DISTINCT host) FROM frontier_queue WHERE session = ?", (self.session,)
+            ).fetchone()[0]
+            queued, seen, forgotten, evicted = self._counts()
+        return {
+            "frontier_size": queued,
+            "seen": seen,
+            "forgotten": forgotten,
+            "evicted": evicted,
+            "by_depth": dict(rows),
+            "hosts": hosts,
+        }
+
+
+class TraversalRegistry:
+    """
+    One frontier per session id, LRU-bounded. In-memory by default; with db_path
+    the frontiers are SQLite-backed and shared by every worker process, and a
+    session evicted from the LRU or dropped has its rows deleted.
+    """
+
+    def __init__(self, max_depth: int = 3, max_size: int = 100_000, max_sessions: int = 256,
+                 db_path: Optional[str] = None, max_seen: int = 1_000_000):
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.max_seen = max_seen
+        self.max_sessions = max(1, int(max_sessions))
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_FRONTIER_SCHEMA)
+            self._conn.isolation_level = ""
+        # evicting or dropping a SQLite session deletes its rows, so get() and drop() block too
+        self.blocking = self._conn is not None
+
+    def get(self, session_id: Optional[str]):
+        key = session_id or "default"
+        evicted = []
+        with self._lock:
+            tm = self._sessions.get(key)
+            if tm is None:
+                if self._conn is not None:
+                    tm = SqliteTraversalManager(self._conn, self._db_lock, key, max_depth=self.max_depth,
+                                                max_size=self.max_size, max_seen=self.max_seen)
+                else:
+                    tm = TraversalManager(max_depth=self.max_depth, max_size=self.max_size, max_seen=self.max_seen)
+                self._sessions[key] = tm
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False)[0])
+            else:
+                self._sessions.move_to_end(key)
+        for old in evicted:
+            self._delete_rows(old)
+        return tm
+
+    def drop(self, session_id: Optional[str]):
+        key = session_id or "default"
+        with self._lock:
+            self._sessions.pop(key, None)
+        self._delete_rows(key)  # also when another worker created the session
+
+    def _delete_rows(self, key: str):
+        if self._conn is None:
+            return
+        with self._db_lock:
+            with self._conn:
+                for table in ("frontier_queue", "frontier_seen", "frontier_counts"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE session = ?", (key,))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,5 +1,34 @@
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
 def normalize_url(url: str) -> str:
-    return url.rstrip('/')
+    """
+    Canonical form used for dedupe: lower-case scheme/host, no default port,
+    no fragment, no trailing slash. Plain string ops (no urlsplit) since this
+    runs for every discovered link.
+    """
+    url = (url or "").strip().split("#", 1)[0]
+    i = url.find("://")
+    if i <= 0:
+        return url.rstrip('/')
+    scheme = url[:i].lower()
+    rest = url[i + 3:]
+    j = len(rest)
+    for sep in "/?":
+        k = rest.find(sep)
+        if k != -1 and k < j:
+            j = k
+    netloc, tail = rest[:j], rest[j:]
+    user, at, host = netloc.rpartition("@")
+    host = host.lower()
+    port = _DEFAULT_PORTS.get(scheme)
+    if port and host.endswith(port):
+        host = host[: -len(port)]
+    return f"{scheme}://{user}{at}{host}{tail}".rstrip('/')
+
+def url_host(url: str) -> str:
+    """Lower-cased host (without port or credentials) of an absolute URL."""
+    netloc = (url or "").partition("://")[2].split("/", 1)[0].split("?", 1)[0].split("#", 1)[0]
+    return netloc.rpartition("@")[2].split(":", 1)[0].lower()
 
 def make_css_selector_from_attrs(tag: str, attrs: dict) -> str:
     parts = [tag]